@@ -0,0 +1,58 @@
+"""
+Throughput of db_builder.build_database for an increasing number of workers.
+The speedup can only grow up to the number of CPUs available, printed first.
+
+    python benchmarks/bench_build.py --files 2000 --workers 1 2 4 8
+"""
+import argparse
+import os
+from pathlib import Path
+import tempfile
+import time
+
+from PIL import Image
+
+from fileexplorer.db_builder import build_database
+
+SUPPORTED_EXTENSIONS = ['.png', '.jpg', '.jpeg', '.gif', '.bmp', '.pdf', '.stl']
+
+def make_tree(root_dir: Path, n_files: int, files_per_dir: int=100):
+    for i in range(n_files):
+        subdir = root_dir / f'dir{i // files_per_dir}'
+        subdir.mkdir(exist_ok=True)
+        img = Image.new('RGB', size=(640, 480), color=(i % 256, (i // 256) % 256, 128))
+        img.save(subdir / f'image{i}.jpg')
+
+def time_build(root_dir: Path, instance_dir: Path, workers: int) -> float:
+    start = time.perf_counter()
+    build_database(
+        database_path=(instance_dir / 'files.db').as_posix(),
+        root_dir=root_dir,
+        resources_dir=instance_dir / 'resources',
+        supported_extensions=SUPPORTED_EXTENSIONS,
+        workers=workers,
+    )
+    return time.perf_counter() - start
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--files', type=int, default=1000)
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+    args = parser.parse_args()
+    cpus = len(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else os.cpu_count()
+    print(f'{cpus} CPUs available')
+    with tempfile.TemporaryDirectory() as tmp:
+        root_dir = Path(tmp) / 'root'
+        root_dir.mkdir()
+        make_tree(root_dir, args.files)
+        baseline = None
+        for workers in args.workers:
+            instance_dir = Path(tmp) / f'instance-{workers}'
+            instance_dir.mkdir()
+            elapsed = time_build(root_dir, instance_dir, workers)
+            rate = args.files / elapsed
+            baseline = baseline or rate
+            print(f'workers={workers:3d}  {elapsed:8.2f} s  {rate:8.1f} files/s  speedup={rate / baseline:5.2f}x')
+
+if __name__ == '__main__':
+    main()
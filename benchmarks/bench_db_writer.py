@@ -0,0 +1,46 @@
+"""
+Rows per second written by the per-row models.upsert_file versus
+models.DatabaseWriter.
+
+    python benchmarks/bench_db_writer.py --rows 20000
+"""
+import argparse
+from pathlib import Path
+import tempfile
+import time
+
+from fileexplorer import models
+from fileexplorer.models import DatabaseWriter, create_tables, upsert_file
+
+STAT_KEY = (1, 2, 3)
+
+def bench_per_row(n_rows: int) -> float:
+    start = time.perf_counter()
+    for i in range(n_rows):
+        upsert_file(f'/data/file{i}.png', 'image', STAT_KEY, f'{i:032x}.png', f'{i:032x}.png')
+    return time.perf_counter() - start
+
+def bench_writer(n_rows: int, batch_rows: int) -> float:
+    start = time.perf_counter()
+    with DatabaseWriter(batch_rows=batch_rows) as writer:
+        for i in range(n_rows):
+            writer.upsert_file(f'/data/file{i}.png', 'image', STAT_KEY, f'{i:032x}.png', f'{i:032x}.png')
+    return time.perf_counter() - start
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=5000)
+    parser.add_argument('--batch-rows', type=int, nargs='+', default=[100, 1000, 10000])
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as tmp:
+        runs = [('per-row', lambda: bench_per_row(args.rows))]
+        for batch_rows in args.batch_rows:
+            runs.append((f'writer batch_rows={batch_rows}', lambda b=batch_rows: bench_writer(args.rows, b)))
+        for i, (name, run) in enumerate(runs):
+            models.DATABASE_PATH = (Path(tmp) / f'files{i}.db').as_posix()
+            create_tables()
+            elapsed = run()
+            print(f'{name:28s} {args.rows / elapsed:10.0f} rows/s')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+"""
+Time of db_builder.build_database over a tree where the same drawings are
+copied in many project folders, with copies mapped to the thumbnail of
+the first one processed, compared with rendering every copy.
+
+    python benchmarks/bench_dedup.py --drawings 10 --copies 50 --workers 4
+"""
+import argparse
+from pathlib import Path
+import random
+import tempfile
+import time
+
+import fitz
+
+from fileexplorer import db_builder
+from fileexplorer.db_builder import build_database
+
+SUPPORTED_EXTENSIONS = ['.png', '.jpg', '.jpeg', '.gif', '.bmp', '.pdf', '.stl']
+
+def make_tree(root_dir: Path, n_drawings: int, n_copies: int, n_lines: int=2000):
+    rng = random.Random(0)
+    drawings = []
+    for i in range(n_drawings):
+        pdf = fitz.open()
+        page = pdf.new_page(width=1190, height=842)
+        shape = page.new_shape()
+        for _ in range(n_lines):
+            shape.draw_line(
+                (rng.uniform(0, page.rect.width), rng.uniform(0, page.rect.height)),
+                (rng.uniform(0, page.rect.width), rng.uniform(0, page.rect.height)),
+            )
+        shape.finish(width=0.5)
+        shape.commit()
+        drawings.append(pdf.tobytes())
+        pdf.close()
+    for project in range(n_copies):
+        project_dir = root_dir / f'project{project}'
+        project_dir.mkdir()
+        for i, drawing in enumerate(drawings):
+            (project_dir / f'drawing{i}.pdf').write_bytes(drawing)
+
+def time_build(root_dir: Path, instance_dir: Path, workers: int) -> tuple[float, db_builder.BuildStats]:
+    start = time.perf_counter()
+    stats = build_database(
+        database_path=(instance_dir / 'files.db').as_posix(),
+        root_dir=root_dir,
+        resources_dir=instance_dir / 'resources',
+        supported_extensions=SUPPORTED_EXTENSIONS,
+        workers=workers,
+    )
+    return time.perf_counter() - start, stats
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--drawings', type=int, default=10)
+    parser.add_argument('--copies', type=int, default=50)
+    parser.add_argument('--workers', type=int, default=4)
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as tmp:
+        root_dir = Path(tmp) / 'root'
+        root_dir.mkdir()
+        make_tree(root_dir, args.drawings, args.copies)
+        find_known_content = db_builder.find_known_content
+        for name, deduplicate in [('render every copy', False), ('deduplicated', True)]:
+            db_builder.find_known_content = find_known_content if deduplicate else lambda *args: None
+            instance_dir = Path(tmp) / f'instance-{deduplicate}'
+            instance_dir.mkdir()
+            elapsed, stats = time_build(root_dir, instance_dir, args.workers)
+            print(f'{name:18s} {elapsed:8.2f} s  {stats.files_processed / elapsed:8.1f} files/s  {stats}')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,111 @@
+"""
+Throughput of /api/file-data/ for a large data file with concurrent
+clients, downloading the whole file and reading it as ranges of
+--range-mb, from a threaded development server started here or from the
+server at --url (for instance behind nginx with X_ACCEL_REDIRECT).
+
+    python benchmarks/bench_file_data.py --size-mb 200 --clients 1 4 16
+"""
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+import http.client
+import os
+from pathlib import Path
+import tempfile
+import threading
+import time
+from urllib.parse import urlsplit
+
+from werkzeug.serving import WSGIRequestHandler, make_server
+
+from fileexplorer import create_app
+
+READ_SIZE = 1024 * 1024
+
+class QuietRequestHandler(WSGIRequestHandler):
+    def log_request(self, *args, **kwargs):
+        pass
+
+def make_data_file(tmp_dir: Path, size_mb: int) -> tuple[Path, Path, str]:
+    root_dir = tmp_dir / 'root'
+    root_dir.mkdir()
+    original = root_dir / 'large.stl'
+    with open(original, 'wb') as f:
+        for _ in range(size_mb):
+            f.write(os.urandom(1024 * 1024))
+    instance_dir = tmp_dir / 'instance'
+    files_dir = instance_dir / 'resources' / 'files'
+    files_dir.mkdir(parents=True)
+    # Data files are symlinks to the originals, as made by the builder
+    filename = 'large-data-file.stl'
+    (files_dir / filename).symlink_to(original)
+    # The root directory is left empty so nothing is built
+    return tmp_dir / 'empty', instance_dir, filename
+
+def download(connection: http.client.HTTPConnection, path: str, headers: dict) -> int:
+    connection.request('GET', path, headers=headers)
+    response = connection.getresponse()
+    if response.status not in (200, 206):
+        raise RuntimeError(f'{path}: status {response.status}')
+    n_bytes = 0
+    while chunk := response.read(READ_SIZE):
+        n_bytes += len(chunk)
+    return n_bytes
+
+def client(url: str, size: int, range_size: int|None, repeat: int) -> int:
+    parts = urlsplit(url)
+    connection = http.client.HTTPConnection(parts.hostname, parts.port)
+    n_bytes = 0
+    for _ in range(repeat):
+        if range_size is None:
+            n_bytes += download(connection, parts.path, {})
+            continue
+        for start in range(0, size, range_size):
+            end = min(start + range_size, size) - 1
+            n_bytes += download(connection, parts.path, {'Range': f'bytes={start}-{end}'})
+    connection.close()
+    return n_bytes
+
+def run(url: str, size: int, n_clients: int, range_size: int|None, repeat: int) -> float:
+    start = time.perf_counter()
+    with ThreadPoolExecutor(n_clients) as executor:
+        futures = [executor.submit(client, url, size, range_size, repeat) for _ in range(n_clients)]
+        n_bytes = sum(future.result() for future in futures)
+    return n_bytes / (time.perf_counter() - start) / 1e6
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--size-mb', type=int, default=200)
+    parser.add_argument('--clients', type=int, nargs='+', default=[1, 4, 16])
+    parser.add_argument('--range-mb', type=int, default=4)
+    parser.add_argument('--repeat', type=int, default=2)
+    parser.add_argument('--url', help='the file-data URL of a data file of --size-mb on a running server')
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as tmp:
+        server = None
+        url = args.url
+        size = args.size_mb * 1024 * 1024
+        if url is None:
+            root_dir, instance_dir, filename = make_data_file(Path(tmp), args.size_mb)
+            root_dir.mkdir()
+            app = create_app({
+                'TESTING': True,
+                'ROOT_DIR': root_dir.as_posix(),
+                'RESOURCES_DIR': (instance_dir / 'resources').as_posix(),
+                'DATABASE_PATH': (instance_dir / 'files.db').as_posix(),
+            })
+            server = make_server('127.0.0.1', 0, app, threaded=True, request_handler=QuietRequestHandler)
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+            url = f'http://127.0.0.1:{server.server_port}/api/file-data/{filename}'
+        for n_clients in args.clients:
+            whole = run(url, size, n_clients, None, args.repeat)
+            ranges = run(url, size, n_clients, args.range_mb * 1024 * 1024, args.repeat)
+            print(
+                f'clients={n_clients:3d}  whole file {whole:8.0f} MB/s  '
+                f'{args.range_mb} MB ranges {ranges:8.0f} MB/s'
+            )
+        if server is not None:
+            server.shutdown()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,55 @@
+"""
+Time to get the file info of every file in a large folder: one
+/api/file-info/ request per file versus a single
+/api/directory-info/?include=file_info request.
+
+    python benchmarks/bench_file_info.py --files 5000
+"""
+import argparse
+from io import BytesIO
+from pathlib import Path
+import tempfile
+import time
+
+from PIL import Image
+
+from fileexplorer import create_app
+
+def make_folder(root_dir: Path, n_files: int):
+    image_bytes_io = BytesIO()
+    Image.new('RGB', size=(32, 32), color=(255, 0, 0)).save(image_bytes_io, format='png')
+    image_bytes = image_bytes_io.getvalue()
+    for i in range(n_files):
+        (root_dir / f'image{i}.png').write_bytes(image_bytes)
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--files', type=int, default=2000)
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as tmp:
+        root_dir = Path(tmp) / 'root'
+        root_dir.mkdir()
+        make_folder(root_dir, args.files)
+        instance_dir = Path(tmp) / 'instance'
+        app = create_app({
+            'TESTING': True,
+            'ROOT_DIR': root_dir.as_posix(),
+            'RESOURCES_DIR': (instance_dir / 'resources').as_posix(),
+            'DATABASE_PATH': (instance_dir / 'files.db').as_posix(),
+        })
+        client = app.test_client()
+
+        start = time.perf_counter()
+        listing = client.get('/api/directory-info/').json
+        for file_data in listing['files']:
+            client.get(file_data['link'])
+        per_file = time.perf_counter() - start
+
+        start = time.perf_counter()
+        listing = client.get('/api/directory-info/?include=file_info').json
+        batched = time.perf_counter() - start
+        assert len(listing['files']) == args.files
+        print(f'files={args.files}  per-file requests {per_file:7.3f} s  include=file_info {batched:7.3f} s')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,59 @@
+"""
+Throughput and peak memory of hashing a large data file: reading it whole
+(the original make_symlink_data_file) versus proc.hash_file.  Each run is
+made in a fresh process so its peak RSS can be reported.
+
+    python benchmarks/bench_hash.py --size-mb 4096
+"""
+import argparse
+import hashlib
+import multiprocessing
+import os
+from pathlib import Path
+import resource
+import tempfile
+import time
+
+from fileexplorer.proc import XXHASH_ALGORITHMS, hash_file
+
+def read_whole(file_path: Path, algorithm: str) -> str:
+    with open(file_path, 'rb') as f:
+        return hashlib.new(algorithm, f.read()).hexdigest()
+
+def run(method, file_path: Path, algorithm: str, results: multiprocessing.Queue):
+    start = time.perf_counter()
+    method(file_path, algorithm)
+    elapsed = time.perf_counter() - start
+    results.put((elapsed, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss))
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--size-mb', type=int, default=1024)
+    args = parser.parse_args()
+    algorithms = ['md5', 'sha1', 'blake2b']
+    try:
+        import xxhash
+        algorithms.append(XXHASH_ALGORITHMS[2])
+    except ImportError:
+        pass
+    runs = [('read whole file', read_whole, 'md5')]
+    runs += [('hash_file', hash_file, algorithm) for algorithm in algorithms]
+    with tempfile.TemporaryDirectory() as tmp:
+        file_path = Path(tmp) / 'data.bin'
+        with open(file_path, 'wb') as f:
+            chunk = os.urandom(1024 * 1024)
+            for _ in range(args.size_mb):
+                f.write(chunk)
+        for name, method, algorithm in runs:
+            results = multiprocessing.Queue()
+            process = multiprocessing.Process(target=run, args=(method, file_path, algorithm, results))
+            process.start()
+            elapsed, max_rss_kb = results.get()
+            process.join()
+            print(
+                f'{name:16s} {algorithm:9s} {args.size_mb / elapsed:8.0f} MB/s  '
+                f'peak RSS {max_rss_kb / 1024:8.0f} MB'
+            )
+
+if __name__ == '__main__':
+    main()
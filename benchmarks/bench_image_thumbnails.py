@@ -0,0 +1,79 @@
+"""
+Thumbnails per second and peak RSS of ImageProcessor over a corpus of
+large JPEG, PNG, BMP and GIF files, compared with opening and shrinking
+the full image (the original make_thumbnail).  Each run is made in a
+fresh process so its peak RSS can be reported.
+
+    python benchmarks/bench_image_thumbnails.py --width 7360 --height 4912 --copies 5
+"""
+import argparse
+import multiprocessing
+from pathlib import Path
+import tempfile
+import time
+
+import numpy as np
+from PIL import Image
+
+from fileexplorer.image_proc import ImageProcessor
+
+THUMBNAIL_SIZE = (100, 100)
+FORMATS = ['jpeg', 'png', 'bmp', 'gif']
+
+def make_corpus(corpus_dir: Path, width: int, height: int, copies: int) -> dict[str, list[Path]]:
+    rng = np.random.default_rng(0)
+    x = np.linspace(0, 255, width, dtype=np.float32)
+    y = np.linspace(0, 255, height, dtype=np.float32)[:, None]
+    corpus = {}
+    for image_format in FORMATS:
+        corpus[image_format] = []
+        for i in range(copies):
+            noise = rng.normal(0, 8, size=(height, width)).astype(np.float32)
+            pixels = np.stack([x + noise + 0 * y, y + noise + 0 * x, (x + y) / 2 + noise], axis=-1)
+            image = Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8))
+            file_path = corpus_dir / f'image{i}.{image_format}'
+            image.save(file_path)
+            corpus[image_format].append(file_path)
+    return corpus
+
+def full_decode(file_path: Path, thumbnails_dir: Path):
+    ImageProcessor().write_thumbnail(Image.open(file_path), thumbnails_dir, THUMBNAIL_SIZE)
+
+def image_processor(file_path: Path, thumbnails_dir: Path):
+    ImageProcessor().make_thumbnail(file_path, thumbnails_dir, THUMBNAIL_SIZE)
+
+def peak_rss_kb() -> int:
+    # VmHWM, unlike ru_maxrss, is not carried over from the parent process
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith('VmHWM:'):
+                return int(line.split()[1])
+    return 0
+
+def run(method, file_paths: list[Path], thumbnails_dir: Path, results: multiprocessing.Queue):
+    start = time.perf_counter()
+    for file_path in file_paths:
+        method(file_path, thumbnails_dir)
+    elapsed = time.perf_counter() - start
+    results.put((len(file_paths) / elapsed, peak_rss_kb()))
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--width', type=int, default=6000)
+    parser.add_argument('--height', type=int, default=4000)
+    parser.add_argument('--copies', type=int, default=3)
+    args = parser.parse_args()
+    context = multiprocessing.get_context('spawn')
+    with tempfile.TemporaryDirectory() as tmp:
+        corpus = make_corpus(Path(tmp), args.width, args.height, args.copies)
+        for image_format, file_paths in corpus.items():
+            for name, method in [('full decode', full_decode), ('ImageProcessor', image_processor)]:
+                results = context.Queue()
+                process = context.Process(target=run, args=(method, file_paths, Path(tmp), results))
+                process.start()
+                rate, max_rss_kb = results.get()
+                process.join()
+                print(f'{image_format:5s} {name:15s} {rate:8.2f} thumbnails/s  peak RSS {max_rss_kb / 1024:7.0f} MB')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,59 @@
+"""
+Latency of a single file lookup (models.get_file_record) in a large
+files table, compared with a full scan of the original unindexed
+thumbnails table.
+
+    python benchmarks/bench_lookup.py --rows 1000000
+"""
+import argparse
+from pathlib import Path
+import random
+import sqlite3
+import tempfile
+import time
+
+from fileexplorer import models
+from fileexplorer.models import UPSERT_FILE_SQL, create_tables, get_file_record
+
+def populate(database_path: Path, n_rows: int):
+    conn = sqlite3.connect(database_path)
+    conn.execute('CREATE TABLE legacy_thumbnails (file_path STR, thumbnail_file STR)')
+    with conn:
+        conn.executemany(UPSERT_FILE_SQL, (
+            (f'/data/dir{i // 1000}/file{i}.png', 'image', 1, 2, i, 'ready', f'{i:032x}.png', f'{i:032x}.png')
+            for i in range(n_rows)
+        ))
+        conn.executemany('INSERT INTO legacy_thumbnails VALUES (?,?)', (
+            (f'/data/dir{i // 1000}/file{i}.png', f'{i:032x}.png')
+            for i in range(n_rows)
+        ))
+    conn.close()
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=1_000_000)
+    parser.add_argument('--lookups', type=int, default=10_000)
+    parser.add_argument('--legacy-lookups', type=int, default=20)
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as tmp:
+        database_path = Path(tmp) / 'files.db'
+        models.DATABASE_PATH = database_path.as_posix()
+        create_tables()
+        populate(database_path, args.rows)
+        paths = [f'/data/dir{i // 1000}/file{i}.png' for i in random.sample(range(args.rows), args.lookups)]
+
+        start = time.perf_counter()
+        for path in paths:
+            assert get_file_record(path) is not None
+        indexed = (time.perf_counter() - start) / args.lookups
+
+        conn = sqlite3.connect(database_path)
+        start = time.perf_counter()
+        for path in paths[:args.legacy_lookups]:
+            conn.execute('SELECT thumbnail_file FROM legacy_thumbnails WHERE file_path = ?', (path,)).fetchone()
+        legacy = (time.perf_counter() - start) / args.legacy_lookups
+        conn.close()
+        print(f'rows={args.rows}  indexed lookup {indexed * 1e6:9.1f} us  legacy full scan {legacy * 1e6:9.1f} us')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+"""
+Bytes the viewer downloads for an STL, as the original file and as each
+level of detail written by StlProcessor.make_data_file, with the time it
+takes to make them.
+
+    python benchmarks/bench_mesh_lods.py --triangles 100000 1000000 5000000
+"""
+import argparse
+from pathlib import Path
+import tempfile
+import time
+
+import numpy as np
+from stl.mesh import Mesh
+
+from fileexplorer.mesh import mesh_lod_filenames, read_mesh
+from fileexplorer.stl_proc import StlProcessor
+
+def make_sphere(file_path: Path, n_triangles: int):
+    """A bumpy UV sphere with about n_triangles triangles"""
+    rows = max(2, int(np.sqrt(n_triangles / 4)))
+    cols = max(3, n_triangles // (2 * rows))
+    theta = np.linspace(0, np.pi, rows + 1)[:, None]
+    phi = np.linspace(0, 2 * np.pi, cols + 1)[None, :]
+    radius = 1 + 0.05 * np.sin(8 * theta) * np.cos(6 * phi)
+    points = np.stack([
+        radius * np.sin(theta) * np.cos(phi),
+        radius * np.sin(theta) * np.sin(phi),
+        radius * np.cos(theta) * np.ones_like(phi),
+    ], axis=-1)
+    a = points[:-1, :-1].reshape(-1, 3)
+    b = points[1:, :-1].reshape(-1, 3)
+    c = points[1:, 1:].reshape(-1, 3)
+    d = points[:-1, 1:].reshape(-1, 3)
+    mesh = Mesh(np.zeros(2 * len(a), dtype=Mesh.dtype))
+    mesh.vectors[0::2] = np.stack([a, b, c], axis=1)
+    mesh.vectors[1::2] = np.stack([a, c, d], axis=1)
+    mesh.save(str(file_path))
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--triangles', type=int, nargs='+', default=[100_000, 1_000_000, 5_000_000])
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp = Path(tmp)
+        for n_triangles in args.triangles:
+            stl_path = tmp / f'mesh{n_triangles}.stl'
+            make_sphere(stl_path, n_triangles)
+            data_files_dir = tmp / f'files{n_triangles}'
+            data_files_dir.mkdir()
+            start = time.perf_counter()
+            data_filename = StlProcessor().make_data_file(stl_path, data_files_dir)
+            elapsed = time.perf_counter() - start
+            print(f'original STL  {stl_path.stat().st_size / 1e6:9.2f} MB  LODs made in {elapsed:.2f} s')
+            for budget, filename in mesh_lod_filenames(data_filename):
+                lod_path = data_files_dir / filename
+                if not lod_path.exists():
+                    continue
+                _, triangles = read_mesh(lod_path)
+                name = 'full' if budget is None else f'<= {budget}'
+                print(f'  {name:10s}  {lod_path.stat().st_size / 1e6:9.2f} MB  {len(triangles):9d} triangles')
+
+if __name__ == '__main__':
+    main()
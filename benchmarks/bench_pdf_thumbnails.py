@@ -0,0 +1,86 @@
+"""
+Time and peak RSS per PDF of PdfProcessor.make_thumbnail over a corpus of
+large-format drawings, compared with rendering the first page at 72 dpi
+and shrinking it (the original make_thumbnail).  Each run is made in a
+fresh process so its peak RSS can be reported.
+
+    python benchmarks/bench_pdf_thumbnails.py --page-size A0 --files 20
+"""
+import argparse
+import multiprocessing
+from pathlib import Path
+import random
+import tempfile
+import time
+
+import fitz
+from PIL import Image
+
+from fileexplorer.pdf_proc import PdfProcessor
+
+THUMBNAIL_SIZE = (100, 100)
+
+def make_corpus(corpus_dir: Path, page_size: str, n_files: int, n_lines: int) -> list[Path]:
+    rng = random.Random(0)
+    width, height = fitz.paper_size(page_size)
+    file_paths = []
+    for i in range(n_files):
+        pdf = fitz.open()
+        page = pdf.new_page(width=max(width, height), height=min(width, height))
+        shape = page.new_shape()
+        for _ in range(n_lines):
+            shape.draw_line(
+                (rng.uniform(0, page.rect.width), rng.uniform(0, page.rect.height)),
+                (rng.uniform(0, page.rect.width), rng.uniform(0, page.rect.height)),
+            )
+        shape.finish(width=0.5)
+        shape.commit()
+        file_path = corpus_dir / f'drawing{i}.pdf'
+        pdf.save(file_path)
+        pdf.close()
+        file_paths.append(file_path)
+    return file_paths
+
+def full_page(file_path: Path, thumbnails_dir: Path):
+    pdf = fitz.open(file_path)
+    pix = pdf.load_page(0).get_pixmap()
+    image = Image.frombytes("RGB", [pix.width, pix.height], pix.samples)
+    PdfProcessor().write_thumbnail(image, thumbnails_dir, THUMBNAIL_SIZE)
+
+def pdf_processor(file_path: Path, thumbnails_dir: Path):
+    PdfProcessor().make_thumbnail(file_path, thumbnails_dir, THUMBNAIL_SIZE)
+
+def peak_rss_kb() -> int:
+    # VmHWM, unlike ru_maxrss, is not carried over from the parent process
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith('VmHWM:'):
+                return int(line.split()[1])
+    return 0
+
+def run(method, file_paths: list[Path], thumbnails_dir: Path, results: multiprocessing.Queue):
+    start = time.perf_counter()
+    for file_path in file_paths:
+        method(file_path, thumbnails_dir)
+    elapsed = time.perf_counter() - start
+    results.put((elapsed / len(file_paths), peak_rss_kb()))
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--page-size', default='A0')
+    parser.add_argument('--files', type=int, default=20)
+    parser.add_argument('--lines', type=int, default=5000)
+    args = parser.parse_args()
+    context = multiprocessing.get_context('spawn')
+    with tempfile.TemporaryDirectory() as tmp:
+        file_paths = make_corpus(Path(tmp), args.page_size, args.files, args.lines)
+        for name, method in [('72 dpi page', full_page), ('PdfProcessor', pdf_processor)]:
+            results = context.Queue()
+            process = context.Process(target=run, args=(method, file_paths, Path(tmp), results))
+            process.start()
+            seconds, max_rss_kb = results.get()
+            process.join()
+            print(f'{name:13s} {seconds * 1000:8.1f} ms/PDF  peak RSS {max_rss_kb / 1024:7.0f} MB')
+
+if __name__ == '__main__':
+    main()
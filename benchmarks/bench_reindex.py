@@ -0,0 +1,55 @@
+"""
+Cold build versus warm restart of db_builder.build_database on an
+unchanged tree.
+
+    python benchmarks/bench_reindex.py --files 20000
+"""
+import argparse
+from io import BytesIO
+from pathlib import Path
+import tempfile
+import time
+
+from PIL import Image
+
+from fileexplorer.db_builder import build_database
+
+SUPPORTED_EXTENSIONS = ['.png', '.jpg', '.jpeg', '.gif', '.bmp', '.pdf', '.stl']
+
+def make_tree(root_dir: Path, n_files: int, files_per_dir: int=500):
+    image_bytes_io = BytesIO()
+    Image.new('RGB', size=(32, 32), color=(255, 0, 0)).save(image_bytes_io, format='png')
+    image_bytes = image_bytes_io.getvalue()
+    for i in range(n_files):
+        subdir = root_dir / f'dir{i // files_per_dir}'
+        subdir.mkdir(exist_ok=True)
+        (subdir / f'image{i}.png').write_bytes(image_bytes)
+
+def time_build(root_dir: Path, instance_dir: Path, workers: int) -> float:
+    start = time.perf_counter()
+    build_database(
+        database_path=(instance_dir / 'files.db').as_posix(),
+        root_dir=root_dir,
+        resources_dir=instance_dir / 'resources',
+        supported_extensions=SUPPORTED_EXTENSIONS,
+        workers=workers,
+    )
+    return time.perf_counter() - start
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--files', type=int, default=5000)
+    parser.add_argument('--workers', type=int, default=1)
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as tmp:
+        root_dir = Path(tmp) / 'root'
+        root_dir.mkdir()
+        make_tree(root_dir, args.files)
+        instance_dir = Path(tmp) / 'instance'
+        instance_dir.mkdir()
+        cold = time_build(root_dir, instance_dir, args.workers)
+        warm = time_build(root_dir, instance_dir, args.workers)
+        print(f'files={args.files}  cold build {cold:8.2f} s  warm restart {warm:8.2f} s')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+"""
+Cold start of a web worker: import time of fileexplorer (from
+python -X importtime) with its slowest imports, and the time and RSS to
+create the app and serve a first directory listing, compared with a
+worker that also imports the processors as it did before they were
+imported lazily.  Each run is made in a fresh interpreter.
+
+    python benchmarks/bench_startup.py --runs 5
+"""
+import argparse
+import collections
+from pathlib import Path
+import statistics
+import subprocess
+import sys
+import tempfile
+
+from PIL import Image
+
+START_WORKER = '''
+import sys, time
+start = time.perf_counter()
+from fileexplorer import create_app
+if sys.argv[3] == 'eager':
+    from fileexplorer.db_builder import get_processor_classes
+    get_processor_classes()
+imported = time.perf_counter()
+root_dir, instance_dir = sys.argv[1:3]
+app = create_app({
+    'TESTING': True,
+    'ROOT_DIR': root_dir,
+    'RESOURCES_DIR': instance_dir + '/resources',
+    'DATABASE_PATH': instance_dir + '/files.db',
+})
+app.test_client().get('/api/directory-info/', query_string={'include': 'file_info'})
+served = time.perf_counter()
+with open('/proc/self/status') as f:
+    rss_kb = next(int(line.split()[1]) for line in f if line.startswith('VmRSS:'))
+print(imported - start, served - start, rss_kb)
+'''
+
+def import_times() -> dict[str, int]:
+    """
+    Return the microseconds spent importing each package, its modules
+    included, when importing fileexplorer.
+    """
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', 'import fileexplorer'],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    times = collections.Counter()
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        self_time, _, module = line[len('import time:'):].split('|')
+        times[module.strip().split('.')[0]] += int(self_time)
+    return times
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--top', type=int, default=10)
+    args = parser.parse_args()
+    times = import_times()
+    print(f'import fileexplorer {sum(times.values()) / 1000:7.1f} ms, slowest packages:')
+    for package, package_time in times.most_common(args.top):
+        print(f'    {package_time / 1000:7.1f} ms  {package}')
+    with tempfile.TemporaryDirectory() as tmp:
+        root_dir = Path(tmp) / 'root'
+        root_dir.mkdir()
+        for i in range(10):
+            Image.new('RGB', size=(150, 150), color=(0, 0, 25 * i)).save(root_dir / f'image{i}.png')
+        for mode in ['lazy', 'eager']:
+            runs = []
+            for i in range(args.runs):
+                instance_dir = Path(tmp) / f'{mode}{i}'
+                result = subprocess.run(
+                    [sys.executable, '-c', START_WORKER, root_dir.as_posix(), instance_dir.as_posix(), mode],
+                    capture_output=True,
+                    text=True,
+                    check=True,
+                )
+                # The last line, PyMuPDF may print a warning first
+                runs.append([float(value) for value in result.stdout.splitlines()[-1].split()])
+            imported, served, rss_kb = (statistics.median(values) for values in zip(*runs))
+            print(
+                f'{mode:5s} processors  imports {imported * 1000:7.1f} ms  '
+                f'first listing {served * 1000:7.1f} ms  RSS {rss_kb / 1024:5.0f} MB'
+            )
+
+if __name__ == '__main__':
+    main()
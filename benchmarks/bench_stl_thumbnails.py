@@ -0,0 +1,106 @@
+"""
+Seconds per STL thumbnail of StlProcessor, which rasterizes the mesh with
+NumPy, compared with the original matplotlib renderer, over meshes from
+1k to 5M triangles.  The matplotlib renderer needs matplotlib, which is
+not a dependency of fileexplorer, and is skipped on meshes larger than
+--matplotlib-max-triangles since it takes minutes on them.
+
+    python benchmarks/bench_stl_thumbnails.py --triangles 1000 10000 100000 1000000 5000000
+"""
+import argparse
+from io import BytesIO
+from pathlib import Path
+import tempfile
+import time
+
+import numpy as np
+from PIL import Image
+from stl.mesh import Mesh
+
+from fileexplorer.stl_proc import StlProcessor
+
+THUMBNAIL_SIZE = (100, 100)
+
+def make_sphere(file_path: Path, n_triangles: int):
+    """A bumpy UV sphere with about n_triangles triangles"""
+    rows = max(2, int(np.sqrt(n_triangles / 4)))
+    cols = max(3, n_triangles // (2 * rows))
+    theta = np.linspace(0, np.pi, rows + 1)[:, None]
+    phi = np.linspace(0, 2 * np.pi, cols + 1)[None, :]
+    radius = 1 + 0.05 * np.sin(8 * theta) * np.cos(6 * phi)
+    points = np.stack([
+        radius * np.sin(theta) * np.cos(phi),
+        radius * np.sin(theta) * np.sin(phi),
+        radius * np.cos(theta) * np.ones_like(phi),
+    ], axis=-1)
+    a = points[:-1, :-1].reshape(-1, 3)
+    b = points[1:, :-1].reshape(-1, 3)
+    c = points[1:, 1:].reshape(-1, 3)
+    d = points[:-1, 1:].reshape(-1, 3)
+    mesh = Mesh(np.zeros(2 * len(a), dtype=Mesh.dtype))
+    mesh.vectors[0::2] = np.stack([a, b, c], axis=1)
+    mesh.vectors[1::2] = np.stack([a, c, d], axis=1)
+    mesh.save(str(file_path))
+    return len(mesh.vectors)
+
+def matplotlib_thumbnail(file_path: Path, thumbnails_dir: Path):
+    """The original StlProcessor.make_thumbnail"""
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    from mpl_toolkits.mplot3d.art3d import Poly3DCollection
+
+    mesh = Mesh.from_file(str(file_path))
+    figure = plt.figure()
+    axes = figure.add_subplot(111, projection='3d')
+    axes.add_collection3d(Poly3DCollection(mesh.vectors))
+    xmin, ymin, zmin = np.min(mesh.points.reshape(-1,3), axis=0)
+    xmax, ymax, zmax = np.max(mesh.points.reshape(-1,3), axis=0)
+    axes.set_xlim([xmin, xmax])
+    axes.set_ylim([ymin, ymax])
+    axes.set_zlim([zmin, zmax])
+    axes.set_box_aspect((xmax-xmin, ymax-ymin, zmax-zmin))
+    plt.axis('off')
+    buf = BytesIO()
+    plt.savefig(buf, format='png', bbox_inches='tight', pad_inches=0, transparent=True)
+    plt.close(figure)
+    buf.seek(0)
+    image = Image.open(buf)
+    data = np.asarray(image)
+    not_transparent = data[:,:,-1] > 0
+    cols = np.where(np.sum(not_transparent, axis=0) > 0)[0]
+    rows = np.where(np.sum(not_transparent, axis=1) > 0)[0]
+    image = image.crop((cols[0], rows[0], cols[-1] + 1, rows[-1] + 1))
+    StlProcessor().write_thumbnail(image, thumbnails_dir, THUMBNAIL_SIZE)
+
+def rasterizer_thumbnail(file_path: Path, thumbnails_dir: Path):
+    StlProcessor().make_thumbnail(file_path, thumbnails_dir, THUMBNAIL_SIZE)
+
+def time_once(method, file_path: Path, thumbnails_dir: Path) -> float:
+    start = time.perf_counter()
+    method(file_path, thumbnails_dir)
+    return time.perf_counter() - start
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--triangles', type=int, nargs='+',
+                        default=[1_000, 10_000, 100_000, 1_000_000, 5_000_000])
+    parser.add_argument('--matplotlib-max-triangles', type=int, default=1_000_000)
+    args = parser.parse_args()
+    try:
+        import matplotlib
+    except ImportError:
+        matplotlib = None
+    with tempfile.TemporaryDirectory() as tmp:
+        for n_triangles in args.triangles:
+            file_path = Path(tmp) / f'mesh{n_triangles}.stl'
+            n_triangles = make_sphere(file_path, n_triangles)
+            rasterizer = time_once(rasterizer_thumbnail, file_path, Path(tmp))
+            line = f'{n_triangles:9d} triangles  rasterizer {rasterizer:8.3f} s'
+            if matplotlib is not None and n_triangles <= args.matplotlib_max_triangles:
+                line += f'  matplotlib {time_once(matplotlib_thumbnail, file_path, Path(tmp)):8.3f} s'
+            print(line)
+            file_path.unlink()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+"""
+Bytes and encode time of thumbnails in each format, compared with PNG, over
+a sample corpus of photographs, PDF pages and STL renders.  Pass
+--corpus-dir to use your own files instead of the generated ones.
+
+    python benchmarks/bench_thumbnail_formats.py --sizes 100 256
+"""
+import argparse
+from pathlib import Path
+import random
+import tempfile
+import time
+
+import fitz
+import numpy as np
+from PIL import Image
+from stl.mesh import Mesh
+
+from fileexplorer.image_proc import ImageProcessor
+from fileexplorer.pdf_proc import PdfProcessor
+from fileexplorer.proc import THUMBNAIL_FORMAT_OPTIONS, encode_thumbnail, thumbnail_format_available
+from fileexplorer.stl_proc import StlProcessor
+
+def make_corpus(corpus_dir: Path, copies: int):
+    rng = np.random.default_rng(0)
+    for i in range(copies):
+        # Smooth shapes with sensor noise, like a photograph
+        x = np.linspace(0, 1, 1600, dtype=np.float32)
+        y = np.linspace(0, 1, 1200, dtype=np.float32)[:, None]
+        phase = rng.uniform(0, 6, size=3)
+        channels = [128 + 100 * np.sin(6 * x + 4 * y + p) * np.cos(5 * y - 3 * x + p) for p in phase]
+        pixels = np.stack(channels, axis=-1) + rng.normal(0, 6, size=(1200, 1600, 3))
+        Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8)).save(corpus_dir / f'photo{i}.jpg', quality=90)
+
+        pdf = fitz.open()
+        page = pdf.new_page()
+        text_rng = random.Random(i)
+        for line in range(40):
+            words = ' '.join(''.join(text_rng.choices('abcdefghij', k=text_rng.randint(2, 8))) for _ in range(10))
+            page.insert_text((50, 60 + 17 * line), words, fontsize=10)
+        page.draw_rect(fitz.Rect(300, 500, 550, 750), color=(0.8, 0.1, 0.1), fill=(0.9, 0.9, 0.3))
+        pdf.save(corpus_dir / f'document{i}.pdf')
+        pdf.close()
+
+        theta = np.linspace(0, np.pi, 101)[:, None]
+        phi = np.linspace(0, 2 * np.pi, 201)[None, :]
+        radius = 1 + 0.1 * np.sin((4 + i) * theta) * np.cos(5 * phi)
+        points = np.stack([
+            radius * np.sin(theta) * np.cos(phi),
+            radius * np.sin(theta) * np.sin(phi),
+            radius * np.cos(theta) * np.ones_like(phi),
+        ], axis=-1)
+        a, b = points[:-1, :-1].reshape(-1, 3), points[1:, :-1].reshape(-1, 3)
+        c, d = points[1:, 1:].reshape(-1, 3), points[:-1, 1:].reshape(-1, 3)
+        mesh = Mesh(np.zeros(2 * len(a), dtype=Mesh.dtype))
+        mesh.vectors[0::2] = np.stack([a, b, c], axis=1)
+        mesh.vectors[1::2] = np.stack([a, c, d], axis=1)
+        mesh.save(str(corpus_dir / f'part{i}.stl'))
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--corpus-dir', type=Path)
+    parser.add_argument('--copies', type=int, default=5)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100, 256])
+    args = parser.parse_args()
+    thumbnail_formats = ['png'] + [f for f in THUMBNAIL_FORMAT_OPTIONS if thumbnail_format_available(f)]
+    processors = [ImageProcessor(), PdfProcessor(), StlProcessor()]
+    with tempfile.TemporaryDirectory() as tmp:
+        corpus_dir = args.corpus_dir
+        if corpus_dir is None:
+            corpus_dir = Path(tmp)
+            make_corpus(corpus_dir, args.copies)
+        for processor in processors:
+            file_paths = sorted(p for p in corpus_dir.rglob('*') if processor.can_process_file(p))
+            if not file_paths:
+                continue
+            for size in args.sizes:
+                images = []
+                for file_path in file_paths:
+                    image = processor.open_thumbnail_image(file_path, (size, size))
+                    image.thumbnail((size, size))
+                    images.append(image)
+                totals = {}
+                for thumbnail_format in thumbnail_formats:
+                    start = time.perf_counter()
+                    n_bytes = sum(len(encode_thumbnail(image, thumbnail_format)) for image in images)
+                    totals[thumbnail_format] = (n_bytes, (time.perf_counter() - start) / len(images))
+                png_bytes = totals['png'][0]
+                for thumbnail_format, (n_bytes, seconds) in totals.items():
+                    print(
+                        f'{processor.file_type:5s} {size:4d}px {thumbnail_format:5s} '
+                        f'{n_bytes / len(images) / 1024:8.1f} KiB/thumbnail '
+                        f'{100 * (1 - n_bytes / png_bytes):6.1f}% saved '
+                        f'{seconds * 1000:7.2f} ms to encode'
+                    )
+
+if __name__ == '__main__':
+    main()
@@ -14,32 +14,38 @@ function convertSize(size) {
   return `${Math.round(size)} ${suffixes[suffixIdx]}`;
 }
 
-const FileRow = ({ fileInfoUrl, setCanvasInfo }) => {
-  const [fileInfo, setFileInfo] = useState({
-    relpath: "",
-    name: "",
-    st_size: "",
-    file_type: "",
-    thumbnail_url: "",
-    file_data_url: "",
-  });
-
-  useEffect(() => {
-    axios
-      .get(fileInfoUrl)
-      .then((response) => {
-        setFileInfo(response.data);
-      })
-      .catch((error) =>
-        console.error(`Error fetching file details from ${fileInfoUrl}:`, error)
-      );
-  }, [fileInfoUrl]);
+// Fetch the thumbnails of every file in a directory in one request, and
+// return the object URLs of those received by file name
+function fetchDirectoryThumbnails(currentPath, signal) {
+  // fetch() sends Accept: */*, which only gets PNG thumbnails
+  return fetch(`/api/directory-thumbnails/${currentPath}`, {
+    signal,
+    headers: { Accept: "image/avif,image/webp,*/*" },
+  })
+    .then((response) => {
+      if (!response.ok) {
+        throw new Error(`Status ${response.status}`);
+      }
+      return response.formData();
+    })
+    .then((formData) => {
+      const thumbnailUrls = {};
+      for (const [name, value] of formData.entries()) {
+        if (value instanceof Blob) {
+          thumbnailUrls[decodeURIComponent(name)] = URL.createObjectURL(value);
+        }
+      }
+      return thumbnailUrls;
+    });
+}
 
-  const handleImageClick = (dataUrl, fileType) => {
+const FileRow = ({ fileInfo, thumbnailUrl, setCanvasInfo }) => {
+  const handleImageClick = (dataUrl, fileType, meshLodUrls) => {
     setCanvasInfo({
       show: true,
       dataUrl: dataUrl,
       fileType: fileType,
+      meshLodUrls: meshLodUrls,
     });
   };
 
@@ -56,10 +62,19 @@ const FileRow = ({ fileInfoUrl, setCanvasInfo }) => {
       <td>
         {fileInfo.thumbnail_url ? (
           <img
-            src={fileInfo.thumbnail_url}
+            src={thumbnailUrl || fileInfo.thumbnail_url}
+            srcSet={
+              thumbnailUrl
+                ? undefined
+                : `${fileInfo.thumbnail_url} 1x, ${fileInfo.thumbnail_url}?size=200 2x`
+            }
             alt="Thumbnail"
             onClick={() =>
-              handleImageClick(fileInfo.file_data_url, fileInfo.file_type)
+              handleImageClick(
+                fileInfo.file_data_url,
+                fileInfo.file_type,
+                fileInfo.mesh_lod_urls
+              )
             }
             className="img-preview"
           />
@@ -91,12 +106,35 @@ const DirectoryContents = ({ currentPath, setCanvasInfo }) => {
   });
   useEffect(() => {
     axios
-      .get(`/api/directory-info/${currentPath}`)
+      .get(`/api/directory-info/${currentPath}`, {
+        params: { include: "file_info" },
+      })
       .then((response) => {
         setDirectoryInfo(response.data);
       })
       .catch((error) => console.error("Error fetching data:", error));
   }, [currentPath]);
+  const [thumbnailUrls, setThumbnailUrls] = useState({});
+  useEffect(() => {
+    const controller = new AbortController();
+    let urls = {};
+    fetchDirectoryThumbnails(currentPath, controller.signal)
+      .then((received) => {
+        urls = received;
+        setThumbnailUrls(received);
+      })
+      .catch((error) => {
+        // Rows fall back to requesting their own thumbnail
+        if (error.name !== "AbortError") {
+          console.error("Error fetching thumbnails:", error);
+        }
+      });
+    return () => {
+      controller.abort();
+      Object.values(urls).forEach((url) => URL.revokeObjectURL(url));
+      setThumbnailUrls({});
+    };
+  }, [currentPath]);
 
   return (
     <div className="table-container left-side">
@@ -116,13 +154,16 @@ const DirectoryContents = ({ currentPath, setCanvasInfo }) => {
               relpath={info.relpath}
             />
           ))}
-          {directoryInfo["files"].map((info) => (
-            <FileRow
-              key={info.name}
-              fileInfoUrl={info.link}
-              setCanvasInfo={setCanvasInfo}
-            />
-          ))}
+          {directoryInfo["files"]
+            .filter((info) => info.file_info)
+            .map((info) => (
+              <FileRow
+                key={info.name}
+                fileInfo={info.file_info}
+                thumbnailUrl={thumbnailUrls[info.name]}
+                setCanvasInfo={setCanvasInfo}
+              />
+            ))}
         </tbody>
       </table>
     </div>
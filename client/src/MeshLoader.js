@@ -0,0 +1,57 @@
+import * as THREE from "three";
+
+// Loads the indexed meshes made by fileexplorer.mesh, see its docstring
+// for the layout
+const MESH_MAGIC = "FEMESH1\0";
+const HEADER_SIZE = 40;
+
+class MeshLoader extends THREE.Loader {
+  load(url, onLoad, onProgress, onError) {
+    const loader = new THREE.FileLoader(this.manager);
+    loader.setPath(this.path);
+    loader.setResponseType("arraybuffer");
+    loader.setRequestHeader(this.requestHeader);
+    loader.setWithCredentials(this.withCredentials);
+    loader.load(
+      url,
+      (buffer) => {
+        try {
+          onLoad(this.parse(buffer));
+        } catch (error) {
+          if (onError) onError(error);
+          else console.error(error);
+          this.manager.itemError(url);
+        }
+      },
+      onProgress,
+      onError
+    );
+  }
+
+  parse(buffer) {
+    const view = new DataView(buffer);
+    const magic = new TextDecoder().decode(new Uint8Array(buffer, 0, 8));
+    if (magic !== MESH_MAGIC) throw new Error("Not a mesh file");
+    const vertexCount = view.getUint32(8, true);
+    const triangleCount = view.getUint32(12, true);
+    const origin = [0, 1, 2].map((i) => view.getFloat32(16 + 4 * i, true));
+    const scale = [0, 1, 2].map((i) => view.getFloat32(28 + 4 * i, true));
+
+    const quantized = new Uint16Array(buffer, HEADER_SIZE, vertexCount * 3);
+    const positions = new Float32Array(vertexCount * 3);
+    for (let i = 0; i < positions.length; i++) {
+      positions[i] = origin[i % 3] + scale[i % 3] * quantized[i];
+    }
+    let offset = HEADER_SIZE + quantized.byteLength;
+    offset += (4 - (offset % 4)) % 4;
+    const indices = new Uint32Array(buffer, offset, triangleCount * 3);
+
+    const geometry = new THREE.BufferGeometry();
+    geometry.setAttribute("position", new THREE.BufferAttribute(positions, 3));
+    geometry.setIndex(new THREE.BufferAttribute(indices, 1));
+    geometry.computeVertexNormals();
+    return geometry;
+  }
+}
+
+export default MeshLoader;
@@ -1,13 +1,14 @@
-import React, { useEffect, useRef, useState } from "react";
+import React, { Suspense, useEffect, useRef, useState } from "react";
 import { Canvas, useLoader } from "@react-three/fiber";
 import { PerspectiveCamera, TrackballControls } from "@react-three/drei";
 import * as THREE from "three";
 import { STLLoader } from "three/examples/jsm/loaders/STLLoader";
+import MeshLoader from "./MeshLoader";
 import "./StlCanvas.css";
 
-const Model = ({ url, meshRef, onGeometryLoad }) => {
+const Model = ({ url, loader, meshRef, onGeometryLoad }) => {
   console.log(`url = ${url}`);
-  const geometry = useLoader(STLLoader, url);
+  const geometry = useLoader(loader, url);
 
   useEffect(() => {
     if (meshRef.current) onGeometryLoad(true);
@@ -65,7 +66,9 @@ const ControlsSetup = ({
   return null;
 };
 
-const StlViewer = ({ dataUrl }) => {
+// With levels of detail, the coarsest mesh is shown while the full
+// resolution one loads.  Otherwise the original STL is loaded.
+const StlViewer = ({ dataUrl, meshLodUrls }) => {
   const meshRef = useRef();
   const controlsRef = useRef();
   const [isModelLoaded, setModelLoaded] = useState(false);
@@ -87,11 +90,25 @@ const StlViewer = ({ dataUrl }) => {
   return (
     <div className="stl-canvas">
       <Canvas style={{ position: "absolute" }}>
-        <Model
-          url={dataUrl}
-          meshRef={meshRef}
-          onGeometryLoad={setModelLoaded}
-        />
+        <Suspense
+          fallback={
+            meshLodUrls && meshLodUrls.length > 1 ? (
+              <Model
+                url={meshLodUrls[0]}
+                loader={MeshLoader}
+                meshRef={meshRef}
+                onGeometryLoad={setModelLoaded}
+              />
+            ) : null
+          }
+        >
+          <Model
+            url={meshLodUrls ? meshLodUrls[meshLodUrls.length - 1] : dataUrl}
+            loader={meshLodUrls ? MeshLoader : STLLoader}
+            meshRef={meshRef}
+            onGeometryLoad={setModelLoaded}
+          />
+        </Suspense>
         <PerspectiveCamera makeDefault={true} />
         <TrackballControls ref={controlsRef} />
         <ControlsSetup
@@ -23,7 +23,12 @@ const VisCanvas = ({ canvasInfo }) => {
   } else if (canvasInfo.fileType === "pdf") {
     content = <PdfCanvas dataUrl={canvasInfo.dataUrl} />;
   } else if (canvasInfo.fileType === "stl") {
-    content = <StlCanvas dataUrl={canvasInfo.dataUrl} />;
+    content = (
+      <StlCanvas
+        dataUrl={canvasInfo.dataUrl}
+        meshLodUrls={canvasInfo.meshLodUrls}
+      />
+    );
   } else {
     content = canvasInfo.dataUrl;
   }
@@ -1,8 +1,13 @@
+from pathlib import Path
+
 from flask import Flask
 
+from fileexplorer.listing_cache import DirectoryListingCache
 from fileexplorer.routes import api
-from fileexplorer.models import init_database
+from fileexplorer.models import ThumbnailAccessLog, init_database
 from fileexplorer.db_builder import build_database_async
+from fileexplorer.registry import get_supported_extensions
+from fileexplorer.thumbnail_pack import ThumbnailPack
 
 def create_app(test_config=None):
     app = Flask(__name__)
@@ -10,10 +15,29 @@ def create_app(test_config=None):
         app.config.update(test_config)
     else:
         app.config.from_prefixed_env(prefix='FILEEXPLORER')
-    app.config['SUPPORTED_EXTENSIONS'] = ['.png', '.jpg', '.jpeg', '.gif', '.bmp', '.pdf', '.stl']
+    app.config['SUPPORTED_EXTENSIONS'] = get_supported_extensions()
     app.register_blueprint(api, url_prefix='/api')
+    listing_cache_size = int(app.config.get('DIRECTORY_CACHE_SIZE', 1024))
+    if listing_cache_size > 0:
+        app.extensions['fileexplorer_listing_cache'] = DirectoryListingCache(
+            max_directories=listing_cache_size,
+            max_entries=int(app.config.get('DIRECTORY_CACHE_MAX_ENTRIES', 10_000)),
+            use_inotify=bool(app.config.get('DIRECTORY_CACHE_INOTIFY', False)),
+        )
+    if app.config.get('THUMBNAIL_PACK', False):
+        resources_dir = Path(app.config['RESOURCES_DIR'])
+        resources_dir.mkdir(parents=True, exist_ok=True)
+        app.extensions['fileexplorer_thumbnail_pack'] = ThumbnailPack(resources_dir)
+    if int(app.config.get('THUMBNAIL_BUDGET', 0)) > 0:
+        app.extensions['fileexplorer_thumbnail_accesses'] = ThumbnailAccessLog(
+            flush_interval=float(app.config.get('THUMBNAIL_ACCESS_FLUSH_INTERVAL', 10.0)),
+        )
     init_database(app)
     testing = app.config.get('TESTING', False)
     build_database_async(app, testing)
+    # Not imported with the package, so python -m fileexplorer.resource_gc
+    # runs the module only once
+    from fileexplorer.resource_gc import collect_garbage_async
+    collect_garbage_async(app)
 
     return app
@@ -1,19 +1,141 @@
+import atexit
+from collections import OrderedDict
+from collections.abc import Callable, Iterable, Iterator, Mapping
+from dataclasses import dataclass
+import logging
 import multiprocessing
+import os
 from pathlib import Path
+import stat
+import threading
+import time
+from typing import TYPE_CHECKING, NamedTuple
 
 from flask import Flask
 
 from fileexplorer import models
 from fileexplorer.models import (
+    DatabaseWriter,
     create_tables,
-    insert_thumbnail,
-    insert_data_file,
+    file_stat_key,
+    find_content,
+    get_file_record,
+    get_file_records,
+    get_files_to_retry,
+    get_indexed_files,
+    normalize_path,
+    normalize_paths,
+    pop_requested_paths,
+    upsert_file,
 )
-from fileexplorer.image_proc import ImageProcessor
-from fileexplorer.pdf_proc import PdfProcessor
-from fileexplorer.stl_proc import StlProcessor
+from fileexplorer.registry import (
+    DATA_FILE,
+    THUMBNAIL,
+    ProcessorSpec,
+    get_extension_map,
+    load_processor_class,
+)
+from fileexplorer.supervisor import WorkerSupervisor
+from fileexplorer.thumbnail_pack import ThumbnailPack
+from fileexplorer.watcher import CHANGED, DELETED, WatchEvent, make_watcher, watch_for_changes
+
+if TYPE_CHECKING:
+    from fileexplorer.proc import ProcessorTemplate
 
 THUMBNAIL_SIZE = (100, 100)
+# Sizes of the thumbnail variants that can be requested, and the ones made
+# during the build; the others are made when they are first requested
+THUMBNAIL_SIZES = (64, 128, 256, 512)
+THUMBNAIL_BUILD_SIZES = (64, 128, 256)
+# Formats every thumbnail is also encoded in, see proc.THUMBNAIL_FORMAT_OPTIONS
+THUMBNAIL_FORMATS = ('webp',)
+# Cost of the files handed to a worker per task, in images (see
+# ProcessorSpec.cost), and number of tasks in flight per worker, when
+# building with worker processes
+BATCH_SIZE = 16
+TASKS_PER_WORKER = 4
+# Seconds a worker may spend on a file before it is killed, when building
+# with worker processes
+PROCESSING_TIMEOUT = 300.0
+# Times a file is processed in a row before it is given up on until it
+# changes, and seconds before the first retry, doubled for each next one
+PROCESSING_ATTEMPTS = 3
+RETRY_BACKOFF = 60.0
+# Seconds between checks for the files the web server wants processed first
+PRIORITY_POLL_INTERVAL = 0.25
+# Number of contents each process remembers having processed, so copies
+# processed before the database writer commits are deduplicated too
+KNOWN_CONTENT_CACHE_SIZE = 10000
+
+logger = logging.getLogger(__name__)
+
+# Processors owned by the current process, with their spec, by extension.
+# Worker processes create them once in init_worker and reuse them for
+# every file they are given.
+_processors: dict[str, tuple[ProcessorSpec, 'ProcessorTemplate']] | None = None
+# Processors shared by the request threads of the web server, by
+# (hash_algorithm, thumbnail_formats, thumbnail_pack_dir).  Each is made
+# once and kept for the life of the process, since any thread may be
+# using it.
+_on_demand_processors: dict[tuple, dict[str, tuple[ProcessorSpec, 'ProcessorTemplate']]] = {}
+_on_demand_processors_lock = threading.Lock()
+# (thumbnail_file, data_file) by (content_hash, file_type), the most
+# recently processed last
+_known_content: OrderedDict[tuple[str, str], tuple[str, str | None]] = OrderedDict()
+# Also used by the request threads of the web server
+_known_content_lock = threading.Lock()
+
+class ProcessingResult(NamedTuple):
+    file_path: Path
+    stat_key: tuple[int, int, int] | None
+    file_type: str | None
+    thumbnail_filename: str | None
+    data_filename: str | None
+    content_hash: str | None = None
+    # Whether the thumbnail of a file with the same content was reused
+    deduplicated: bool = False
+    # Why no thumbnail was made, and seconds spent processing the file
+    error: str | None = None
+    duration: float | None = None
+
+class RetryPolicy(NamedTuple):
+    """When the files that could not be processed are processed again"""
+    max_attempts: int = PROCESSING_ATTEMPTS
+    backoff: float = RETRY_BACKOFF
+
+    def retry_at(self, attempts: int, now: float) -> float | None:
+        """When to try again a file that failed attempts times in a row, if ever"""
+        if attempts >= self.max_attempts:
+            return None
+        return now + self.backoff * 2 ** (attempts - 1)
+
+@dataclass
+class BuildStats:
+    """What a build processed, logged at the end of its walk"""
+    files_processed: int = 0
+    files_deduplicated: int = 0
+    bytes_deduplicated: int = 0
+
+    def add(self, result: ProcessingResult):
+        if result.stat_key is None:
+            return
+        self.files_processed += 1
+        if result.deduplicated:
+            self.files_deduplicated += 1
+            self.bytes_deduplicated += result.stat_key[1]
+
+    def __str__(self) -> str:
+        return (
+            f'{self.files_processed} files processed, {self.files_deduplicated} '
+            f'({self.bytes_deduplicated / 1e6:.1f} MB) deduplicated'
+        )
+
+def get_retry_policy(config: Mapping) -> RetryPolicy:
+    """The RetryPolicy set by PROCESSING_ATTEMPTS and RETRY_BACKOFF in config"""
+    return RetryPolicy(
+        int(config.get("PROCESSING_ATTEMPTS", PROCESSING_ATTEMPTS)),
+        float(config.get("RETRY_BACKOFF", RETRY_BACKOFF)),
+    )
 
 def build_database_async(app: Flask, testing: bool=False):
     database_path = app.config["DATABASE_PATH"]
@@ -21,14 +143,35 @@ def build_database_async(app: Flask, testing: bool=False):
     resources_dir = Path(app.config["RESOURCES_DIR"])
     supported_extensions = app.config["SUPPORTED_EXTENSIONS"]
     build_args = (database_path, root_dir, resources_dir, supported_extensions)
-    if testing:
-        done_flag = multiprocessing.Event()
-        build_args += (done_flag,)
+    done_flag = multiprocessing.Event() if testing else None
+    watch = bool(app.config.get("WATCH", False))
+    build_kwargs = {
+        "done_flag": done_flag,
+        "workers": int(app.config.get("BUILD_WORKERS", os.cpu_count() or 1)),
+        "batch_rows": int(app.config.get("DATABASE_BATCH_ROWS", 1000)),
+        "batch_ms": int(app.config.get("DATABASE_BATCH_MS", 1000)),
+        "watch": watch,
+        "watch_mode": app.config.get("WATCH_MODE", "auto"),
+        "poll_interval": float(app.config.get("WATCH_POLL_INTERVAL", 10.0)),
+        "debounce": float(app.config.get("WATCH_DEBOUNCE", 0.5)),
+        "hash_algorithm": app.config.get("HASH_ALGORITHM", "md5"),
+        "thumbnail_sizes": tuple(app.config.get("THUMBNAIL_BUILD_SIZES", THUMBNAIL_BUILD_SIZES)),
+        "thumbnail_formats": tuple(app.config.get("THUMBNAIL_FORMATS", THUMBNAIL_FORMATS)),
+        "thumbnail_pack": bool(app.config.get("THUMBNAIL_PACK", False)),
+        "timeout": float(app.config.get("PROCESSING_TIMEOUT", PROCESSING_TIMEOUT)),
+        "memory_limit": int(app.config.get("WORKER_MEMORY_LIMIT", 0)),
+        "retry_policy": get_retry_policy(app.config),
+    }
     worker = multiprocessing.Process(
         target=build_database,
         args=build_args,
+        kwargs=build_kwargs,
     )
     worker.start()
+    if watch:
+        # The watcher never returns, so stop it before multiprocessing
+        # tries to join it when this process exits
+        atexit.register(worker.terminate)
     if testing:
         done_flag.wait()
 
@@ -37,44 +180,669 @@ def build_database(
     root_dir: Path,
     resources_dir: Path,
     supported_extensions: list[str],
-    done_flag: multiprocessing.Event=None
-):
+    done_flag: multiprocessing.Event=None,
+    workers: int=1,
+    batch_rows: int=1000,
+    batch_ms: int=1000,
+    watch: bool=False,
+    watch_mode: str="auto",
+    poll_interval: float=10.0,
+    debounce: float=0.5,
+    hash_algorithm: str="md5",
+    thumbnail_sizes: tuple[int, ...]=(),
+    thumbnail_formats: tuple[str, ...]=(),
+    thumbnail_pack: bool=False,
+    timeout: float=0,
+    memory_limit: int=0,
+    retry_policy: RetryPolicy=RetryPolicy(),
+) -> BuildStats:
+    """
+    Walk root_dir, make thumbnails and data files for every new or changed
+    supported file and record them in the database.
+
+    The database is persistent: a file whose (mtime, size, inode) matches
+    its indexed stat key is skipped, and entries for files that no longer
+    exist are purged at the end of the walk.
+
+    With workers > 1, a timeout or a memory_limit, the files are processed
+    by worker processes (see fileexplorer.supervisor) and the results are
+    funneled back to this process, which is the only one writing to the
+    database.  A worker that spends more than timeout seconds on a file is
+    killed and replaced, and allocations fail in the workers past
+    memory_limit bytes of address space.  Rows are committed in batches
+    of batch_rows rows or batch_ms milliseconds.
+
+    A file that could not be processed is recorded with the error, and is
+    processed again after the walk, or while watching, when retry_policy
+    says so.
+
+    With watch, root_dir is then watched (see fileexplorer.watcher) and
+    changed files are processed as they settle, until the process that
+    started the build exits.  The watcher is started before the walk so
+    nothing changed during the walk is missed.
+
+    Files and directories requested by the web server are processed
+    before the rest of the walk, see prioritize_requested_files.
+
+    Data files are named after the hash_algorithm digest of their content.
+    A variant of every thumbnail is made for each of thumbnail_sizes, and
+    each is also encoded in each of thumbnail_formats.  With thumbnail_pack
+    they are all saved in a ThumbnailPack in resources_dir rather than as
+    files in its thumbnails directory.
+
+    Files are also indexed by the digest of their content, and a copy of a
+    file already processed reuses its thumbnail and data file rather than
+    being rendered again.  The BuildStats of the walk are logged and, unless
+    watching, returned.
+    """
     models.DATABASE_PATH = database_path
     create_tables()
     make_resources_directories(resources_dir)
-    processors = [ImageProcessor(), PdfProcessor(), StlProcessor()]
-    for file_path in Path(root_dir).rglob("*"):
-        if not file_path.is_file():
+    parent_pid = os.getppid()
+    watcher = make_watcher(root_dir, watch_mode, poll_interval) if watch else None
+    # Imported before the workers fork, so they share them
+    get_processor_classes()
+    thumbnail_pack_dir = resources_dir if thumbnail_pack else None
+    worker_args = (hash_algorithm, thumbnail_sizes, thumbnail_formats, thumbnail_pack_dir)
+    pool = None
+    if workers > 1 or timeout > 0 or memory_limit > 0:
+        pool = WorkerSupervisor(
+            workers,
+            process_task,
+            failed_task_result,
+            initializer=init_worker,
+            initargs=worker_args,
+            timeout=timeout if timeout > 0 else None,
+            memory_limit=memory_limit,
+            tasks_per_worker=TASKS_PER_WORKER,
+        )
+    else:
+        init_worker(*worker_args)
+    stats = BuildStats()
+    try:
+        with DatabaseWriter(batch_rows, batch_ms) as writer:
+            indexed_files = get_indexed_files()
+            file_paths = prioritize_requested_files(
+                iter_changed_files(root_dir, supported_extensions, indexed_files),
+                root_dir,
+                supported_extensions,
+            )
+            # Results are committed within batch_ms even while slow files
+            # hold up the next ones
+            for result in process_files(pool, file_paths, resources_dir, writer.flush_if_due):
+                record_result(writer, result, retry_policy)
+                stats.add(result)
+            # Whatever was not seen during the walk has been deleted or moved
+            writer.delete_files(list(indexed_files))
+            writer.flush()
+            for result in retry_failed_files(writer, pool, resources_dir, retry_policy):
+                stats.add(result)
+            logger.info('Built the database of %s: %s', root_dir, stats)
+            if done_flag:
+                done_flag.set()
+            if watcher is None:
+                return stats
+            def handle_events(events: list[WatchEvent]):
+                apply_changes(writer, pool, events, resources_dir, supported_extensions, retry_policy)
+                writer.flush()
+            def retry_due_files():
+                for _ in retry_failed_files(writer, pool, resources_dir, retry_policy):
+                    pass
+            watch_for_changes(
+                watcher,
+                handle_events,
+                debounce=debounce,
+                should_stop=lambda: os.getppid() != parent_pid,
+                on_tick=retry_due_files,
+            )
+    finally:
+        if watcher is not None:
+            watcher.close()
+        if pool is not None:
+            pool.close()
+
+def retry_failed_files(
+    writer: DatabaseWriter,
+    pool: WorkerSupervisor | None,
+    resources_dir: Path,
+    retry_policy: RetryPolicy,
+) -> Iterator[ProcessingResult]:
+    """Process again the files due to be retried, yielding the results once recorded"""
+    file_paths = [Path(file_path) for file_path in get_files_to_retry(time.time())]
+    if not file_paths:
+        return
+    for result in process_files(pool, file_paths, resources_dir, writer.flush_if_due):
+        record_result(writer, result, retry_policy)
+        yield result
+    # So they are not found due again
+    writer.flush()
+
+def apply_changes(
+    writer: DatabaseWriter,
+    pool: WorkerSupervisor | None,
+    events: list[WatchEvent],
+    resources_dir: Path,
+    supported_extensions: list[str],
+    retry_policy: RetryPolicy=RetryPolicy(),
+):
+    """
+    Bring the index up to date with the changes reported by a watcher.
+    Deleted paths are purged with everything under them, and the new or
+    changed supported files under the changed paths are processed.  A
+    changed directory, root_dir itself when the watcher lost events, is
+    reconciled with the index: the files indexed under it that are not
+    there anymore are purged too.
+    """
+    writer.delete_trees(normalize_paths([e.path for e in events if e.kind == DELETED]))
+    candidates = []
+    for event in events:
+        if event.kind != CHANGED:
             continue
-        # if thumbnail_exists_for_file(file_path):
-        #     continue
+        if event.path.is_dir():
+            found = list(iter_supported_files(event.path, supported_extensions))
+            candidates.extend(found)
+            indexed_files = get_indexed_files(normalize_path(event.path))
+            for normalized_path in normalize_paths([file_path for file_path, _ in found]):
+                indexed_files.pop(normalized_path, None)
+            writer.delete_files(list(indexed_files))
+            continue
+        if event.path.suffix.lower() not in supported_extensions:
+            continue
+        try:
+            stat_result = event.path.stat()
+        except OSError:
+            continue
+        if stat.S_ISREG(stat_result.st_mode):
+            candidates.append((event.path, stat_result))
+    normalized_paths = normalize_paths([file_path for file_path, _ in candidates])
+    records = get_file_records(normalized_paths)
+    changed_files = []
+    for (file_path, stat_result), normalized_path in zip(candidates, normalized_paths):
+        record = records.get(normalized_path)
+        indexed_stat_key = None
+        if record is not None:
+            indexed_stat_key = (record["st_mtime_ns"], record["st_size"], record["st_ino"])
+        if indexed_stat_key != file_stat_key(stat_result):
+            changed_files.append(file_path)
+    for result in process_files(pool, changed_files, resources_dir, writer.flush_if_due):
+        record_result(writer, result, retry_policy)
+
+def record_result(
+    writer: DatabaseWriter,
+    result: ProcessingResult,
+    retry_policy: RetryPolicy=RetryPolicy(),
+):
+    """
+    Replace the database entry for result.file_path.  A file whose
+    thumbnail could not be made is recorded with the error status and
+    the error, so that it is only retried when retry_policy says so, or
+    when it changes.
+    """
+    if result.stat_key is None:
+        writer.delete_files([normalize_path(result.file_path)])
+        return
+    attempts = retry_at = None
+    if result.error is not None:
+        attempts = count_attempts(result)
+        retry_at = retry_policy.retry_at(attempts, time.time())
+    writer.upsert_file(
+        result.file_path,
+        result.file_type,
+        result.stat_key,
+        result.thumbnail_filename,
+        result.data_filename,
+        result.content_hash,
+        result.error,
+        result.duration,
+        attempts,
+        retry_at,
+        makes_thumbnail(result.file_path),
+    )
+
+def makes_thumbnail(file_path: Path) -> bool:
+    """Whether the processor of file_path has the THUMBNAIL capability"""
+    spec = get_extension_map().get(file_path.suffix.lower())
+    return spec is None or THUMBNAIL in spec.capabilities
+
+def count_attempts(result: ProcessingResult) -> int:
+    """The number of times in a row the file of a failed result failed, this one included"""
+    record = get_file_record(result.file_path)
+    if record is None or record['error'] is None:
+        return 1
+    if (record['st_mtime_ns'], record['st_size'], record['st_ino']) != result.stat_key:
+        return 1
+    return (record['attempts'] or 0) + 1
+
+def iter_supported_files(
+    root_dir: Path,
+    supported_extensions: list[str],
+    recursive: bool=True,
+) -> Iterator[tuple[Path, os.stat_result]]:
+    """
+    Yield every file under root_dir with a supported extension, with its
+    stat, or only those directly in root_dir unless recursive.
+    """
+    file_paths = Path(root_dir).rglob("*") if recursive else Path(root_dir).iterdir()
+    for file_path in file_paths:
         if file_path.suffix.lower() not in supported_extensions:
             continue
-        thumbnail_filename = None
-        data_filename = None
-        for processor in processors:
-            if not processor.can_process_file(file_path):
-                continue
-            thumbnail_filename = processor.make_thumbnail(
-                file_path=file_path,
-                thumbnails_dir=resources_dir / "thumbnails",
-                thumbnail_size=THUMBNAIL_SIZE
-            )
-            if thumbnail_filename is None:
-                continue
+        try:
+            stat_result = file_path.stat()
+        except OSError:
+            continue
+        if not stat.S_ISREG(stat_result.st_mode):
+            continue
+        yield file_path, stat_result
+
+def iter_changed_files(
+    root_dir: Path,
+    supported_extensions: list[str],
+    indexed_files: dict[str, tuple[int, int, int]],
+) -> Iterator[Path]:
+    """
+    Yield the supported files under root_dir that are new or have changed
+    since they were indexed.  Every file seen is popped from indexed_files,
+    leaving only the entries for files that no longer exist.
+    """
+    for file_path, stat_result in iter_supported_files(root_dir, supported_extensions):
+        indexed_stat_key = indexed_files.pop(normalize_path(file_path), None)
+        if indexed_stat_key == file_stat_key(stat_result):
+            continue
+        yield file_path
+
+def prioritize_requested_files(
+    file_paths: Iterable[Path],
+    root_dir: Path,
+    supported_extensions: list[str],
+) -> Iterator[Path]:
+    """
+    Yield file_paths, and ahead of them the new or changed files requested
+    with models.request_paths whenever there are any, most recent requests
+    first.  A requested directory stands for the files directly in it.
+    The files yielded early are skipped when file_paths reaches them.
+    """
+    prioritized = set()
+    next_poll = 0.0
+    for file_path in file_paths:
+        if time.monotonic() >= next_poll:
+            for requested_path in iter_requested_files(root_dir, supported_extensions):
+                normalized_path = normalize_path(requested_path)
+                if normalized_path not in prioritized:
+                    prioritized.add(normalized_path)
+                    yield requested_path
+            next_poll = time.monotonic() + PRIORITY_POLL_INTERVAL
+        if prioritized and normalize_path(file_path) in prioritized:
+            prioritized.discard(normalize_path(file_path))
+            continue
+        yield file_path
+
+def iter_requested_files(root_dir: Path, supported_extensions: list[str]) -> Iterator[Path]:
+    """Yield the new or changed files under root_dir requested since the last call"""
+    root_prefix = normalize_path(root_dir) + "/"
+    candidates = []
+    for requested_path in pop_requested_paths():
+        if not requested_path.startswith(root_prefix):
+            continue
+        path = Path(requested_path)
+        if path.is_dir():
+            candidates.extend(iter_supported_files(path, supported_extensions, recursive=False))
+            continue
+        if path.suffix.lower() not in supported_extensions:
+            continue
+        try:
+            stat_result = path.stat()
+        except OSError:
+            continue
+        if stat.S_ISREG(stat_result.st_mode):
+            candidates.append((path, stat_result))
+    normalized_paths = normalize_paths([file_path for file_path, _ in candidates])
+    records = get_file_records(normalized_paths)
+    for (file_path, stat_result), normalized_path in zip(candidates, normalized_paths):
+        record = records.get(normalized_path)
+        indexed_stat_key = None
+        if record is not None:
+            indexed_stat_key = (record["st_mtime_ns"], record["st_size"], record["st_ino"])
+        if indexed_stat_key != file_stat_key(stat_result):
+            yield file_path
+
+def init_worker(
+    hash_algorithm: str="md5",
+    thumbnail_sizes: tuple[int, ...]=(),
+    thumbnail_formats: tuple[str, ...]=(),
+    thumbnail_pack_dir: Path | None=None,
+):
+    """
+    Create the processors used by process_file in this process.  With
+    thumbnail_pack_dir, thumbnails are saved in the ThumbnailPack there,
+    which is opened by each process since they must not share its files.
+    """
+    global _processors
+    previous_pack = get_thumbnail_pack() if _processors else None
+    if previous_pack is not None:
+        previous_pack.close()
+    _processors = make_processors(hash_algorithm, thumbnail_sizes, thumbnail_formats, thumbnail_pack_dir)
+    _known_content.clear()
+
+def make_processors(
+    hash_algorithm: str,
+    thumbnail_sizes: tuple[int, ...],
+    thumbnail_formats: tuple[str, ...],
+    thumbnail_pack_dir: Path | None,
+) -> dict[str, tuple[ProcessorSpec, 'ProcessorTemplate']]:
+    """One processor of every registered type, with its spec, by extension"""
+    thumbnail_pack = None
+    if thumbnail_pack_dir is not None:
+        thumbnail_pack = ThumbnailPack(thumbnail_pack_dir)
+    processor_args = (hash_algorithm, thumbnail_sizes, thumbnail_formats, thumbnail_pack)
+    processors = {
+        spec: processor_class(*processor_args)
+        for spec, processor_class in get_processor_classes().items()
+    }
+    return {
+        extension: (spec, processors[spec])
+        for extension, spec in get_extension_map().items()
+    }
+
+def get_processor_classes() -> dict[ProcessorSpec, type['ProcessorTemplate']]:
+    """
+    Import the registered processors.  They pull in Pillow, PyMuPDF, numpy
+    and numpy-stl, so they are only imported by the processes that make
+    thumbnails, never by web workers that just serve them.
+    """
+    return {spec: load_processor_class(spec) for spec in set(get_extension_map().values())}
+
+def get_thumbnail_pack() -> ThumbnailPack | None:
+    """The pack the processors of this process save thumbnails in"""
+    for _, processor in _processors.values():
+        return processor.thumbnail_pack
+    return None
+
+def process_file(
+    file_path: Path,
+    resources_dir: Path,
+    processors: Mapping[str, tuple[ProcessorSpec, 'ProcessorTemplate']] | None=None,
+) -> ProcessingResult:
+    """
+    Make the thumbnail and data file for a single file with processors, by
+    default those of init_worker, or reuse those of a file with the same
+    content, see find_known_content.  The exception that stopped the
+    processor, if any, is returned as the error.
+    """
+    if processors is None:
+        processors = _processors
+    try:
+        stat_key = file_stat_key(file_path.stat())
+    except FileNotFoundError:
+        # Deleted since the walk found it
+        return ProcessingResult(file_path, None, None, None, None)
+    if file_path.suffix.lower() not in processors:
+        return ProcessingResult(file_path, stat_key, None, None, None)
+    spec, processor = processors[file_path.suffix.lower()]
+    start = time.perf_counter()
+    try:
+        result = make_resources(file_path, stat_key, spec, processor, resources_dir)
+    except Exception as e:
+        result = ProcessingResult(
+            file_path, stat_key, spec.file_type, None, None, error=f'{type(e).__name__}: {e}'
+        )
+    return result._replace(duration=time.perf_counter() - start)
+
+def make_resources(
+    file_path: Path,
+    stat_key: tuple[int, int, int],
+    spec: ProcessorSpec,
+    processor: 'ProcessorTemplate',
+    resources_dir: Path,
+) -> ProcessingResult:
+    content_hash = processor.hash_file(file_path)
+    known_content = find_known_content(content_hash, spec, processor, resources_dir)
+    if known_content is not None:
+        thumbnail_filename, data_filename = known_content
+        if DATA_FILE in spec.capabilities and data_filename is None:
+            # The data file is gone with the file it linked to
             data_filename = processor.make_data_file(
                 file_path=file_path,
                 data_files_dir=resources_dir / "files"
             )
-        if (thumbnail_filename is not None) and (data_filename is not None):
-            insert_thumbnail(file_path, thumbnail_filename)
-            insert_data_file(file_path, data_filename)
-    if done_flag:
-        done_flag.set()
+        remember_content(content_hash, spec, thumbnail_filename, data_filename)
+        return ProcessingResult(
+            file_path, stat_key, spec.file_type, thumbnail_filename, data_filename,
+            content_hash, deduplicated=True,
+        )
+    thumbnail_filename = None
+    if THUMBNAIL in spec.capabilities:
+        thumbnail_filename = processor.make_thumbnail(
+            file_path=file_path,
+            thumbnails_dir=resources_dir / "thumbnails",
+            thumbnail_size=THUMBNAIL_SIZE
+        )
+        if thumbnail_filename is None:
+            return ProcessingResult(
+                file_path, stat_key, spec.file_type, None, None, content_hash, error='No thumbnail made'
+            )
+    data_filename = None
+    if DATA_FILE in spec.capabilities:
+        data_filename = processor.make_data_file(
+            file_path=file_path,
+            data_files_dir=resources_dir / "files"
+        )
+    remember_content(content_hash, spec, thumbnail_filename, data_filename)
+    return ProcessingResult(
+        file_path, stat_key, spec.file_type, thumbnail_filename, data_filename, content_hash
+    )
+
+def find_known_content(
+    content_hash: str,
+    spec: ProcessorSpec,
+    processor: 'ProcessorTemplate',
+    resources_dir: Path,
+) -> tuple[str, str | None] | None:
+    """
+    Return the (thumbnail_file, data_file) made for a file of the type of
+    spec with the same content, remembered by this process or recorded in
+    the database, if its thumbnail still exists.  The data file is None if
+    it does not exist anymore, a symlink to a copy since deleted.
+    """
+    key = (content_hash, spec.file_type)
+    with _known_content_lock:
+        known_content = _known_content.get(key)
+    if known_content is None:
+        known_content = find_content(content_hash, spec.file_type)
+        if known_content is None:
+            return None
+    thumbnail_filename, data_filename = known_content
+    if thumbnail_filename is not None and not processor.thumbnail_saved(
+        resources_dir / "thumbnails", thumbnail_filename
+    ):
+        return None
+    if data_filename is not None and not (resources_dir / "files" / data_filename).exists():
+        data_filename = None
+    return thumbnail_filename, data_filename
+
+def remember_content(
+    content_hash: str,
+    spec: ProcessorSpec,
+    thumbnail_filename: str,
+    data_filename: str | None,
+):
+    key = (content_hash, spec.file_type)
+    with _known_content_lock:
+        _known_content[key] = (thumbnail_filename, data_filename)
+        _known_content.move_to_end(key)
+        if len(_known_content) > KNOWN_CONTENT_CACHE_SIZE:
+            _known_content.popitem(last=False)
+
+def make_thumbnail_variant(
+    file_path: Path,
+    resources_dir: Path,
+    thumbnail_filename: str,
+    size: int,
+    thumbnail_formats: tuple[str, ...]=(),
+    thumbnail_pack: bool=False,
+    hash_algorithm: str="md5",
+) -> str | None:
+    """
+    Make the variant of size of the thumbnail of file_path in this
+    process, for a variant requested that was not made during the build.
+    """
+    processors = get_on_demand_processors(resources_dir, thumbnail_formats, thumbnail_pack, hash_algorithm)
+    if file_path.suffix.lower() not in processors:
+        return None
+    _, processor = processors[file_path.suffix.lower()]
+    return processor.make_thumbnail_variant(
+        file_path=file_path,
+        thumbnails_dir=resources_dir / "thumbnails",
+        thumbnail_filename=thumbnail_filename,
+        size=size,
+    )
+
+def remake_thumbnail(
+    file_path: Path,
+    resources_dir: Path,
+    thumbnail_formats: tuple[str, ...]=(),
+    thumbnail_pack: bool=False,
+    hash_algorithm: str="md5",
+) -> str | None:
+    """
+    Make the thumbnail of file_path again in this process, for a thumbnail
+    evicted by resource_gc.  Its variants are made when they are requested.
+    """
+    processors = get_on_demand_processors(resources_dir, thumbnail_formats, thumbnail_pack, hash_algorithm)
+    if file_path.suffix.lower() not in processors:
+        return None
+    _, processor = processors[file_path.suffix.lower()]
+    try:
+        return processor.make_thumbnail(
+            file_path=file_path,
+            thumbnails_dir=resources_dir / "thumbnails",
+            thumbnail_size=THUMBNAIL_SIZE
+        )
+    except Exception:
+        return None
+
+def process_file_on_demand(
+    file_path: Path,
+    resources_dir: Path,
+    thumbnail_formats: tuple[str, ...]=(),
+    thumbnail_pack: bool=False,
+    hash_algorithm: str="md5",
+    retry_policy: RetryPolicy=RetryPolicy(),
+) -> ProcessingResult:
+    """
+    Process a file in this process and record it in the database, for a
+    file requested before the builder got to it, with the same
+    hash_algorithm and retry_policy as the builder.  Its variants are made
+    when they are requested.
+    """
+    processors = get_on_demand_processors(resources_dir, thumbnail_formats, thumbnail_pack, hash_algorithm)
+    result = process_file(file_path, resources_dir, processors)
+    if result.stat_key is not None:
+        attempts = retry_at = None
+        if result.error is not None:
+            attempts = 1
+            retry_at = retry_policy.retry_at(attempts, time.time())
+        upsert_file(
+            result.file_path,
+            result.file_type,
+            result.stat_key,
+            result.thumbnail_filename,
+            result.data_filename,
+            result.content_hash,
+            result.error,
+            result.duration,
+            attempts,
+            retry_at,
+            makes_thumbnail(result.file_path),
+        )
+    return result
+
+def get_on_demand_processors(
+    resources_dir: Path,
+    thumbnail_formats: tuple[str, ...],
+    thumbnail_pack: bool,
+    hash_algorithm: str,
+) -> dict[str, tuple[ProcessorSpec, 'ProcessorTemplate']]:
+    """
+    The processors for files processed by the web server, outside of the
+    build, made by the first request thread that needs them
+    """
+    thumbnail_pack_dir = Path(resources_dir) if thumbnail_pack else None
+    key = (hash_algorithm, tuple(thumbnail_formats), thumbnail_pack_dir)
+    processors = _on_demand_processors.get(key)
+    if processors is None:
+        with _on_demand_processors_lock:
+            processors = _on_demand_processors.get(key)
+            if processors is None:
+                processors = make_processors(hash_algorithm, (), tuple(thumbnail_formats), thumbnail_pack_dir)
+                _on_demand_processors[key] = processors
+    return processors
+
+def process_task(task: tuple[Path, Path]) -> ProcessingResult:
+    """process_file for a (file_path, resources_dir) task of a WorkerSupervisor"""
+    return process_file(*task)
+
+def failed_task_result(task: tuple[Path, Path], error: str, duration: float) -> ProcessingResult:
+    """The result of a task whose worker was killed or died, see WorkerSupervisor"""
+    file_path, _ = task
+    try:
+        stat_key = file_stat_key(file_path.stat())
+    except FileNotFoundError:
+        return ProcessingResult(file_path, None, None, None, None)
+    spec = get_extension_map().get(file_path.suffix.lower())
+    file_type = None if spec is None else spec.file_type
+    return ProcessingResult(file_path, stat_key, file_type, None, None, error=error, duration=duration)
+
+def process_files(
+    pool: WorkerSupervisor | None,
+    file_paths: Iterable[Path],
+    resources_dir: Path,
+    on_wait: Callable[[], float | None] | None=None,
+) -> Iterator[ProcessingResult]:
+    """
+    Process files, on pool if there is one, yielding results as they
+    complete.  on_wait is called while waiting for results, see
+    WorkerSupervisor.imap_unordered, or between files without pool.
+
+    Files are handed to the workers in batches costing BATCH_SIZE images
+    with at most TASKS_PER_WORKER batches in flight per worker, so a huge
+    tree is never materialized in memory, the workers never starve, and
+    a few costly files do not hold up a worker while the others idle.
+    """
+    if pool is None:
+        for file_path in file_paths:
+            if on_wait is not None:
+                on_wait()
+            yield process_file(file_path, resources_dir)
+        return
+    tasks = ((file_path, resources_dir) for file_path in file_paths)
+    batches = iter_batches(tasks, BATCH_SIZE, lambda task: get_file_cost(task[0]))
+    yield from pool.imap_unordered(batches, on_wait)
+
+def get_file_cost(file_path: Path) -> float:
+    spec = get_extension_map().get(file_path.suffix.lower())
+    return 1.0 if spec is None else spec.cost
+
+def iter_batches(
+    items: Iterable,
+    batch_size: float,
+    cost: Callable[[object], float]=lambda item: 1,
+) -> Iterator[list]:
+    """Group items in batches whose total cost reaches batch_size, but the last"""
+    batch = []
+    batch_cost = 0
+    for item in items:
+        batch.append(item)
+        batch_cost += cost(item)
+        if batch_cost >= batch_size:
+            yield batch
+            batch = []
+            batch_cost = 0
+    if batch:
+        yield batch
 
 def make_resources_directories(resources_dir: Path):
     resources_dir.mkdir(parents=True, exist_ok=True)
     thumbnails_dir = resources_dir / "thumbnails"
     thumbnails_dir.mkdir(exist_ok=True)
     files_dir = resources_dir / "files"
-    files_dir.mkdir(exist_ok=True)
\ No newline at end of file
+    files_dir.mkdir(exist_ok=True)
@@ -1,10 +1,24 @@
+from io import BytesIO
 from pathlib import Path
 
-from PIL import Image
+from PIL import ExifTags, Image
 
 from fileexplorer.proc import ProcessorTemplate
+from fileexplorer.registry import IMAGE_EXTENSIONS
 
-IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.gif', '.bmp',)
+# Transposition undoing each EXIF orientation
+ORIENTATION_TRANSPOSE = {
+    2: Image.Transpose.FLIP_LEFT_RIGHT,
+    3: Image.Transpose.ROTATE_180,
+    4: Image.Transpose.FLIP_TOP_BOTTOM,
+    5: Image.Transpose.TRANSPOSE,
+    6: Image.Transpose.ROTATE_270,
+    7: Image.Transpose.TRANSVERSE,
+    8: Image.Transpose.ROTATE_90,
+}
+# How far the aspect ratio of an EXIF thumbnail may be from the image's
+# before it is assumed to be letterboxed and is not used
+EXIF_THUMBNAIL_ASPECT_TOLERANCE = 0.02
 
 class ImageProcessor(ProcessorTemplate):
     """
@@ -15,8 +29,10 @@ class ImageProcessor(ProcessorTemplate):
     Attributes:
     extensions (tuple[str, ...]): A tuple containing the file extensions that 
                                   this processor can handle.
+    file_type (str): The file type recorded for the files it processes.
     """
     extensions = IMAGE_EXTENSIONS
+    file_type = 'image'
 
     def make_thumbnail(
         self,
@@ -27,8 +43,9 @@ class ImageProcessor(ProcessorTemplate):
         """
         Generate a thumbnail for an image file.
 
-        This method attempts to open an image file, and if successful, it calls
-        the write_thumbnail method to create and save the thumbnail.
+        This method opens an image file at reduced resolution (see
+        open_reduced_image), large enough for the thumbnail and its variants,
+        and calls the write_thumbnail method to create and save them.
 
         Parameters:
         file_path (Path): The path of the image file.
@@ -37,13 +54,12 @@ class ImageProcessor(ProcessorTemplate):
                                          of the thumbnail.
 
         Returns:
-        str | None: The filename of the generated thumbnail if successful, 
-                    otherwise None.
+        str: The filename of the generated thumbnail.
+
+        Raises:
+        Exception: Whatever kept the image from being opened.
         """
-        try:
-            image = Image.open(file_path)
-        except Exception:
-            return None
+        image = self.open_thumbnail_image(file_path, self.decode_size(thumbnail_size))
         thumbnail_filename = self.write_thumbnail(
             image=image,
             thumbnails_dir=thumbnails_dir,
@@ -51,6 +67,9 @@ class ImageProcessor(ProcessorTemplate):
         )
         return thumbnail_filename
 
+    def open_thumbnail_image(self, file_path: Path, thumbnail_size: tuple[int, int]) -> Image.Image:
+        return open_reduced_image(file_path, thumbnail_size)
+
     def make_data_file(self, file_path: Path, data_files_dir: Path) -> str:
         """
         Create a symbolic link for the given image file in the specified directory.
@@ -68,4 +87,75 @@ class ImageProcessor(ProcessorTemplate):
         return self.make_symlink_data_file(
             file_path=file_path,
             data_files_dir=data_files_dir
-        )
\ No newline at end of file
+        )
+
+def open_reduced_image(file_path: Path, thumbnail_size: tuple[int, int]) -> Image.Image:
+    """
+    Open an image at the lowest resolution that still gives a full size
+    thumbnail, with its EXIF orientation applied.
+
+    For a JPEG, the thumbnail embedded in its EXIF data is used when it is
+    large enough, and otherwise the image is decoded with DCT scaling at
+    1/2, 1/4 or 1/8 of its size.  Other formats cannot be decoded at a
+    lower resolution; write_thumbnail shrinks them with Image.reduce
+    before resampling.
+
+    Parameters:
+    file_path (Path): The path of the image file.
+    thumbnail_size (tuple[int, int]): The dimensions (width, height) of
+                                      the thumbnail to be made.
+
+    Returns:
+    Image.Image: The image, not necessarily loaded yet.
+    """
+    image = Image.open(file_path)
+    orientation = image.getexif().get(ExifTags.Base.Orientation)
+    if orientation in (5, 6, 7, 8):
+        # The image is stored rotated by 90 degrees
+        thumbnail_size = (thumbnail_size[1], thumbnail_size[0])
+    if image.format == 'JPEG':
+        exif_thumbnail = get_exif_thumbnail(image, thumbnail_size)
+        if exif_thumbnail is not None:
+            image = exif_thumbnail
+        else:
+            image.draft('RGB', fit_size(image.size, thumbnail_size))
+    if orientation in ORIENTATION_TRANSPOSE:
+        image = image.transpose(ORIENTATION_TRANSPOSE[orientation])
+    return image
+
+def get_exif_thumbnail(image: Image.Image, thumbnail_size: tuple[int, int]) -> Image.Image | None:
+    """
+    Return the thumbnail embedded in the EXIF data of a JPEG if it is at
+    least as large as the thumbnail to be made and has the same aspect
+    ratio as the image, otherwise None.
+    """
+    exif_bytes = image.info.get('exif')
+    if not exif_bytes:
+        return None
+    ifd1 = image.getexif().get_ifd(ExifTags.IFD.IFD1)
+    offset = ifd1.get(ExifTags.Base.JpegIFOffset)
+    length = ifd1.get(ExifTags.Base.JpegIFByteCount)
+    if not offset or not length:
+        return None
+    # Offsets are relative to the TIFF header following the Exif marker
+    if exif_bytes.startswith(b'Exif\x00\x00'):
+        offset += 6
+    try:
+        exif_thumbnail = Image.open(BytesIO(exif_bytes[offset:offset + length]))
+        exif_thumbnail.load()
+    except Exception:
+        return None
+    width, height = exif_thumbnail.size
+    needed_width, needed_height = fit_size(image.size, thumbnail_size)
+    if width < needed_width or height < needed_height:
+        return None
+    image_aspect = image.width / image.height
+    if abs(width / height - image_aspect) > EXIF_THUMBNAIL_ASPECT_TOLERANCE * image_aspect:
+        return None
+    return exif_thumbnail
+
+def fit_size(size: tuple[int, int], box: tuple[int, int]) -> tuple[int, int]:
+    """Return size scaled down to fit in box, keeping its aspect ratio"""
+    width, height = size
+    scale = min(box[0] / width, box[1] / height, 1)
+    return (max(round(width * scale), 1), max(round(height * scale), 1))
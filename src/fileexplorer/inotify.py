@@ -0,0 +1,110 @@
+"""Minimal ctypes binding of the Linux inotify API"""
+import ctypes
+import ctypes.util
+import os
+from pathlib import Path
+import select
+import struct
+import sys
+from typing import NamedTuple
+
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+
+IN_CLOEXEC = 0o2000000
+IN_NONBLOCK = 0o4000
+
+# Events that change the entries of a watched directory
+DIRECTORY_CHANGED_MASK = (
+    IN_CREATE | IN_DELETE | IN_MOVED_FROM | IN_MOVED_TO | IN_DELETE_SELF | IN_MOVE_SELF
+)
+
+_EVENT_HEADER = struct.Struct('iIII')
+
+class InotifyEvent(NamedTuple):
+    wd: int
+    mask: int
+    cookie: int
+    name: str
+
+def _load_libc():
+    if not sys.platform.startswith('linux'):
+        return None
+    libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+    if not hasattr(libc, 'inotify_init1'):
+        return None
+    libc.inotify_add_watch.argtypes = (ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32)
+    return libc
+
+_libc = _load_libc()
+
+def inotify_available() -> bool:
+    """True if the inotify API can be used on this platform"""
+    return _libc is not None
+
+class Inotify:
+    """An inotify instance.  Close it, or use it as a context manager."""
+
+    def __init__(self):
+        if _libc is None:
+            raise OSError('inotify is not available on this platform')
+        self.fd = _libc.inotify_init1(IN_CLOEXEC | IN_NONBLOCK)
+        if self.fd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno))
+
+    def __enter__(self) -> 'Inotify':
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def add_watch(self, path: str|Path, mask: int) -> int:
+        """Watch path for the events in mask and return the watch descriptor"""
+        wd = _libc.inotify_add_watch(self.fd, os.fsencode(path), mask)
+        if wd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno), str(path))
+        return wd
+
+    def rm_watch(self, wd: int):
+        # Fails harmlessly when the watch is already gone with its directory
+        _libc.inotify_rm_watch(self.fd, wd)
+
+    def read_events(self, timeout: float|None=None) -> list[InotifyEvent]:
+        """
+        Wait up to timeout seconds (forever if None) for events and return
+        every event that is available.
+        """
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return []
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+        events = []
+        offset = 0
+        while offset < len(data):
+            wd, mask, cookie, name_length = _EVENT_HEADER.unpack_from(data, offset)
+            offset += _EVENT_HEADER.size
+            name = data[offset:offset + name_length].rstrip(b'\0')
+            offset += name_length
+            events.append(InotifyEvent(wd, mask, cookie, os.fsdecode(name)))
+        return events
+
+    def close(self):
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
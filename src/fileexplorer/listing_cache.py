@@ -0,0 +1,187 @@
+from collections import OrderedDict
+from collections.abc import Iterator
+import os
+from pathlib import Path
+import threading
+import time
+from typing import NamedTuple
+
+from fileexplorer.inotify import (
+    DIRECTORY_CHANGED_MASK,
+    IN_ONLYDIR,
+    IN_Q_OVERFLOW,
+    Inotify,
+    inotify_available,
+)
+
+# A listing is only cached once the directory has been left unchanged for
+# this long, so a change within the same mtime tick is never missed
+RACY_MTIME_NS = 2_000_000_000
+
+class ListingEntry(NamedTuple):
+    name: str
+    is_dir: bool
+
+def scan_directory(path: str|Path) -> Iterator[ListingEntry]:
+    """Yield the files and directories in path, in directory order"""
+    with os.scandir(path) as it:
+        for entry in it:
+            if entry.is_file():
+                yield ListingEntry(entry.name, False)
+            elif entry.is_dir():
+                yield ListingEntry(entry.name, True)
+
+class DirectoryListingCache:
+    """
+    In-process LRU cache of directory listings.
+
+    A cached listing is keyed on the directory path and is valid while the
+    directory mtime is unchanged.  With use_inotify the cache instead
+    watches every cached directory and evicts its listing as soon as an
+    entry is created, deleted or moved, which saves the stat per lookup.
+
+    Attributes:
+    max_directories (int): Number of listings kept before evicting the
+                           least recently used one.
+    max_entries (int): Listings with more entries than this are not cached.
+    hits, misses, invalidations, evictions (int): Counters for sizing
+                                                  the cache.
+    """
+
+    def __init__(
+        self,
+        max_directories: int=1024,
+        max_entries: int=10_000,
+        use_inotify: bool=False
+    ):
+        self.max_directories = max_directories
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.evictions = 0
+        self._listings = OrderedDict()
+        self._lock = threading.Lock()
+        self._inotify = None
+        # Watch descriptor -> directory, number of reads in progress and
+        # number of change events seen
+        self._watches = {}
+        self._reading = {}
+        self._changes = {}
+        if use_inotify and inotify_available():
+            self._inotify = Inotify()
+            thread = threading.Thread(target=self._watch_for_changes, daemon=True)
+            thread.start()
+
+    def iter_entries(self, path: str|Path) -> Iterator[ListingEntry]:
+        """
+        Yield the entries of the directory at path.  On a miss the entries
+        are yielded while the directory is read and cached once it has been
+        read in full.
+        """
+        key = os.fspath(path)
+        mtime_ns = None if self._inotify else os.stat(key).st_mtime_ns
+        with self._lock:
+            cached = self._listings.get(key)
+            if cached is not None and (self._inotify or cached[0] == mtime_ns):
+                self._listings.move_to_end(key)
+                self.hits += 1
+                entries = cached[1]
+            else:
+                self.misses += 1
+                entries = None
+        if entries is not None:
+            yield from entries
+            return
+        if self._inotify:
+            # Watch before reading so no change during the read is missed
+            try:
+                wd, changes = self._start_watched_read(key)
+            except OSError:
+                # Out of watches, so the listing cannot be cached
+                yield from scan_directory(key)
+                return
+        try:
+            entries = []
+            for entry in scan_directory(key):
+                if entries is not None:
+                    entries.append(entry)
+                    if len(entries) > self.max_entries:
+                        entries = None
+                yield entry
+            if entries is None:
+                return
+            if not self._inotify:
+                if time.time_ns() - mtime_ns >= RACY_MTIME_NS:
+                    self._store(key, (mtime_ns, entries))
+                return
+            with self._lock:
+                if self._changes.get(wd, 0) == changes:
+                    self._store(key, (wd, entries))
+        finally:
+            if self._inotify:
+                with self._lock:
+                    self._reading[wd] -= 1
+                    self._drop_unused_watches()
+
+    def _store(self, key: str, value: tuple):
+        """Cache value for key, with the lock held"""
+        self._listings[key] = value
+        self._listings.move_to_end(key)
+        while len(self._listings) > self.max_directories:
+            self._listings.popitem(last=False)
+            self.evictions += 1
+        self._drop_unused_watches()
+
+    def _start_watched_read(self, key: str) -> tuple[int, int]:
+        with self._lock:
+            wd = self._inotify.add_watch(key, DIRECTORY_CHANGED_MASK | IN_ONLYDIR)
+            self._watches[wd] = key
+            self._reading[wd] = self._reading.get(wd, 0) + 1
+            return wd, self._changes.get(wd, 0)
+
+    def _drop_unused_watches(self):
+        """Remove the watches of directories neither cached nor being read"""
+        if not self._inotify or len(self._watches) <= len(self._listings):
+            return
+        used = {value[0] for value in self._listings.values()}
+        used.update(wd for wd, count in self._reading.items() if count)
+        for wd in [wd for wd in self._watches if wd not in used]:
+            del self._watches[wd]
+            self._reading.pop(wd, None)
+            self._changes.pop(wd, None)
+            self._inotify.rm_watch(wd)
+
+    def _watch_for_changes(self):
+        while True:
+            events = self._inotify.read_events()
+            with self._lock:
+                for event in events:
+                    if event.wd not in self._watches:
+                        continue
+                    self._changes[event.wd] = self._changes.get(event.wd, 0) + 1
+                    if self._listings.pop(self._watches[event.wd], None) is not None:
+                        self.invalidations += 1
+                if any(event.mask & IN_Q_OVERFLOW for event in events):
+                    # Events were dropped, nothing cached can be trusted
+                    self.invalidations += len(self._listings)
+                    self._listings.clear()
+                    for wd in self._watches:
+                        self._changes[wd] = self._changes.get(wd, 0) + 1
+                self._drop_unused_watches()
+
+    def clear(self):
+        with self._lock:
+            self._listings.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'directories': len(self._listings),
+                'max_directories': self.max_directories,
+                'hits': self.hits,
+                'misses': self.misses,
+                'invalidations': self.invalidations,
+                'evictions': self.evictions,
+                'inotify': self._inotify is not None,
+            }
@@ -0,0 +1,154 @@
+"""
+Indexed binary meshes served to the viewer in place of the original STL.
+
+An STL stores every triangle with its own three vertices and a normal,
+50 bytes per triangle.  A mesh file stores each vertex once, quantized to
+16 bits per coordinate over the bounding box, and the triangles as
+indices into the vertices, about 15 bytes per triangle.  The viewer
+computes the normals.
+
+Layout, little-endian:
+    magic           8 bytes, MESH_MAGIC
+    vertex_count    uint32
+    triangle_count  uint32
+    origin          3 float32
+    scale           3 float32, a vertex is origin + scale * quantized
+    quantized       vertex_count * 3 uint16, zero padded to 4 bytes
+    indices         triangle_count * 3 uint32
+
+Coarser levels of detail are made by vertex clustering: vertices in the
+same cell of a grid over the bounding box are merged, and the triangles
+that collapse are dropped.
+"""
+import math
+import os
+from pathlib import Path
+import struct
+
+import numpy as np
+
+from fileexplorer.resource_names import MESH_EXTENSION, MESH_LOD_TRIANGLES, mesh_lod_filenames
+
+MESH_MAGIC = b'FEMESH1\x00'
+QUANTIZATION_STEPS = 65535
+
+_HEADER = struct.Struct('<8sII3f3f')
+
+def deduplicate_vertices(vectors: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Return the distinct vertices of the triangles vectors, an (n, 3, 3)
+    array, and the triangles as an (m, 3) array of vertex indices.
+    Triangles with a repeated vertex are dropped.
+    """
+    points = np.ascontiguousarray(vectors, dtype=np.float32).reshape(-1, 3)
+    # Rows compared as 12 byte strings, much faster than unique(axis=0)
+    _, first, inverse = np.unique(
+        points.view(np.dtype((np.void, 12))).ravel(),
+        return_index=True,
+        return_inverse=True,
+    )
+    triangles = inverse.reshape(-1, 3).astype(np.uint32)
+    return points[first], drop_degenerate_triangles(triangles)
+
+def drop_degenerate_triangles(triangles: np.ndarray) -> np.ndarray:
+    a, b, c = triangles[:, 0], triangles[:, 1], triangles[:, 2]
+    return triangles[(a != b) & (b != c) & (a != c)]
+
+def cluster_vertices(
+    vertices: np.ndarray,
+    triangles: np.ndarray,
+    cells_per_axis: int,
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Merge the vertices in each cell of a grid of cells_per_axis cells
+    along the longest side of the bounding box into their mean.  Triangles
+    that collapse or end up duplicated are dropped.
+    """
+    low = vertices.min(axis=0)
+    cell_size = max(float((vertices.max(axis=0) - low).max()), 1e-30) / cells_per_axis
+    cells = np.minimum(((vertices - low) / cell_size).astype(np.int64), cells_per_axis - 1)
+    cell_ids = cells[:, 0] + cells_per_axis * (cells[:, 1] + cells_per_axis * cells[:, 2])
+    _, clusters = np.unique(cell_ids, return_inverse=True)
+    counts = np.bincount(clusters)
+    merged = np.stack(
+        [np.bincount(clusters, weights=vertices[:, axis]) / counts for axis in range(3)],
+        axis=1,
+    ).astype(np.float32)
+    triangles = drop_degenerate_triangles(clusters[triangles].astype(np.uint32))
+    # The same triangle may be made from several, whatever its winding
+    _, first = np.unique(np.sort(triangles, axis=1), axis=0, return_index=True)
+    return remove_unused_vertices(merged, triangles[np.sort(first)])
+
+def remove_unused_vertices(vertices: np.ndarray, triangles: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    used, inverse = np.unique(triangles, return_inverse=True)
+    return vertices[used], inverse.reshape(-1, 3).astype(np.uint32)
+
+def decimate(
+    vertices: np.ndarray,
+    triangles: np.ndarray,
+    max_triangles: int,
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Cluster vertices on grids coarser and coarser until the mesh has at
+    most max_triangles triangles.
+    """
+    if len(triangles) <= max_triangles:
+        return vertices, triangles
+    # A surface clustered on an n^3 grid is left with on the order of
+    # n^2 triangles
+    cells_per_axis = max(2, math.isqrt(max_triangles))
+    while True:
+        decimated = cluster_vertices(vertices, triangles, cells_per_axis)
+        if len(decimated[1]) <= max_triangles or cells_per_axis == 2:
+            return decimated
+        cells_per_axis = max(2, int(cells_per_axis * 0.75))
+
+def make_mesh_lods(
+    vectors: np.ndarray,
+    lod_triangles: tuple[int, ...]=MESH_LOD_TRIANGLES,
+) -> list[tuple[int|None, np.ndarray, np.ndarray]]:
+    """
+    Return the (triangle budget, vertices, triangles) of the levels of
+    detail of the triangles vectors, coarsest first and ending with the
+    full resolution mesh.  Only the budgets below the number of triangles
+    of the mesh get a level.
+    """
+    vertices, triangles = deduplicate_vertices(vectors)
+    lods = []
+    for budget in sorted(lod_triangles):
+        if budget < len(triangles):
+            lods.append((budget, *decimate(vertices, triangles, budget)))
+    lods.append((None, vertices, triangles))
+    return lods
+
+def write_mesh(file_path: Path, vertices: np.ndarray, triangles: np.ndarray):
+    """
+    Write a mesh file, through a temporary file so that a reader never
+    sees it partly written.
+    """
+    origin = vertices.min(axis=0) if len(vertices) else np.zeros(3, dtype=np.float32)
+    extent = vertices.max(axis=0) - origin if len(vertices) else np.zeros(3, dtype=np.float32)
+    scale = np.where(extent > 0, extent / QUANTIZATION_STEPS, 1).astype(np.float32)
+    quantized = np.round((vertices - origin) / scale).astype('<u2')
+    padding = b'\0' * (-quantized.nbytes % 4)
+    temporary_path = Path(file_path).with_name(f'.{Path(file_path).name}.{os.getpid()}')
+    with open(temporary_path, 'wb') as f:
+        f.write(_HEADER.pack(MESH_MAGIC, len(vertices), len(triangles), *origin, *scale))
+        f.write(quantized.tobytes())
+        f.write(padding)
+        f.write(triangles.astype('<u4').tobytes())
+    os.replace(temporary_path, file_path)
+
+def read_mesh(file_path: Path) -> tuple[np.ndarray, np.ndarray]:
+    """Return the dequantized vertices and the triangles of a mesh file"""
+    data = Path(file_path).read_bytes()
+    magic, vertex_count, triangle_count, *origin_scale = _HEADER.unpack_from(data)
+    if magic != MESH_MAGIC:
+        raise ValueError(f'{file_path} is not a mesh file')
+    origin = np.array(origin_scale[:3], dtype=np.float32)
+    scale = np.array(origin_scale[3:], dtype=np.float32)
+    offset = _HEADER.size
+    quantized = np.frombuffer(data, '<u2', vertex_count * 3, offset).reshape(-1, 3)
+    offset += quantized.nbytes + (-quantized.nbytes % 4)
+    triangles = np.frombuffer(data, '<u4', triangle_count * 3, offset).reshape(-1, 3)
+    return origin + scale * quantized, triangles
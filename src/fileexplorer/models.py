@@ -1,85 +1,700 @@
+import os
 from pathlib import Path
 import sqlite3
+import threading
+import time
 
-from flask import Flask
+from flask import Flask, g, has_app_context
 
 DATABASE_PATH = None
 
+# Connections cached by get_db_connection, one per thread
+_local = threading.local()
+
+# Idle read-only connections of the web server, see get_read_connection
+MAX_IDLE_READ_CONNECTIONS = 8
+
+# Bumped whenever the layout of the database changes.  create_tables
+# migrates older databases up to this version.
+SCHEMA_VERSION = 3
+
+# Values of files.status.  A file_path missing from the table is still
+# waiting to be processed.
+STATUS_PROCESSING = 'processing'
+STATUS_READY = 'ready'
+STATUS_ERROR = 'error'
+
+FILE_COLUMNS = (
+    'file_path',
+    'file_type',
+    'st_size',
+    'st_mtime_ns',
+    'st_ino',
+    'status',
+    'thumbnail_file',
+    'data_file',
+    'content_hash',
+    'error',
+    'duration',
+    'attempts',
+    'retry_at',
+)
+
+# Columns added to the files table by each schema version
+ADDED_FILE_COLUMNS = {
+    2: ('content_hash TEXT',),
+    3: ('error TEXT', 'duration REAL', 'attempts INTEGER', 'retry_at REAL'),
+}
+
 def init_database(app: Flask):
-    """Set DATABASE_PATH from app.config"""
-    global DATABASE_PATH 
+    """
+    Set DATABASE_PATH from app.config, and give the read connection of each
+    app context back to the pool when it ends
+    """
+    global DATABASE_PATH
     DATABASE_PATH = app.config['DATABASE_PATH']
     Path(DATABASE_PATH).parent.mkdir(parents=True, exist_ok=True)
+    app.teardown_appcontext(release_read_connection)
 
 def get_db_connection() -> sqlite3.Connection:
-    """Get connection to the file explorer sqlite database"""
+    """
+    Get connection to the file explorer sqlite database.
+
+    The connection is cached and reused by every later call in the same
+    thread, so callers must not close it.  A new connection is made after
+    a fork or when DATABASE_PATH changes.  In the web server it is only
+    used for the few writes, queries go through get_read_connection.
+    """
     if DATABASE_PATH is None:
         raise RuntimeError('DATABASE_PATH has not been set')
-    return sqlite3.connect(DATABASE_PATH)
+    key = (os.getpid(), DATABASE_PATH)
+    if getattr(_local, 'key', None) != key:
+        # Never close a connection inherited through fork, the parent owns it
+        if getattr(_local, 'key', (None,))[0] == os.getpid():
+            _local.conn.close()
+        _local.conn = sqlite3.connect(DATABASE_PATH)
+        _local.key = key
+    return _local.conn
+
+def close_db_connection():
+    """Close the connection cached for the current thread, if any"""
+    if getattr(_local, 'key', (None,))[0] == os.getpid():
+        _local.conn.close()
+    _local.__dict__.clear()
+
+class ReadConnectionPool:
+    """
+    Idle read-only connections to DATABASE_PATH, at most max_idle of them,
+    shared by the threads of the web server.  Connections are made with
+    query_only, so writing through one fails, and without
+    check_same_thread, since each is used by a single app context at a
+    time whatever thread that runs in.
+    """
+
+    def __init__(self, max_idle: int=MAX_IDLE_READ_CONNECTIONS):
+        self.max_idle = max_idle
+        self._idle = []
+        self._key = None
+        self._lock = threading.Lock()
+
+    def acquire(self) -> tuple[sqlite3.Connection, tuple[int, str]]:
+        """Return an idle connection, or a new one, and the key to release it with"""
+        if DATABASE_PATH is None:
+            raise RuntimeError('DATABASE_PATH has not been set')
+        key = (os.getpid(), DATABASE_PATH)
+        with self._lock:
+            if self._key != key:
+                # Never close connections inherited through fork
+                if self._key is not None and self._key[0] == os.getpid():
+                    for conn in self._idle:
+                        conn.close()
+                self._idle = []
+                self._key = key
+            if self._idle:
+                return self._idle.pop(), key
+        conn = sqlite3.connect(DATABASE_PATH, check_same_thread=False)
+        conn.execute('PRAGMA query_only = ON')
+        return conn, key
+
+    def release(self, conn: sqlite3.Connection, key: tuple[int, str]):
+        """Keep conn for a later acquire, unless enough are kept or it is outdated"""
+        with self._lock:
+            if key == self._key and len(self._idle) < self.max_idle:
+                self._idle.append(conn)
+                return
+        if key[0] == os.getpid():
+            conn.close()
+
+_read_pool = ReadConnectionPool()
+
+def get_read_connection() -> sqlite3.Connection:
+    """
+    Get a read-only connection for queries.
+
+    In a Flask app context, the connection is taken from the pool the first
+    time and given back when the app context ends, so a request makes no
+    connection after the first ones and leaves none open.  Elsewhere, in
+    the builder and resource_gc, it is the one of get_db_connection.
+    """
+    if not has_app_context():
+        return get_db_connection()
+    if 'db_read_connection' not in g:
+        g.db_read_connection = _read_pool.acquire()
+    return g.db_read_connection[0]
+
+def release_read_connection(exception: BaseException|None=None):
+    """Give the read connection of the app context back to the pool, if any"""
+    read_connection = g.pop('db_read_connection', None)
+    if read_connection is not None:
+        _read_pool.release(*read_connection)
+
+BUMP_DATABASE_VERSION_SQL = 'UPDATE database_version SET version = version + 1'
+
+def get_database_version() -> int:
+    """Return a number that changes whenever the files table changes"""
+    return get_read_connection().execute('SELECT version FROM database_version').fetchone()[0]
 
 def create_tables():
+    """Create the tables, migrating a database made by an older version"""
     conn = get_db_connection()
-    conn.execute('DROP TABLE IF EXISTS thumbnails')
-    conn.execute('CREATE TABLE IF NOT EXISTS thumbnails (file_path STR, thumbnail_file STR)')
-    conn.execute('CREATE TABLE IF NOT EXISTS data_files (file_path STR, data_file STR)')
-    conn.close()    
+    # WAL lets the web server keep reading while the builder writes
+    conn.execute('PRAGMA journal_mode=WAL')
+    with conn:
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS files ('
+            'id INTEGER PRIMARY KEY, '
+            'file_path TEXT NOT NULL, '
+            'file_type TEXT, '
+            'st_size INTEGER, '
+            'st_mtime_ns INTEGER, '
+            'st_ino INTEGER, '
+            f"status TEXT NOT NULL CHECK (status IN ('{STATUS_PROCESSING}', '{STATUS_READY}', '{STATUS_ERROR}')), "
+            'thumbnail_file TEXT, '
+            'data_file TEXT, '
+            'content_hash TEXT, '
+            # Why the file could not be processed, how long processing
+            # took in seconds, how many times in a row it failed, and when
+            # it is tried again if it is
+            'error TEXT, '
+            'duration REAL, '
+            'attempts INTEGER, '
+            'retry_at REAL)'
+        )
+        version = conn.execute('PRAGMA user_version').fetchone()[0]
+        if version > 0:
+            for added_version, columns in ADDED_FILE_COLUMNS.items():
+                if version < added_version:
+                    for column in columns:
+                        conn.execute(f'ALTER TABLE files ADD COLUMN {column}')
+        conn.execute('CREATE UNIQUE INDEX IF NOT EXISTS files_file_path ON files (file_path)')
+        # Finds the file a thumbnail was made for, to make its variants
+        conn.execute('CREATE INDEX IF NOT EXISTS files_thumbnail_file ON files (thumbnail_file)')
+        # Finds a file with the same content, whose thumbnail is reused
+        conn.execute('CREATE INDEX IF NOT EXISTS files_content_hash ON files (content_hash)')
+        conn.execute('CREATE INDEX IF NOT EXISTS files_retry_at ON files (retry_at)')
+        # A single row counting the commits that changed files, so the
+        # web server can tell whether a response it sent is still valid
+        conn.execute('CREATE TABLE IF NOT EXISTS database_version (version INTEGER NOT NULL)')
+        conn.execute(
+            'INSERT INTO database_version (version) '
+            'SELECT 0 WHERE NOT EXISTS (SELECT 1 FROM database_version)'
+        )
+        # Paths the web server wants processed before the rest of the walk
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS requested_paths ('
+            'path TEXT PRIMARY KEY, '
+            'requested_at REAL NOT NULL)'
+        )
+        # When each thumbnail was last served, for resource_gc to evict the
+        # least recently used ones first
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS thumbnail_accesses ('
+            'thumbnail_file TEXT PRIMARY KEY, '
+            'accessed_at REAL NOT NULL)'
+        )
+        if version < 1:
+            migrate_from_legacy_tables(conn)
+            conn.execute(BUMP_DATABASE_VERSION_SQL)
+        conn.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
+
+def migrate_from_legacy_tables(conn: sqlite3.Connection):
+    """
+    Move the rows of the original thumbnails, data_files and file_stats
+    tables into the files table and drop them.
+    """
+    tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    if 'thumbnails' not in tables:
+        return
+    has_data_files = 'data_files' in tables
+    has_file_stats = 'file_stats' in tables
+    conn.execute(
+        'INSERT OR IGNORE INTO files '
+        '(file_path, file_type, st_size, st_mtime_ns, st_ino, status, thumbnail_file, data_file) '
+        'SELECT t.file_path, '
+        "CASE lower(substr(t.file_path, -4)) WHEN '.pdf' THEN 'pdf' WHEN '.stl' THEN 'stl' ELSE 'image' END, "
+        f"{'s.st_size, s.st_mtime_ns, s.st_ino' if has_file_stats else 'NULL, NULL, NULL'}, "
+        f"CASE WHEN t.thumbnail_file IS NULL THEN '{STATUS_ERROR}' ELSE '{STATUS_READY}' END, "
+        't.thumbnail_file, '
+        f"{'(SELECT max(d.data_file) FROM data_files d WHERE d.file_path = t.file_path)' if has_data_files else 'NULL'} "
+        'FROM thumbnails t '
+        f"{'LEFT JOIN file_stats s ON s.file_path = t.file_path' if has_file_stats else ''}"
+    )
+    conn.execute('DROP TABLE thumbnails')
+    conn.execute('DROP TABLE IF EXISTS data_files')
+    conn.execute('DROP TABLE IF EXISTS file_stats')
 
 def normalize_path(path: str|Path) -> str:
     """Normalize a path for insertion into or querying the database"""
     return Path(path).resolve().as_posix()
 
-def insert_thumbnail(file_path: str|Path, thumbnail_filename: str):
-    """Insert a thumbnail filename for the given file_path and commit to the database"""
-    conn = get_db_connection()
-    conn.execute(
-        'INSERT INTO thumbnails (file_path, thumbnail_file) VALUES (?,?)',
-        (normalize_path(file_path), thumbnail_filename)
+def normalize_paths(paths: list[str|Path]) -> list[str]:
+    """
+    Same as normalize_path for many paths, resolving each parent directory
+    only once.  Only paths that are themselves symlinks are resolved in full.
+    """
+    resolved_parents = {}
+    normalized_paths = []
+    for path in map(Path, paths):
+        if path.is_symlink():
+            normalized_paths.append(normalize_path(path))
+            continue
+        resolved_parent = resolved_parents.get(path.parent)
+        if resolved_parent is None:
+            resolved_parent = resolved_parents[path.parent] = path.parent.resolve()
+        normalized_paths.append((resolved_parent / path.name).as_posix())
+    return normalized_paths
+
+def file_stat_key(stat_result: os.stat_result) -> tuple[int, int, int]:
+    """Return the (mtime, size, inode) triple used to detect changed files"""
+    return (stat_result.st_mtime_ns, stat_result.st_size, stat_result.st_ino)
+
+def make_file_row(
+    file_path: str|Path,
+    file_type: str|None,
+    stat_key: tuple[int, int, int],
+    thumbnail_filename: str|None,
+    data_filename: str|None,
+    content_hash: str|None=None,
+    error: str|None=None,
+    duration: float|None=None,
+    attempts: int|None=None,
+    retry_at: float|None=None,
+    makes_thumbnail: bool=True,
+) -> tuple:
+    """
+    Return the files table row for a processed file, in FILE_COLUMNS order.
+    A file is recorded with the error status if it has no thumbnail, unless
+    not makes_thumbnail, for the files of processors that make none.
+    """
+    st_mtime_ns, st_size, st_ino = stat_key
+    # Not every processor makes data files
+    if error is not None or (thumbnail_filename is None and makes_thumbnail):
+        status = STATUS_ERROR
+    else:
+        status = STATUS_READY
+    return (
+        normalize_path(file_path),
+        file_type,
+        st_size,
+        st_mtime_ns,
+        st_ino,
+        status,
+        thumbnail_filename,
+        data_filename,
+        content_hash,
+        error,
+        duration,
+        attempts,
+        retry_at,
     )
-    conn.commit()
-    conn.close()
+
+UPSERT_FILE_SQL = (
+    f'INSERT INTO files ({", ".join(FILE_COLUMNS)}) '
+    f'VALUES ({", ".join("?" for _ in FILE_COLUMNS)}) '
+    'ON CONFLICT (file_path) DO UPDATE SET '
+    + ', '.join(f'{column} = excluded.{column}' for column in FILE_COLUMNS[1:])
+)
+
+def upsert_file(
+    file_path: str|Path,
+    file_type: str|None,
+    stat_key: tuple[int, int, int],
+    thumbnail_filename: str|None,
+    data_filename: str|None,
+    content_hash: str|None=None,
+    error: str|None=None,
+    duration: float|None=None,
+    attempts: int|None=None,
+    retry_at: float|None=None,
+    makes_thumbnail: bool=True,
+):
+    """Insert or replace the entry for a processed file and commit to the database"""
+    conn = get_db_connection()
+    with conn:
+        conn.execute(
+            UPSERT_FILE_SQL,
+            make_file_row(
+                file_path, file_type, stat_key, thumbnail_filename, data_filename,
+                content_hash, error, duration, attempts, retry_at, makes_thumbnail,
+            )
+        )
+        conn.execute(BUMP_DATABASE_VERSION_SQL)
+
+def get_file_record(file_path: str|Path) -> sqlite3.Row|None:
+    """Return the files table row for file_path, or None if it has not been processed"""
+    cursor = get_read_connection().cursor()
+    cursor.row_factory = sqlite3.Row
+    return cursor.execute(
+        f'SELECT {", ".join(FILE_COLUMNS)} FROM files WHERE file_path = ?',
+        (normalize_path(file_path),)
+    ).fetchone()
+
+# Bound on the number of parameters in one IN (...) query
+MAX_QUERY_PARAMETERS = 500
+
+def get_file_records(normalized_paths: list[str]) -> dict[str, sqlite3.Row]:
+    """Return the files table rows for the given normalized paths, keyed by path"""
+    cursor = get_read_connection().cursor()
+    cursor.row_factory = sqlite3.Row
+    records = {}
+    for start in range(0, len(normalized_paths), MAX_QUERY_PARAMETERS):
+        chunk = normalized_paths[start:start + MAX_QUERY_PARAMETERS]
+        rows = cursor.execute(
+            f'SELECT {", ".join(FILE_COLUMNS)} FROM files '
+            f'WHERE file_path IN ({", ".join("?" for _ in chunk)})',
+            chunk
+        ).fetchall()
+        records.update((row['file_path'], row) for row in rows)
+    return records
 
 def get_thumbnail_filename(file_path: str|Path) -> str|None:
     """Return
         the filename of the thumbnail in config.resources_dir for computed thumbnails
         'processing' if the thumbnail is not computed yet (file_path missing from table)
-        'error' if there was an error computing the thumbnail (file_path exists, but no thumbnail)
+        'error' if there was an error computing the thumbnail
     """
-    conn = get_db_connection()
-    result = conn.execute(
-        'SELECT thumbnail_file FROM thumbnails WHERE file_path = ?',
-        (normalize_path(file_path),)
-    ).fetchone()
-    if result is None:
-        return 'processing'
-    if result[0] is None:
-        return 'error'
-    else:
-        return result[0]
+    return thumbnail_filename_from_record(get_file_record(file_path))
+
+def thumbnail_filename_from_record(record: sqlite3.Row|None) -> str|None:
+    """
+    Same as get_thumbnail_filename, for a row returned by get_file_record.
+    None for the files of processors that make no thumbnail.
+    """
+    if record is None or record['status'] == STATUS_PROCESSING:
+        return STATUS_PROCESSING
+    if record['status'] == STATUS_ERROR:
+        return STATUS_ERROR
+    return record['thumbnail_file']
 
 def thumbnail_exists_for_file(file_path: str|Path) -> bool:
-    conn = get_db_connection()
+    conn = get_read_connection()
     result = conn.execute(
-        'SELECT EXISTS (SELECT 1 FROM thumbnails WHERE file_path = ?)',
+        'SELECT EXISTS (SELECT 1 FROM files WHERE file_path = ?)',
         (normalize_path(file_path),)
     ).fetchone()
-    return result[0]
+    return bool(result[0])
 
-def insert_data_file(file_path: str|Path, data_filename: str):
+def get_data_filename(file_path: str|Path) -> str|None:
+    record = get_file_record(file_path)
+    if record is None:
+        return None
+    return record['data_file']
+
+def get_thumbnail_source(thumbnail_filename: str) -> str|None:
+    """Return the path of a file whose thumbnail is thumbnail_filename, if any"""
+    conn = get_read_connection()
+    row = conn.execute(
+        'SELECT file_path FROM files WHERE thumbnail_file = ? LIMIT 1',
+        (thumbnail_filename,)
+    ).fetchone()
+    return None if row is None else row[0]
+
+def find_content(content_hash: str, file_type: str) -> tuple[str, str|None]|None:
+    """
+    Return the (thumbnail_file, data_file) of a processed file of file_type
+    whose content hashes to content_hash, if any.
+    """
+    conn = get_read_connection()
+    return conn.execute(
+        'SELECT thumbnail_file, data_file FROM files '
+        'WHERE content_hash = ? AND file_type = ? AND status = ? LIMIT 1',
+        (content_hash, file_type, STATUS_READY)
+    ).fetchone()
+
+def rename_thumbnail(thumbnail_filename: str, new_thumbnail_filename: str):
+    """Make the files recorded with thumbnail_filename use new_thumbnail_filename"""
     conn = get_db_connection()
-    conn.execute(
-        'INSERT INTO data_files (file_path, data_file) VALUES (?,?)',
-        (normalize_path(file_path), data_filename)
+    with conn:
+        conn.execute(
+            'UPDATE files SET thumbnail_file = ? WHERE thumbnail_file = ?',
+            (new_thumbnail_filename, thumbnail_filename)
+        )
+        conn.execute(BUMP_DATABASE_VERSION_SQL)
+
+def get_referenced_thumbnails() -> set[str]:
+    """Return the filename of every thumbnail recorded for a file"""
+    conn = get_read_connection()
+    rows = conn.execute('SELECT DISTINCT thumbnail_file FROM files WHERE thumbnail_file IS NOT NULL')
+    return {row[0] for row in rows}
+
+def get_data_file_sources() -> dict[str, list[tuple[str, tuple[int, int, int]]]]:
+    """
+    Return a map of every data file recorded for a file to the
+    (file_path, stat key) of the files it was recorded for.
+    """
+    conn = get_read_connection()
+    rows = conn.execute(
+        'SELECT data_file, file_path, st_mtime_ns, st_size, st_ino FROM files '
+        'WHERE data_file IS NOT NULL'
     )
-    conn.commit()
-    conn.close()
+    sources = {}
+    for data_file, file_path, *stat_key in rows:
+        sources.setdefault(data_file, []).append((file_path, tuple(stat_key)))
+    return sources
 
-def get_data_filename(file_path: str|Path) -> str|None:
+def get_files_to_retry(now: float) -> list[str]:
+    """Return the files that failed to be processed and are due to be tried again"""
+    conn = get_read_connection()
+    rows = conn.execute(
+        'SELECT file_path FROM files WHERE retry_at <= ? ORDER BY retry_at',
+        (now,)
+    )
+    return [row[0] for row in rows]
+
+def get_indexed_files(under: str|None=None) -> dict[str, tuple[int, int, int]]:
+    """
+    Return a map of every indexed (normalized) file_path to its stat key,
+    or only of those under the normalized directory path under.
+    """
+    conn = get_read_connection()
+    if under is None:
+        rows = conn.execute(
+            'SELECT file_path, st_mtime_ns, st_size, st_ino FROM files'
+        ).fetchall()
+    else:
+        # Every path under p sorts between p + '/' and p + '0'
+        rows = conn.execute(
+            'SELECT file_path, st_mtime_ns, st_size, st_ino FROM files '
+            'WHERE file_path > ? AND file_path < ?',
+            (f'{under}/', f'{under}0')
+        ).fetchall()
+    return {row[0]: tuple(row[1:]) for row in rows}
+
+def delete_files(normalized_paths: list[str]):
+    """Remove every database entry for the given normalized file paths"""
     conn = get_db_connection()
-    result = conn.execute(
-        'SELECT data_file FROM data_files WHERE file_path = ?',
-        (normalize_path(file_path),)
-    ).fetchone()
-    if result is None:
+    with conn:
+        conn.executemany('DELETE FROM files WHERE file_path = ?', [(p,) for p in normalized_paths])
+        conn.execute(BUMP_DATABASE_VERSION_SQL)
+
+def request_paths(normalized_paths: list[str]):
+    """
+    Ask the builder to process these files, or the files in these
+    directories, first, the first path most urgently.  This is best
+    effort: nothing is requested if the database is busy.
+    """
+    if not normalized_paths:
+        return
+    conn = get_db_connection()
+    requested_at = time.time()
+    try:
+        with conn:
+            conn.executemany(
+                'INSERT OR REPLACE INTO requested_paths (path, requested_at) VALUES (?, ?)',
+                [(p, requested_at - i * 1e-6) for i, p in enumerate(normalized_paths)]
+            )
+    except sqlite3.OperationalError:
+        pass
+
+def pop_requested_paths() -> list[str]:
+    """Remove and return every requested path, most recently requested first"""
+    conn = get_db_connection()
+    with conn:
+        rows = conn.execute(
+            'SELECT path FROM requested_paths ORDER BY requested_at DESC'
+        ).fetchall()
+        conn.executemany('DELETE FROM requested_paths WHERE path = ?', rows)
+    return [row[0] for row in rows]
+
+def record_thumbnail_accesses(accesses: dict[str, float]):
+    """
+    Record the times thumbnails were last served, by filename.  Like
+    request_paths this is best effort, nothing is recorded if the database
+    is busy.
+    """
+    if not accesses:
+        return
+    conn = get_db_connection()
+    try:
+        with conn:
+            conn.executemany(
+                'INSERT INTO thumbnail_accesses (thumbnail_file, accessed_at) VALUES (?, ?) '
+                'ON CONFLICT (thumbnail_file) DO UPDATE SET '
+                'accessed_at = max(accessed_at, excluded.accessed_at)',
+                accesses.items()
+            )
+    except sqlite3.OperationalError:
+        pass
+
+def get_thumbnail_accesses() -> dict[str, float]:
+    """Return when each thumbnail was last served, by filename"""
+    conn = get_read_connection()
+    return dict(conn.execute('SELECT thumbnail_file, accessed_at FROM thumbnail_accesses'))
+
+def delete_thumbnail_accesses(thumbnail_filenames: list[str]):
+    conn = get_db_connection()
+    with conn:
+        conn.executemany(
+            'DELETE FROM thumbnail_accesses WHERE thumbnail_file = ?',
+            [(f,) for f in thumbnail_filenames]
+        )
+
+class ThumbnailAccessLog:
+    """
+    Access times of the thumbnails served by the web server, kept in memory
+    and written with record_thumbnail_accesses at most every
+    flush_interval seconds, so serving a thumbnail does not write to the
+    database.
+    """
+
+    def __init__(self, flush_interval: float=10.0):
+        self.flush_interval = flush_interval
+        self._accesses = {}
+        self._last_flush_time = time.monotonic()
+        self._lock = threading.Lock()
+
+    def record(self, thumbnail_filename: str):
+        now = time.monotonic()
+        with self._lock:
+            self._accesses[thumbnail_filename] = time.time()
+            if now - self._last_flush_time < self.flush_interval:
+                return
+            accesses = self._accesses
+            self._accesses = {}
+            self._last_flush_time = now
+        record_thumbnail_accesses(accesses)
+
+    def flush(self):
+        with self._lock:
+            accesses = self._accesses
+            self._accesses = {}
+            self._last_flush_time = time.monotonic()
+        record_thumbnail_accesses(accesses)
+
+class DatabaseWriter:
+    """
+    Bulk writer for the builder.
+
+    Holds a single connection in WAL mode and queues rows in memory,
+    writing them with executemany and committing once batch_rows rows
+    are queued or batch_ms milliseconds have passed since the first
+    queued row, whichever comes first.  Within a batch the deletes are
+    applied before the upserts, so deleting a path with a queued upsert
+    flushes the batch first.  Use as a context manager so the last
+    batch is flushed on exit.
+    """
+
+    def __init__(self, batch_rows: int=1000, batch_ms: int=1000):
+        if DATABASE_PATH is None:
+            raise RuntimeError('DATABASE_PATH has not been set')
+        self.batch_rows = batch_rows
+        self.batch_ms = batch_ms
+        self.conn = sqlite3.connect(DATABASE_PATH)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        # A crash can lose the last commits but never corrupts the database
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self._deleted_paths = []
+        self._deleted_trees = []
+        self._file_rows = {}
+        self._pending_rows = 0
+        self._first_pending_time = None
+
+    def __enter__(self) -> 'DatabaseWriter':
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def upsert_file(
+        self,
+        file_path: str|Path,
+        file_type: str|None,
+        stat_key: tuple[int, int, int],
+        thumbnail_filename: str|None,
+        data_filename: str|None,
+        content_hash: str|None=None,
+        error: str|None=None,
+        duration: float|None=None,
+        attempts: int|None=None,
+        retry_at: float|None=None,
+        makes_thumbnail: bool=True,
+    ):
+        row = make_file_row(
+            file_path, file_type, stat_key, thumbnail_filename, data_filename,
+            content_hash, error, duration, attempts, retry_at, makes_thumbnail,
+        )
+        # A later upsert of the same path in this batch supersedes the earlier one
+        self._file_rows[row[0]] = row
+        self._row_added()
+
+    def delete_files(self, normalized_paths: list[str]):
+        if not self._file_rows.keys().isdisjoint(normalized_paths):
+            self.flush()
+        self._deleted_paths.extend((p,) for p in normalized_paths)
+        self._row_added(len(normalized_paths))
+
+    def delete_trees(self, normalized_paths: list[str]):
+        """Delete the entries for the given paths and for everything under them"""
+        deleted = set(normalized_paths)
+        prefixes = tuple(f'{p}/' for p in normalized_paths)
+        if any(p in deleted or p.startswith(prefixes) for p in self._file_rows):
+            self.flush()
+        # Every path under p sorts between p + '/' and p + '0'
+        self._deleted_trees.extend((p, f'{p}/', f'{p}0') for p in normalized_paths)
+        self._row_added(len(normalized_paths))
+
+    def _row_added(self, n_rows: int=1):
+        if self._first_pending_time is None:
+            self._first_pending_time = time.monotonic()
+        self._pending_rows += n_rows
+        if self._pending_rows >= self.batch_rows:
+            self.flush()
+        else:
+            self.flush_if_due()
+
+    def flush_if_due(self) -> float|None:
+        """
+        Flush if batch_ms milliseconds have passed since the first queued
+        row, and return the time.monotonic() time the queued rows are due,
+        or None if there are none.  Called while waiting for rows, so they
+        are committed in time even when no more rows come.
+        """
+        if self._first_pending_time is None:
+            return None
+        due_time = self._first_pending_time + self.batch_ms / 1000
+        if time.monotonic() < due_time:
+            return due_time
+        self.flush()
         return None
-    else:
-        return result[0]
\ No newline at end of file
+
+    def flush(self):
+        """Write and commit every queued row"""
+        if self._pending_rows == 0:
+            return
+        with self.conn:
+            self.conn.executemany('DELETE FROM files WHERE file_path = ?', self._deleted_paths)
+            self.conn.executemany(
+                'DELETE FROM files WHERE file_path = ? OR (file_path > ? AND file_path < ?)',
+                self._deleted_trees
+            )
+            self.conn.executemany(UPSERT_FILE_SQL, self._file_rows.values())
+            self.conn.execute(BUMP_DATABASE_VERSION_SQL)
+        self._deleted_paths.clear()
+        self._deleted_trees.clear()
+        self._file_rows.clear()
+        self._pending_rows = 0
+        self._first_pending_time = None
+
+    def close(self):
+        self.flush()
+        self.conn.close()
@@ -4,11 +4,11 @@ import fitz
 from PIL import Image
 
 from fileexplorer.proc import ProcessorTemplate
-
-PDF_EXTENSIONS = ('.pdf',)
+from fileexplorer.registry import PDF_EXTENSIONS
 
 class PdfProcessor(ProcessorTemplate):
     extensions = PDF_EXTENSIONS
+    file_type = 'pdf'
 
     def make_thumbnail(
         self,
@@ -16,13 +16,7 @@ class PdfProcessor(ProcessorTemplate):
         thumbnails_dir: Path,
         thumbnail_size: tuple[int, int]
     ) -> str | None:
-        try:
-            pdf = fitz.open(file_path)
-            first_page = pdf.load_page(0)
-            pix = first_page.get_pixmap()
-            image = Image.frombytes("RGB", [pix.width, pix.height], pix.samples)
-        except Exception:
-            return None
+        image = self.open_thumbnail_image(file_path, self.decode_size(thumbnail_size))
         thumbnail_filename = self.write_thumbnail(
             image=image,
             thumbnails_dir=thumbnails_dir,
@@ -30,8 +24,59 @@ class PdfProcessor(ProcessorTemplate):
         )
         return thumbnail_filename
 
+    def open_thumbnail_image(self, file_path: Path, thumbnail_size: tuple[int, int]) -> Image.Image:
+        return render_first_page(file_path, thumbnail_size)
+
     def make_data_file(self, file_path: Path, data_files_dir: Path) -> str:
         return self.make_symlink_data_file(
             file_path=file_path,
             data_files_dir=data_files_dir
-        )
\ No newline at end of file
+        )
+
+def render_first_page(file_path: Path, thumbnail_size: tuple[int, int]) -> Image.Image:
+    """
+    Return an image of the first page of the PDF at file_path, no larger
+    than needed for a thumbnail of thumbnail_size.
+
+    The page's embedded thumbnail (/Thumb) is used when it is large enough.
+    Otherwise the page is rendered straight at the size that fits
+    thumbnail_size, without an alpha channel, rather than at 72 dpi, so a
+    large-format drawing never makes a multi-megapixel pixmap.
+    """
+    with fitz.open(file_path) as pdf:
+        first_page = pdf.load_page(0)
+        page_width, page_height = first_page.rect.width, first_page.rect.height
+        scale = min(thumbnail_size[0] / page_width, thumbnail_size[1] / page_height)
+        fitted_size = (round(page_width * scale), round(page_height * scale))
+        pix = get_embedded_thumbnail(pdf, first_page, fitted_size)
+        if pix is None:
+            pix = first_page.get_pixmap(
+                matrix=fitz.Matrix(scale, scale),
+                colorspace=fitz.csRGB,
+                alpha=False,
+            )
+        return Image.frombytes("RGB", (pix.width, pix.height), pix.samples)
+
+def get_embedded_thumbnail(
+    pdf: fitz.Document,
+    page: fitz.Page,
+    min_size: tuple[int, int],
+) -> fitz.Pixmap | None:
+    """
+    Return the /Thumb image of page as an RGB pixmap without alpha, or None
+    if it has none or it is smaller than min_size.  Thumbnails of rotated
+    pages are not used since they may or may not show the rotation.
+    """
+    if page.rotation:
+        return None
+    kind, value = pdf.xref_get_key(page.xref, "Thumb")
+    if kind != "xref":
+        return None
+    pix = fitz.Pixmap(pdf, int(value.split()[0]))
+    if pix.width < min_size[0] or pix.height < min_size[1]:
+        return None
+    if pix.alpha:
+        pix = fitz.Pixmap(pix, 0)
+    if pix.colorspace is None or pix.colorspace.n != 3:
+        pix = fitz.Pixmap(fitz.csRGB, pix)
+    return pix
@@ -1,12 +1,126 @@
 from abc import ABC, abstractmethod
+from collections.abc import Iterable
+import functools
 import hashlib
 import io
+import os
 from pathlib import Path
+import threading
 
-from PIL import Image
+from PIL import Image, features
+
+from fileexplorer.resource_names import (
+    THUMBNAIL_FORMAT_OPTIONS,
+    thumbnail_format_filename,
+    thumbnail_variant_filename,
+)
+from fileexplorer.thumbnail_pack import ThumbnailPack
+
+# Size of the chunks read when hashing a data file
+HASH_CHUNK_SIZE = 1024 * 1024
+# Algorithms provided by the optional xxhash package
+XXHASH_ALGORITHMS = ('xxh64', 'xxh3_64', 'xxh3_128', 'xxh128')
+
+def new_hash(algorithm: str):
+    """
+    Return a new hash object for algorithm, any name accepted by
+    hashlib.new or, when the xxhash package is installed, one of
+    XXHASH_ALGORITHMS.  blake2b and blake2s give 128 bit digests so the
+    filenames they make are as long as md5 ones.
+    """
+    if algorithm in XXHASH_ALGORITHMS:
+        import xxhash
+        return getattr(xxhash, algorithm)()
+    if algorithm in ('blake2b', 'blake2s'):
+        return hashlib.new(algorithm, digest_size=16)
+    return hashlib.new(algorithm)
+
+def hash_file(file_path: Path, algorithm: str="md5") -> str:
+    """
+    Return the hex digest of the content of file_path, read in chunks of
+    HASH_CHUNK_SIZE bytes so memory use does not depend on the file size.
+
+    Digests are cached on the file's (mtime, size, inode), so a file that
+    is hashed again without having changed is not read again.
+    """
+    stat_result = os.stat(file_path)
+    stat_key = (stat_result.st_mtime_ns, stat_result.st_size, stat_result.st_ino)
+    return _hash_file(os.fspath(file_path), stat_key, algorithm)
+
+@functools.lru_cache(maxsize=4096)
+def _hash_file(file_path: str, stat_key: tuple[int, int, int], algorithm: str) -> str:
+    file_hash = new_hash(algorithm)
+    buffer = bytearray(HASH_CHUNK_SIZE)
+    view = memoryview(buffer)
+    with open(file_path, "rb", buffering=0) as f:
+        while n_bytes := f.readinto(buffer):
+            file_hash.update(view[:n_bytes])
+    return file_hash.hexdigest()
+
+def thumbnail_format_available(thumbnail_format: str) -> bool:
+    """True if this Pillow can encode thumbnails in thumbnail_format"""
+    try:
+        return features.check(THUMBNAIL_FORMAT_OPTIONS[thumbnail_format][1])
+    except ValueError:
+        # A feature this version of Pillow does not know about
+        return False
+
+def encode_thumbnail(image: Image.Image, thumbnail_format: str="png") -> bytes:
+    """Encode image as PNG or as one of THUMBNAIL_FORMAT_OPTIONS"""
+    image_bytes_io = io.BytesIO()
+    if thumbnail_format == "png":
+        image.save(image_bytes_io, format="png")
+        return image_bytes_io.getvalue()
+    pillow_format, _, options = THUMBNAIL_FORMAT_OPTIONS[thumbnail_format]
+    has_alpha = image.mode in ("RGBA", "LA", "PA") or "transparency" in image.info
+    if pillow_format == "JPEG" and has_alpha:
+        # No alpha channel in JPEG, transparent pixels become white
+        rgba = image.convert("RGBA")
+        image = Image.new("RGB", image.size, "white")
+        image.paste(rgba, mask=rgba)
+    elif image.mode not in ("RGB", "RGBA"):
+        image = image.convert("RGBA" if has_alpha else "RGB")
+    image.save(image_bytes_io, format=pillow_format, **options)
+    return image_bytes_io.getvalue()
+
+def write_file_atomic(file_path: Path, data: bytes):
+    """Write a file through a temporary file so no reader sees it partly written"""
+    temporary_path = file_path.with_name(f".{file_path.name}.{os.getpid()}.{threading.get_ident()}")
+    with open(temporary_path, "wb") as f:
+        f.write(data)
+    os.replace(temporary_path, file_path)
 
 class ProcessorTemplate(ABC):
     extensions = ()
+    file_type = None
+
+    def __init__(
+        self,
+        hash_algorithm: str="md5",
+        thumbnail_sizes: Iterable[int]=(),
+        thumbnail_formats: Iterable[str]=(),
+        thumbnail_pack: ThumbnailPack | None=None,
+    ):
+        """
+        Parameters:
+        hash_algorithm (str): The hash used to name data files, see new_hash.
+        thumbnail_sizes (Iterable[int]): The sizes of the square boxes of the
+                                         variants written with every
+                                         thumbnail, see write_thumbnail.
+        thumbnail_formats (Iterable[str]): The formats of THUMBNAIL_FORMAT_OPTIONS
+                                           every thumbnail and variant is also
+                                           written in.  Those this Pillow
+                                           cannot encode are ignored.
+        thumbnail_pack (ThumbnailPack | None): The pack thumbnails are saved
+                                               in instead of thumbnails_dir.
+        """
+        self.hash_algorithm = hash_algorithm
+        self.thumbnail_sizes = tuple(sorted(set(thumbnail_sizes), reverse=True))
+        self.thumbnail_formats = tuple(
+            thumbnail_format for thumbnail_format in THUMBNAIL_FORMAT_OPTIONS
+            if thumbnail_format in thumbnail_formats and thumbnail_format_available(thumbnail_format)
+        )
+        self.thumbnail_pack = thumbnail_pack
 
     def can_process_file(self, file_path: Path) -> bool:
         """
@@ -20,6 +134,14 @@ class ProcessorTemplate(ABC):
         """
         return file_path.suffix.lower() in self.extensions
 
+    def decode_size(self, thumbnail_size: tuple[int, int]) -> tuple[int, int]:
+        """
+        Return the size an image must be opened at for write_thumbnail to
+        make a thumbnail of thumbnail_size and all of its variants.
+        """
+        largest = max(self.thumbnail_sizes, default=0)
+        return (max(thumbnail_size[0], largest), max(thumbnail_size[1], largest))
+
     def write_thumbnail(
         self,
         image: Image.Image,
@@ -27,7 +149,11 @@ class ProcessorTemplate(ABC):
         thumbnail_size: tuple[int, int],
     ) -> str:
         """
-        Generate and save a thumbnail for the provided image.
+        Generate and save a thumbnail for the provided image, and a variant
+        for each of thumbnail_sizes (see thumbnail_variant_filename).  The
+        image is shrunk step by step from the largest size to the smallest,
+        so it is decoded only once.  Each is saved as PNG and in each of
+        thumbnail_formats (see thumbnail_format_filename).
 
         Parameters:
         image (Image.Image): The image object to create a thumbnail from.
@@ -37,16 +163,96 @@ class ProcessorTemplate(ABC):
         Returns:
         str: The filename of the saved thumbnail.
         """
-        image.thumbnail(thumbnail_size)
-        image_bytes_io = io.BytesIO()
-        image.save(image_bytes_io, format="png")
-        image_bytes = image_bytes_io.getvalue()
+        boxes = [(thumbnail_size, None)] + [((size, size), size) for size in self.thumbnail_sizes]
+        boxes.sort(key=lambda box: max(box[0]), reverse=True)
+        encoded = {}
+        for box, size in boxes:
+            image.thumbnail(box)
+            for thumbnail_format in ("png", *self.thumbnail_formats):
+                encoded[size, thumbnail_format] = encode_thumbnail(image, thumbnail_format)
+        image_bytes = encoded.pop((None, "png"))
         md5 = hashlib.md5(image_bytes).hexdigest()
         thumbnail_filename = f"{md5}.png"
-        with open(thumbnails_dir / thumbnail_filename, "wb") as f:
-            f.write(image_bytes)
+        self.save_thumbnail(thumbnails_dir, thumbnail_filename, image_bytes)
+        for (size, thumbnail_format), data in encoded.items():
+            filename = thumbnail_filename
+            if size is not None:
+                filename = thumbnail_variant_filename(thumbnail_filename, size)
+            self.save_thumbnail(
+                thumbnails_dir,
+                thumbnail_format_filename(filename, thumbnail_format),
+                data,
+            )
         return thumbnail_filename
 
+    def hash_file(self, file_path: Path) -> str:
+        """The hash_algorithm digest of the content of file_path, that data files are named after"""
+        return hash_file(file_path, self.hash_algorithm)
+
+    def thumbnail_saved(self, thumbnails_dir: Path, filename: str) -> bool:
+        """Whether the thumbnail filename was saved, in thumbnail_pack if there is one"""
+        if self.thumbnail_pack is not None:
+            return filename in self.thumbnail_pack
+        return (thumbnails_dir / filename).exists()
+
+    def save_thumbnail(self, thumbnails_dir: Path, filename: str, data: bytes):
+        """
+        Save an encoded thumbnail in thumbnail_pack if there is one, and
+        otherwise in thumbnails_dir, unless it was already saved.  Since
+        thumbnails are named after their content, one with the same name
+        is the same.
+        """
+        if self.thumbnail_pack is not None:
+            self.thumbnail_pack.put(filename, data)
+        elif not (thumbnails_dir / filename).exists():
+            write_file_atomic(thumbnails_dir / filename, data)
+
+    def make_thumbnail_variant(
+        self,
+        file_path: Path,
+        thumbnails_dir: Path,
+        thumbnail_filename: str,
+        size: int,
+    ) -> str | None:
+        """
+        Make the variant of size of the thumbnail thumbnail_filename, made
+        for file_path, when it was not made with the thumbnail.
+
+        Returns:
+        str | None: The filename of the variant if created, otherwise None.
+        """
+        try:
+            image = self.open_thumbnail_image(file_path, (size, size))
+        except Exception:
+            return None
+        image.thumbnail((size, size))
+        variant_filename = thumbnail_variant_filename(thumbnail_filename, size)
+        # The PNG is written last, it is what tells the variant exists
+        for thumbnail_format in self.thumbnail_formats:
+            self.save_thumbnail(
+                thumbnails_dir,
+                thumbnail_format_filename(variant_filename, thumbnail_format),
+                encode_thumbnail(image, thumbnail_format),
+            )
+        self.save_thumbnail(thumbnails_dir, variant_filename, encode_thumbnail(image))
+        return variant_filename
+
+    @abstractmethod
+    def open_thumbnail_image(self, file_path: Path, thumbnail_size: tuple[int, int]) -> Image.Image:
+        """
+        Abstract method to open an image of a given file to make thumbnails from.
+
+        Parameters:
+        file_path (Path): The path of the file to create a thumbnail from.
+        thumbnail_size (tuple[int, int]): The largest dimensions the thumbnails
+                                          will be made at, so the image need
+                                          not be any larger.
+
+        Returns:
+        Image.Image: The image, at least as large as thumbnail_size if possible.
+        """
+        pass
+
     @abstractmethod
     def make_thumbnail(
         self,
@@ -66,6 +272,10 @@ class ProcessorTemplate(ABC):
 
         Returns:
         str | None: The filename of the thumbnail if created, otherwise None.
+
+        Raises:
+        Exception: Whatever kept the thumbnail from being made, so that the
+                   builder can record it.
         """
         pass
 
@@ -87,7 +297,8 @@ class ProcessorTemplate(ABC):
 
     def make_symlink_data_file(self, file_path: Path, data_files_dir: Path) -> str:
         """
-        Create a symbolic link for the given file in the specified directory.
+        Create a symbolic link for the given file in the specified directory,
+        named after the hash of the file content.
 
         Parameters:
         file_path (Path): The path of the file to create a symbolic link for.
@@ -97,11 +308,15 @@ class ProcessorTemplate(ABC):
         str: The filename of the symbolic link.
         """
         extension = file_path.suffix
-        with open(file_path, "rb") as f:
-            file_bytes = f.read()
-        md5 = hashlib.md5(file_bytes).hexdigest()
-        symlink_filename = f"{md5}{extension}"
+        digest = self.hash_file(file_path)
+        symlink_filename = f"{digest}{extension}"
         destination = data_files_dir / symlink_filename
         if not destination.exists():
-            destination.symlink_to(file_path)
+            # A dangling symlink left by a moved or deleted original is replaced
+            destination.unlink(missing_ok=True)
+            try:
+                destination.symlink_to(file_path)
+            except FileExistsError:
+                # Made by another worker in the meantime
+                pass
         return symlink_filename
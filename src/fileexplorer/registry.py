@@ -0,0 +1,84 @@
+"""
+Registry of the processors that make the thumbnails and data files.
+
+Every processor is described by a ProcessorSpec: the file type it
+records, the extensions it handles, what it makes and roughly how costly
+a file is, with the processor class named by 'module:attribute' so it is
+imported only by the processes that process files.  Besides the built-in
+ones, packages can add processors, for instance for TIFF, SVG or OBJ
+files, by exposing a ProcessorSpec as an entry point in the
+PROCESSOR_ENTRY_POINT_GROUP group:
+
+    [project.entry-points."fileexplorer.processors"]
+    tiff = "fileexplorer_tiff:TIFF_PROCESSOR"
+
+A processor registered later for an extension replaces the earlier one,
+so entry points can also replace built-in processors.
+"""
+import functools
+import importlib
+from importlib.metadata import entry_points
+from typing import TYPE_CHECKING, NamedTuple
+
+if TYPE_CHECKING:
+    from fileexplorer.proc import ProcessorTemplate
+
+PROCESSOR_ENTRY_POINT_GROUP = 'fileexplorer.processors'
+
+# What a processor makes
+THUMBNAIL = 'thumbnail'
+DATA_FILE = 'data_file'
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.gif', '.bmp',)
+PDF_EXTENSIONS = ('.pdf',)
+STL_EXTENSIONS = ('.stl',)
+
+class ProcessorSpec(NamedTuple):
+    """
+    file_type: recorded for the files processed and reported by file-info.
+    extensions: lowercase, with the leading dot.
+    processor: 'module:attribute' of the ProcessorTemplate subclass.
+    capabilities: THUMBNAIL if it makes thumbnails, files of those that do
+        not are recorded without one, and DATA_FILE if it makes data files.
+    cost: rough time to process a file relative to an image, used by the
+        builder to hand out work in batches of similar cost.
+    """
+    file_type: str
+    extensions: tuple[str, ...]
+    processor: str
+    capabilities: frozenset[str] = frozenset({THUMBNAIL, DATA_FILE})
+    cost: float = 1.0
+
+BUILTIN_PROCESSORS = (
+    ProcessorSpec('image', IMAGE_EXTENSIONS, 'fileexplorer.image_proc:ImageProcessor'),
+    ProcessorSpec('pdf', PDF_EXTENSIONS, 'fileexplorer.pdf_proc:PdfProcessor', cost=5.0),
+    # Rendering, and making the levels of detail of, large meshes
+    ProcessorSpec('stl', STL_EXTENSIONS, 'fileexplorer.stl_proc:StlProcessor', cost=10.0),
+)
+
+@functools.cache
+def get_processor_specs() -> tuple[ProcessorSpec, ...]:
+    """The built-in processors followed by those registered as entry points"""
+    specs = list(BUILTIN_PROCESSORS)
+    for entry_point in entry_points(group=PROCESSOR_ENTRY_POINT_GROUP):
+        spec = entry_point.load()
+        if not isinstance(spec, ProcessorSpec):
+            raise TypeError(f'Entry point {entry_point.name} is not a ProcessorSpec: {spec!r}')
+        specs.append(spec)
+    return tuple(specs)
+
+@functools.cache
+def get_extension_map() -> dict[str, ProcessorSpec]:
+    """Map every supported extension to the processor handling it"""
+    return {
+        extension.lower(): spec
+        for spec in get_processor_specs()
+        for extension in spec.extensions
+    }
+
+def get_supported_extensions() -> list[str]:
+    return list(get_extension_map())
+
+def load_processor_class(spec: ProcessorSpec) -> type['ProcessorTemplate']:
+    module_name, _, attribute = spec.processor.partition(':')
+    return getattr(importlib.import_module(module_name), attribute)
@@ -0,0 +1,276 @@
+"""
+Garbage collection of the resources directory.
+
+Thumbnails and data files are named after their content and shared by
+every file with that content, so nothing removes them when the files they
+were made for change or go away.  collect_garbage reconciles the
+resources directory with the database:
+
+- the thumbnails, with their variants and encodings, and the data files,
+  with their levels of detail, that no file is recorded with are removed,
+- data file symlinks left dangling by a moved or deleted original are
+  pointed at an unchanged file with the same content, or removed,
+- with a thumbnail budget, the least recently served thumbnails are
+  removed until the rest fit in it.  Their files keep their records and
+  the web server makes them again when they are next requested, under the
+  same name since they are made from the same content.
+
+Resources made less than grace_period seconds ago are never removed as
+orphans, since the builder saves them before it records them.
+
+Run it offline, with the web server and the builder stopped, to also
+compact the thumbnail pack:
+
+    python -m fileexplorer.resource_gc --database-path instance/files.db \\
+        --resources-dir instance/resources --thumbnail-budget 1000000000
+
+or online, every GC_INTERVAL seconds, see collect_garbage_async.
+"""
+import argparse
+import atexit
+from dataclasses import dataclass
+import logging
+import multiprocessing
+import os
+from pathlib import Path
+import time
+
+from flask import Flask
+
+from fileexplorer import models
+from fileexplorer.models import (
+    create_tables,
+    delete_thumbnail_accesses,
+    file_stat_key,
+    get_data_file_sources,
+    get_referenced_thumbnails,
+    get_thumbnail_accesses,
+)
+from fileexplorer.resource_names import resource_stem
+from fileexplorer.thumbnail_pack import INDEX_FILENAME, ThumbnailPack, compact_thumbnail_pack
+
+ORPHAN_GRACE_PERIOD = 3600.0
+
+logger = logging.getLogger(__name__)
+
+@dataclass
+class GarbageCollectionStats:
+    orphans_removed: int = 0
+    symlinks_repaired: int = 0
+    symlinks_removed: int = 0
+    thumbnails_evicted: int = 0
+    bytes_freed: int = 0
+
+    def __str__(self) -> str:
+        return (
+            f'{self.orphans_removed} orphans removed, {self.symlinks_repaired} symlinks repaired, '
+            f'{self.symlinks_removed} removed, {self.thumbnails_evicted} thumbnails evicted, '
+            f'{self.bytes_freed / 1e6:.1f} MB freed'
+        )
+
+def collect_garbage_async(app: Flask):
+    """
+    Collect garbage every GC_INTERVAL seconds in a process of its own,
+    until the process that started it exits.  Not started unless
+    GC_INTERVAL is set.  The thumbnail pack is not compacted.
+    """
+    interval = float(app.config.get('GC_INTERVAL', 0))
+    if interval <= 0:
+        return
+    process = multiprocessing.Process(
+        target=collect_garbage_periodically,
+        args=(app.config['DATABASE_PATH'], Path(app.config['RESOURCES_DIR']), interval),
+        kwargs={'thumbnail_budget': int(app.config.get('THUMBNAIL_BUDGET', 0))},
+    )
+    process.start()
+    atexit.register(process.terminate)
+
+def collect_garbage_periodically(
+    database_path: str,
+    resources_dir: Path,
+    interval: float,
+    thumbnail_budget: int=0,
+):
+    models.DATABASE_PATH = database_path
+    create_tables()
+    parent_pid = os.getppid()
+    next_time = time.monotonic() + interval
+    while os.getppid() == parent_pid:
+        if time.monotonic() < next_time:
+            time.sleep(min(1.0, next_time - time.monotonic()))
+            continue
+        stats = collect_garbage(resources_dir, thumbnail_budget)
+        logger.info('Collected the garbage of %s: %s', resources_dir, stats)
+        next_time = time.monotonic() + interval
+
+def collect_garbage(
+    resources_dir: Path,
+    thumbnail_budget: int=0,
+    compact_pack: bool=False,
+    grace_period: float=ORPHAN_GRACE_PERIOD,
+) -> GarbageCollectionStats:
+    """
+    Reconcile resources_dir with the database, see the module docstring.
+    Thumbnails are evicted once the thumbnails take more than
+    thumbnail_budget bytes, unless it is 0.  Those in the thumbnail pack
+    are only removed, and counted in the budget, with compact_pack, which
+    must only be used while no other process has the pack open.
+    """
+    resources_dir = Path(resources_dir)
+    stats = GarbageCollectionStats()
+    cutoff = time.time() - grace_period
+    collect_data_files(resources_dir / 'files', cutoff, stats)
+    collect_thumbnails(resources_dir, thumbnail_budget, compact_pack, cutoff, stats)
+    return stats
+
+def collect_data_files(files_dir: Path, cutoff: float, stats: GarbageCollectionStats):
+    sources = get_data_file_sources()
+    recorded_stems = {resource_stem(data_file) for data_file in sources}
+    for entry in scan_resources(files_dir):
+        try:
+            stat_result = entry.stat(follow_symlinks=False)
+        except FileNotFoundError:
+            continue
+        if entry.name.startswith('.') or resource_stem(entry.name) not in recorded_stems:
+            # Temporary files of killed processes too
+            if stat_result.st_mtime < cutoff:
+                remove_resource(entry.path, stat_result.st_size, stats)
+                stats.orphans_removed += 1
+            continue
+        if not entry.is_symlink() or os.path.exists(entry.path):
+            continue
+        source = find_unchanged_source(sources.get(entry.name, ()))
+        if source is None:
+            remove_resource(entry.path, stat_result.st_size, stats)
+            stats.symlinks_removed += 1
+        else:
+            replace_symlink(Path(entry.path), source)
+            stats.symlinks_repaired += 1
+
+def find_unchanged_source(sources: list[tuple[str, tuple[int, int, int]]]) -> str | None:
+    """The first file_path of sources that still has the stat key it was recorded with"""
+    for file_path, stat_key in sources:
+        try:
+            if file_stat_key(os.stat(file_path)) == stat_key:
+                return file_path
+        except OSError:
+            continue
+    return None
+
+def replace_symlink(link_path: Path, target: str):
+    temporary_path = link_path.with_name(f'.{link_path.name}.{os.getpid()}')
+    temporary_path.unlink(missing_ok=True)
+    temporary_path.symlink_to(target)
+    os.replace(temporary_path, link_path)
+
+def collect_thumbnails(
+    resources_dir: Path,
+    thumbnail_budget: int,
+    compact_pack: bool,
+    cutoff: float,
+    stats: GarbageCollectionStats,
+):
+    """
+    Remove the thumbnails no file is recorded with, and then the least
+    recently served ones over thumbnail_budget.  A thumbnail goes with its
+    variants and encodings, which are named after the same digest.
+    """
+    # Total size, and time the last one was made, of the files of each
+    # thumbnail by digest
+    sizes = {}
+    made_at = {}
+    files = {}
+    for entry in scan_resources(resources_dir / 'thumbnails'):
+        try:
+            stat_result = entry.stat(follow_symlinks=False)
+        except FileNotFoundError:
+            continue
+        if entry.name.startswith('.'):
+            if stat_result.st_mtime < cutoff:
+                remove_resource(entry.path, stat_result.st_size, stats)
+                stats.orphans_removed += 1
+            continue
+        stem = resource_stem(entry.name)
+        sizes[stem] = sizes.get(stem, 0) + stat_result.st_size
+        made_at[stem] = max(made_at.get(stem, 0.0), stat_result.st_mtime)
+        files.setdefault(stem, []).append((entry.path, stat_result.st_size))
+    packed = compact_pack and (resources_dir / INDEX_FILENAME).exists()
+    if packed:
+        with ThumbnailPack(resources_dir) as pack:
+            for name, size in pack.sizes().items():
+                stem = resource_stem(name)
+                sizes[stem] = sizes.get(stem, 0) + size
+                made_at.setdefault(stem, 0.0)
+
+    recorded_stems = {resource_stem(filename) for filename in get_referenced_thumbnails()}
+    removed_stems = {
+        stem for stem in sizes
+        if stem not in recorded_stems and made_at[stem] < cutoff
+    }
+    stats.orphans_removed += len(removed_stems)
+    accesses = {}
+    for filename, accessed_at in get_thumbnail_accesses().items():
+        stem = resource_stem(filename)
+        accesses[stem] = max(accesses.get(stem, 0.0), accessed_at)
+    if thumbnail_budget > 0:
+        total_size = sum(size for stem, size in sizes.items() if stem not in removed_stems)
+        # Never served ones by the time they were made
+        kept_stems = sorted(
+            (stem for stem in sizes if stem not in removed_stems),
+            key=lambda stem: accesses.get(stem, made_at[stem]),
+        )
+        for stem in kept_stems:
+            if total_size <= thumbnail_budget:
+                break
+            removed_stems.add(stem)
+            total_size -= sizes[stem]
+            stats.thumbnails_evicted += 1
+
+    for stem in removed_stems:
+        for file_path, size in files.get(stem, ()):
+            remove_resource(file_path, size, stats)
+    if packed:
+        stats.bytes_freed += compact_thumbnail_pack(
+            resources_dir,
+            lambda name: resource_stem(name) not in removed_stems,
+        )
+    # Those of thumbnails no file is recorded with too, which were never
+    # saved or were removed as orphans
+    delete_thumbnail_accesses([
+        filename for filename in get_thumbnail_accesses()
+        if resource_stem(filename) in removed_stems or resource_stem(filename) not in recorded_stems
+    ])
+
+def scan_resources(directory: Path) -> list[os.DirEntry]:
+    try:
+        with os.scandir(directory) as it:
+            return list(it)
+    except FileNotFoundError:
+        return []
+
+def remove_resource(file_path: str, size: int, stats: GarbageCollectionStats):
+    try:
+        os.unlink(file_path)
+    except FileNotFoundError:
+        return
+    stats.bytes_freed += size
+
+def main():
+    parser = argparse.ArgumentParser(description='Collect the garbage of a resources directory')
+    parser.add_argument('--database-path', required=True)
+    parser.add_argument('--resources-dir', required=True, type=Path)
+    parser.add_argument('--thumbnail-budget', type=int, default=0, help='in bytes, 0 for no budget')
+    parser.add_argument('--grace-period', type=float, default=ORPHAN_GRACE_PERIOD, help='in seconds')
+    args = parser.parse_args()
+    models.DATABASE_PATH = args.database_path
+    create_tables()
+    stats = collect_garbage(
+        args.resources_dir,
+        args.thumbnail_budget,
+        compact_pack=True,
+        grace_period=args.grace_period,
+    )
+    print(stats)
+
+if __name__ == '__main__':
+    main()
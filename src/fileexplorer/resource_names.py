@@ -0,0 +1,53 @@
+"""
+Names of the thumbnails and data files made in the resources directory.
+
+The web server finds the resources it serves with these alone, so this
+module must not import the processing libraries (Pillow, PyMuPDF, numpy,
+numpy-stl), which only the builder needs.
+"""
+from pathlib import Path
+
+# Pillow format, Pillow feature and save options of the formats thumbnails
+# can be encoded in besides PNG, by order of preference for clients that
+# accept several
+THUMBNAIL_FORMAT_OPTIONS = {
+    'avif': ('AVIF', 'avif', {'quality': 60}),
+    'webp': ('WEBP', 'webp', {'quality': 80, 'method': 4}),
+    'jpeg': ('JPEG', 'jpg', {'quality': 85, 'optimize': True}),
+}
+
+MESH_EXTENSION = '.mesh'
+# Triangle budgets of the decimated levels of detail, coarsest first.
+# The full resolution mesh is always made as the last level.
+MESH_LOD_TRIANGLES = (10_000, 100_000)
+
+def resource_stem(filename: str) -> str:
+    """
+    Return the digest a thumbnail or data file is named after, which its
+    variants, encodings and levels of detail are named after too.
+    """
+    return filename.split('.', 1)[0]
+
+def thumbnail_variant_filename(thumbnail_filename: str, size: int) -> str:
+    """
+    Return the filename of the variant of a thumbnail that fits in a size
+    by size box.  Variants are named after the thumbnail they were made
+    with, so they can be found from the filename recorded in the database.
+    """
+    thumbnail_filename = Path(thumbnail_filename)
+    return f"{thumbnail_filename.stem}.{size}{thumbnail_filename.suffix}"
+
+def thumbnail_format_filename(thumbnail_filename: str, thumbnail_format: str) -> str:
+    """Return the filename of a PNG thumbnail or variant encoded in thumbnail_format"""
+    return Path(thumbnail_filename).with_suffix(f".{thumbnail_format}").name
+
+def mesh_lod_filenames(data_filename: str) -> list[tuple[int|None, str]]:
+    """
+    Return the (triangle budget, filename) of every level of detail that
+    may be made for the data file data_filename, coarsest first.  The
+    full resolution level has no budget.
+    """
+    stem = Path(data_filename).stem
+    filenames = [(budget, f'{stem}.{budget}{MESH_EXTENSION}') for budget in MESH_LOD_TRIANGLES]
+    filenames.append((None, f'{stem}{MESH_EXTENSION}'))
+    return filenames
@@ -1,11 +1,92 @@
+from collections.abc import Callable, Iterable, Iterator
+import heapq
+import json
+import mimetypes
+import os
 from pathlib import Path
+import secrets
+import sqlite3
+import stat
+import time
+from urllib.parse import quote
 
-from flask import Blueprint, jsonify, current_app, abort, send_from_directory, url_for
+from flask import (
+    Blueprint,
+    Response,
+    jsonify,
+    current_app,
+    abort,
+    g,
+    redirect,
+    request,
+    send_from_directory,
+    stream_with_context,
+    url_for,
+)
+from werkzeug.http import generate_etag
+from werkzeug.security import safe_join
 
-from fileexplorer.models import get_thumbnail_filename, get_data_filename
+from fileexplorer.db_builder import (
+    THUMBNAIL_FORMATS,
+    THUMBNAIL_SIZES,
+    get_file_cost,
+    get_retry_policy,
+    make_thumbnail_variant,
+    process_file_on_demand,
+    remake_thumbnail,
+)
+from fileexplorer.listing_cache import ListingEntry, scan_directory
+from fileexplorer.models import (
+    get_file_record,
+    get_database_version,
+    get_file_records,
+    get_thumbnail_source,
+    file_stat_key,
+    normalize_path,
+    normalize_paths,
+    rename_thumbnail,
+    request_paths,
+    thumbnail_filename_from_record,
+)
+from fileexplorer.registry import get_extension_map
+from fileexplorer.resource_names import (
+    THUMBNAIL_FORMAT_OPTIONS,
+    mesh_lod_filenames,
+    thumbnail_format_filename,
+    thumbnail_variant_filename,
+)
+from fileexplorer.thumbnail_pack import ThumbnailPack
 
 api = Blueprint('api', __name__)
 
+# Cache lifetime of the thumbnails and data files, which are named after
+# their content and so never change
+IMMUTABLE_MAX_AGE = 365 * 24 * 60 * 60
+
+def make_etag(*parts) -> str:
+    """Return an ETag for a response made from parts, without making it"""
+    return generate_etag(repr(parts).encode())
+
+def not_modified(etag: str) -> Response|None:
+    """Return a 304 response if the client has the response with etag"""
+    if not request.if_none_match.contains_weak(etag):
+        return None
+    response = Response(status=304)
+    set_revalidated(response, etag)
+    return response
+
+def set_revalidated(response: Response, etag: str):
+    """Make clients check response is still current before reusing it"""
+    response.set_etag(etag)
+    response.cache_control.no_cache = True
+
+def set_immutable(response: Response):
+    # send_from_directory asks for revalidation, which would defeat it
+    response.cache_control.no_cache = None
+    response.cache_control.public = True
+    response.cache_control.max_age = IMMUTABLE_MAX_AGE
+    response.cache_control.immutable = True
+
 @api.route('/directory-info/<path:relpath>', methods=['GET'])
 def directory_listing(relpath: str):
     if '..' in relpath or '\\' in relpath:
@@ -18,33 +99,151 @@ def rootdir_directory_listing():
     return get_directory_listing(relpath)
 
 def get_directory_listing(relpath: str):
+    """
+    List the files and directories in relpath.
+
+    Query parameters:
+    include=file_info: every file also gets its file info, looked up in a
+        single query per batch of files.
+    limit, cursor: return at most limit entries in name order, starting
+        after the name given as cursor.  The response's next_cursor is the
+        cursor of the next page, or null on the last page.
+    stream=1: send the listing as newline delimited JSON, a header line
+        with relpath and parts, one line per entry and a last line with
+        next_cursor.  Without limit, the entries are sent in directory
+        order as they are read so the first ones arrive immediately.
+
+    The ETag is made from the modification time of the directory and,
+    with file info, the database version, so a client revalidating the
+    listing gets a 304 without the directory being read.  File info of
+    a file changed in place is updated when the builder processes it.
+    """
     rootdir = Path(current_app.config['ROOT_DIR'])
     path = rootdir / relpath
-    if not path.is_dir():
+    try:
+        stat_result = path.stat()
+    except OSError:
         abort(404)
+    if not stat.S_ISDIR(stat_result.st_mode):
+        abort(404)
+    limit = request.args.get('limit', type=int)
+    if limit is not None and limit <= 0:
+        abort(400)
+    cursor = request.args.get('cursor')
+    include_file_info = 'file_info' in request.args.getlist('include')
+    etag = make_etag(
+        stat_result.st_mtime_ns,
+        stat_result.st_ino,
+        get_database_version() if include_file_info else None,
+    )
+    response = not_modified(etag)
+    if response is not None:
+        return response
+    if limit is None:
+        entries = iter_directory_entries(path)
+        next_cursor = None
+    else:
+        entries = get_directory_page(path, limit, cursor)
+        next_cursor = entries[-1].name if len(entries) == limit else None
+    parts = url_for('api.directory_parts', relpath=relpath)
+    children = iter_children_data(rootdir, Path(relpath), entries, include_file_info)
+    if request.args.get('stream', type=int):
+        response = stream_directory_listing(relpath, parts, children, next_cursor)
+        set_revalidated(response, etag)
+        return response
     files = []
     directories = []
-    for child_path in path.glob('*'):
-        child_relpath = child_path.relative_to(rootdir)
-        child_data = {'name': child_path.name, 'relpath': child_relpath.as_posix()}
-        if child_path.is_file():
-            child_data['link'] = url_for(
-                'api.file_info',
-                relpath=child_relpath.as_posix()
-            )
+    for child_type, child_data in children:
+        if child_type == 'file':
             files.append(child_data)
-        elif child_path.is_dir():
-            child_data['link'] = url_for(
-                'api.directory_listing',
-                relpath=child_relpath.as_posix(),
-            )
+        else:
             directories.append(child_data)
-    return jsonify({
+    response = jsonify({
         'relpath': relpath,
         'files': files,
         'directories': directories,
-        'parts': url_for('api.directory_parts', relpath=relpath)
+        'parts': parts,
+        'next_cursor': next_cursor,
     })
+    set_revalidated(response, etag)
+    return response
+
+# Number of files whose file info is looked up together
+FILE_INFO_BATCH_SIZE = 500
+
+def iter_directory_entries(path: Path) -> Iterator[ListingEntry]:
+    """Yield the files and directories in path, from the listing cache if enabled"""
+    listing_cache = current_app.extensions.get('fileexplorer_listing_cache')
+    if listing_cache is None:
+        return scan_directory(path)
+    return listing_cache.iter_entries(path)
+
+def get_directory_page(path: Path, limit: int, cursor: str|None) -> list[ListingEntry]:
+    """
+    Return the first limit entries of path in name order whose name comes
+    after cursor, holding no more than limit entries in memory.
+    """
+    entries = iter_directory_entries(path)
+    if cursor is not None:
+        entries = (entry for entry in entries if entry.name > cursor)
+    return heapq.nsmallest(limit, entries, key=lambda entry: entry.name)
+
+def iter_children_data(
+    rootdir: Path,
+    relpath: Path,
+    entries: Iterable[ListingEntry],
+    include_file_info: bool
+) -> Iterator[tuple[str, dict]]:
+    """Yield ('file' or 'directory', child_data) for each directory entry"""
+    file_info_link = make_link_builder('api.file_info')
+    directory_link = make_link_builder('api.directory_listing')
+    pending_files = []
+    for entry in entries:
+        child_relpath = (relpath / entry.name).as_posix()
+        child_data = {'name': entry.name, 'relpath': child_relpath}
+        if not entry.is_dir:
+            child_data['link'] = file_info_link(child_relpath)
+            if not include_file_info:
+                yield 'file', child_data
+                continue
+            pending_files.append(child_data)
+            if len(pending_files) == FILE_INFO_BATCH_SIZE:
+                yield from attach_files_info(rootdir, pending_files)
+                pending_files = []
+        else:
+            child_data['link'] = directory_link(child_relpath)
+            yield 'directory', child_data
+    yield from attach_files_info(rootdir, pending_files)
+
+def attach_files_info(rootdir: Path, files: list[dict]) -> Iterator[tuple[str, dict]]:
+    files_info = get_files_info(rootdir, [f['relpath'] for f in files])
+    for child_data, child_info in zip(files, files_info):
+        child_data['file_info'] = child_info
+        yield 'file', child_data
+
+def make_link_builder(endpoint: str) -> Callable[[str], str]:
+    """
+    Return a function making the url of endpoint for a relpath, the same
+    as url_for(endpoint, relpath=relpath) but without building every url
+    from scratch.
+    """
+    placeholder = 'relpath-placeholder'
+    prefix = url_for(endpoint, relpath=placeholder)[:-len(placeholder)]
+    # Characters left unquoted by werkzeug's path converter
+    return lambda relpath: prefix + quote(relpath, safe="!$&'()*+,/:;=@")
+
+def stream_directory_listing(
+    relpath: str,
+    parts: str,
+    children: Iterator[tuple[str, dict]],
+    next_cursor: str|None
+) -> Response:
+    def generate():
+        yield json.dumps({'relpath': relpath, 'parts': parts}) + '\n'
+        for child_type, child_data in children:
+            yield json.dumps({'type': child_type, **child_data}) + '\n'
+        yield json.dumps({'next_cursor': next_cursor}) + '\n'
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
 
 @api.route('/file-info/<path:relpath>', methods=['GET'])
 def file_info(relpath: str):
@@ -52,57 +251,510 @@ def file_info(relpath: str):
         abort(404)
     rootdir = Path(current_app.config['ROOT_DIR'])
     path = rootdir / relpath
-    if not path.is_file():
+    try:
+        stat_result = path.stat()
+    except OSError:
         abort(404)
-    return jsonify({
+    if not stat.S_ISREG(stat_result.st_mode):
+        abort(404)
+    normalized_path = normalize_path(path)
+    record = get_file_record(path)
+    if record is None:
+        records = {}
+        catch_up_unprocessed_files([(path, normalized_path)], records)
+        record = records.get(normalized_path)
+    etag = make_etag(file_stat_key(stat_result), None if record is None else tuple(record))
+    response = not_modified(etag)
+    if response is None:
+        response = jsonify(make_file_info(relpath, path, stat_result, record))
+        set_revalidated(response, etag)
+    return response
+
+@api.route('/file-info/', methods=['POST'])
+def batch_file_info():
+    """
+    File info for many files in one request.  The JSON body is
+    {"relpaths": [...]} and the response is {"files": [...]} in the same
+    order, with null for any relpath that is not an existing file.
+    """
+    body = request.get_json(silent=True)
+    relpaths = body.get('relpaths') if isinstance(body, dict) else None
+    if not isinstance(relpaths, list) or not all(isinstance(r, str) for r in relpaths):
+        abort(400)
+    rootdir = Path(current_app.config['ROOT_DIR'])
+    return jsonify({'files': get_files_info(rootdir, relpaths)})
+
+def get_files_info(rootdir: Path, relpaths: list[str]) -> list[dict|None]:
+    """File info for every relpath, with a single database query for all of them"""
+    found = []
+    for i, relpath in enumerate(relpaths):
+        if '..' in relpath or '\\' in relpath or relpath.startswith('/'):
+            continue
+        path = rootdir / relpath
+        try:
+            stat_result = path.stat()
+        except OSError:
+            continue
+        if stat.S_ISREG(stat_result.st_mode):
+            found.append((i, path, stat_result))
+    normalized_paths = normalize_paths([path for _, path, _ in found])
+    records = get_file_records(normalized_paths)
+    catch_up_unprocessed_files(
+        [(path, normalized_path) for (_, path, _), normalized_path in zip(found, normalized_paths)],
+        records,
+    )
+    files_info = [None] * len(relpaths)
+    for (i, path, stat_result), normalized_path in zip(found, normalized_paths):
+        record = records.get(normalized_path)
+        files_info[i] = make_file_info(relpaths[i], path, stat_result, record)
+    return files_info
+
+def catch_up_unprocessed_files(files: list[tuple[Path, str]], records: dict[str, sqlite3.Row]):
+    """
+    Get the files of (path, normalized path) files that have no record,
+    and so have not been processed yet, done sooner than the walk of the
+    builder would.  Until ON_DEMAND_BUDGET seconds have passed they are
+    processed in this process and their records added to records, but for
+    those costing more than ON_DEMAND_MAX_COST images, PDF and STL files
+    by default, which could hold the request thread for long.  The builder
+    is asked to process the others first, and then the files next to them,
+    in its workers, which are given a timeout and a memory limit.
+    """
+    supported_extensions = current_app.config['SUPPORTED_EXTENSIONS']
+    unprocessed = [
+        (path, normalized_path) for path, normalized_path in files
+        if normalized_path not in records and path.suffix.lower() in supported_extensions
+    ]
+    if not unprocessed:
+        return
+    deadline = get_on_demand_deadline()
+    if deadline is not None:
+        max_cost = float(current_app.config.get('ON_DEMAND_MAX_COST', 1.0))
+        processed = []
+        for path, normalized_path in unprocessed:
+            if time.monotonic() >= deadline:
+                break
+            if get_file_cost(path) > max_cost:
+                continue
+            process_file_on_demand(
+                path,
+                Path(current_app.config['RESOURCES_DIR']),
+                current_app.config.get('THUMBNAIL_FORMATS', THUMBNAIL_FORMATS),
+                bool(current_app.config.get('THUMBNAIL_PACK', False)),
+                current_app.config.get('HASH_ALGORITHM', 'md5'),
+                get_retry_policy(current_app.config),
+            )
+            processed.append(normalized_path)
+        records.update(get_file_records(processed))
+    remaining = [normalized_path for _, normalized_path in unprocessed if normalized_path not in records]
+    directories = dict.fromkeys(Path(normalized_path).parent.as_posix() for normalized_path in remaining)
+    request_paths(remaining + list(directories))
+
+def get_on_demand_deadline() -> float|None:
+    """
+    The time.monotonic() time until which files are processed on demand
+    for this request, ON_DEMAND_BUDGET seconds after the first time it is
+    asked for, however many batches of files the request looks up.  None
+    if ON_DEMAND_BUDGET is not set.
+    """
+    budget = float(current_app.config.get('ON_DEMAND_BUDGET', 0))
+    if budget <= 0:
+        return None
+    if 'on_demand_deadline' not in g:
+        g.on_demand_deadline = time.monotonic() + budget
+    return g.on_demand_deadline
+
+def make_file_info(
+    relpath: str,
+    path: Path,
+    stat_result: os.stat_result,
+    record: sqlite3.Row|None
+) -> dict:
+    return {
         'relpath': relpath,
         'name': path.name,
-        'st_size': path.stat().st_size,
+        'st_size': stat_result.st_size,
         'file_type': get_file_type(path),
-        'thumbnail_url': get_thumbnail_url(path),
-        'file_data_url': get_file_data_url(path)
-    })
+        'thumbnail_url': get_thumbnail_url(path, record),
+        'file_data_url': get_file_data_url(record),
+        'mesh_lod_urls': get_mesh_lod_urls(record),
+    }
 
 def get_file_type(path: Path) -> str:
-    extension = path.suffix.lower()
-    if extension in ['.png', '.jpg', '.jpeg', '.gif', '.bmp']:
-        return 'image'
-    if extension == '.pdf':
-        return 'pdf'
-    if extension == '.stl':
-        return 'stl'
-    return None
-
-def get_thumbnail_url(path: Path) -> str:
+    spec = get_extension_map().get(path.suffix.lower())
+    return None if spec is None else spec.file_type
+
+def get_thumbnail_url(path: Path, record: sqlite3.Row|None) -> str:
     if path.suffix.lower() not in current_app.config['SUPPORTED_EXTENSIONS']:
         return None
-    thumbnail_filename = get_thumbnail_filename(path)
+    thumbnail_filename = thumbnail_filename_from_record(record)
     # return something better in these cases?
     if thumbnail_filename in ['processing', 'error']:
         return thumbnail_filename
+    if thumbnail_filename is None:
+        # Its processor makes no thumbnail
+        return None
     return url_for(
         'api.serve_thumbnail',
         filename=thumbnail_filename,
     )
 
-def get_file_data_url(path: Path) -> str:
-    data_filename = get_data_filename(path)
-    if data_filename is None:
+def get_file_data_url(record: sqlite3.Row|None) -> str:
+    if record is None or record['data_file'] is None:
         return None
     return url_for(
         'api.serve_file_data',
-        filename=data_filename,
+        filename=record['data_file'],
     )
 
+def get_mesh_lod_urls(record: sqlite3.Row|None) -> list[str]|None:
+    """
+    Return the URLs of the levels of detail made for an STL file, coarsest
+    first and ending with the full resolution mesh, or None if there are
+    none and the viewer should load the original.
+    """
+    if record is None or record['file_type'] != 'stl' or record['data_file'] is None:
+        return None
+    files_dir = Path(current_app.config['RESOURCES_DIR']) / 'files'
+    urls = [
+        url_for('api.serve_file_data', filename=filename)
+        for _, filename in mesh_lod_filenames(record['data_file'])
+        if (files_dir / filename).exists()
+    ]
+    return urls or None
+
 @api.route('/thumbnails/<path:filename>', methods=['GET'])
 def serve_thumbnail(filename: str):
+    """
+    Serve a thumbnail, or with the size query parameter the variant of the
+    thumbnail that best fits a size by size box, in the best format the
+    client accepts.
+
+    Thumbnails are named after their content and cached for good, except
+    when another variant is served because the one of size could not be
+    made.  A thumbnail evicted by resource_gc is made again, and if it
+    does not come out the same, the client is redirected to the new one.
+    """
     thumbnails_dir = Path(current_app.config['RESOURCES_DIR']) / 'thumbnails'
-    return send_from_directory(thumbnails_dir, filename)
+    size = get_thumbnail_size_arg()
+    thumbnail_filename = filename
+    if not thumbnail_exists(thumbnails_dir, thumbnail_filename):
+        remade_filename = remake_evicted_thumbnail(thumbnail_filename)
+        if remade_filename is None:
+            abort(404)
+        if remade_filename != thumbnail_filename:
+            return redirect(url_for('api.serve_thumbnail', filename=remade_filename, **request.args))
+    # Not before, so requests for thumbnails that do not exist leave no trace
+    record_thumbnail_access(thumbnail_filename)
+    immutable = True
+    if size is not None:
+        filename = get_thumbnail_variant(thumbnail_filename, size)
+        nearest = nearest_thumbnail_size(size)
+        if nearest is not None:
+            immutable = filename == thumbnail_variant_filename(thumbnail_filename, nearest)
+    filename, mimetype = negotiate_thumbnail_format(thumbnails_dir, filename)
+    response = send_thumbnail(thumbnails_dir, filename, mimetype)
+    response.vary.add('Accept')
+    if immutable:
+        set_immutable(response)
+    else:
+        response.cache_control.no_cache = True
+    return response
+
+def get_thumbnail_size_arg() -> int|None:
+    """The size query parameter of a thumbnail request, aborting if invalid"""
+    size = request.args.get('size')
+    if size is None:
+        return None
+    try:
+        size = int(size)
+    except ValueError:
+        abort(400)
+    if size <= 0:
+        abort(400)
+    return size
+
+def record_thumbnail_access(thumbnail_filename: str):
+    """Note that a thumbnail was served, when resource_gc evicts thumbnails"""
+    access_log = current_app.extensions.get('fileexplorer_thumbnail_accesses')
+    if access_log is not None:
+        access_log.record(thumbnail_filename)
+
+def remake_evicted_thumbnail(thumbnail_filename: str) -> str|None:
+    """
+    Make a thumbnail evicted by resource_gc again, from a file recorded
+    with it, and return its filename, or None if there is no such file.
+    """
+    file_path = get_thumbnail_source(thumbnail_filename)
+    if file_path is None:
+        return None
+    remade_filename = remake_thumbnail(
+        Path(file_path),
+        Path(current_app.config['RESOURCES_DIR']),
+        current_app.config.get('THUMBNAIL_FORMATS', THUMBNAIL_FORMATS),
+        bool(current_app.config.get('THUMBNAIL_PACK', False)),
+        current_app.config.get('HASH_ALGORITHM', 'md5'),
+    )
+    if remade_filename is not None and remade_filename != thumbnail_filename:
+        # Made by another version of an image library
+        rename_thumbnail(thumbnail_filename, remade_filename)
+    return remade_filename
+
+def get_thumbnail_pack() -> ThumbnailPack|None:
+    return current_app.extensions.get('fileexplorer_thumbnail_pack')
+
+def thumbnail_exists(thumbnails_dir: Path, filename: str) -> bool:
+    """Whether the thumbnail filename is in the thumbnail pack or thumbnails_dir"""
+    thumbnail_pack = get_thumbnail_pack()
+    if thumbnail_pack is not None and filename in thumbnail_pack:
+        return True
+    return (thumbnails_dir / filename).exists()
+
+def read_thumbnail(thumbnails_dir: Path, filename: str) -> bytes|None:
+    thumbnail_pack = get_thumbnail_pack()
+    if thumbnail_pack is not None:
+        data = thumbnail_pack.get(filename)
+        if data is not None:
+            return data
+    try:
+        return (thumbnails_dir / filename).read_bytes()
+    except OSError:
+        return None
+
+def send_thumbnail(thumbnails_dir: Path, filename: str, mimetype: str|None) -> Response:
+    """
+    Send a thumbnail from the thumbnail pack, or from thumbnails_dir for
+    those made before the pack was enabled, with its filename as ETag.
+    """
+    thumbnail_pack = get_thumbnail_pack()
+    if thumbnail_pack is not None:
+        data = thumbnail_pack.get(filename)
+        if data is not None:
+            response = Response(data, mimetype=mimetype or 'image/png')
+            response.set_etag(filename)
+            return response.make_conditional(request)
+    return send_from_directory(thumbnails_dir, filename, mimetype=mimetype, etag=filename)
+
+def negotiate_thumbnail_format(thumbnails_dir: Path, thumbnail_filename: str) -> tuple[str, str|None]:
+    """
+    Return the filename and mimetype of the encoding of a PNG thumbnail to
+    serve, by order of THUMBNAIL_FORMAT_OPTIONS among the THUMBNAIL_FORMATS
+    that were made.  AVIF and WebP must be listed in the Accept header,
+    since */* is also sent by clients that cannot decode them.  The PNG is
+    served if no other encoding is accepted.
+    """
+    thumbnail_formats = current_app.config.get('THUMBNAIL_FORMATS', THUMBNAIL_FORMATS)
+    accept = request.accept_mimetypes
+    for thumbnail_format in THUMBNAIL_FORMAT_OPTIONS:
+        if thumbnail_format not in thumbnail_formats:
+            continue
+        mimetype = f'image/{thumbnail_format}'
+        if thumbnail_format == 'jpeg':
+            accepted = bool(accept) and accept.quality(mimetype) > 0
+        else:
+            accepted = any(value == mimetype and quality > 0 for value, quality in accept)
+        if not accepted:
+            continue
+        filename = thumbnail_format_filename(thumbnail_filename, thumbnail_format)
+        if thumbnail_exists(thumbnails_dir, filename):
+            return filename, mimetype
+    return thumbnail_filename, None
+
+def get_thumbnail_variant(thumbnail_filename: str, size: int, make_missing: bool=True) -> str:
+    """
+    Return the filename of the variant of thumbnail_filename for the
+    smallest of THUMBNAIL_SIZES at least as large as size, or the largest.
+    A variant that was not made during the build is made now, unless not
+    make_missing.  If it cannot be made, the nearest variant that exists
+    is used, and then the thumbnail itself.
+    """
+    resources_dir = Path(current_app.config['RESOURCES_DIR'])
+    thumbnails_dir = resources_dir / 'thumbnails'
+    sizes = sorted(current_app.config.get('THUMBNAIL_SIZES', THUMBNAIL_SIZES))
+    nearest = nearest_thumbnail_size(size)
+    if nearest is None:
+        return thumbnail_filename
+    variant_filename = thumbnail_variant_filename(thumbnail_filename, nearest)
+    if thumbnail_exists(thumbnails_dir, variant_filename):
+        return variant_filename
+    file_path = get_thumbnail_source(thumbnail_filename) if make_missing else None
+    if file_path is not None:
+        made_filename = make_thumbnail_variant(
+            Path(file_path),
+            resources_dir,
+            thumbnail_filename,
+            nearest,
+            current_app.config.get('THUMBNAIL_FORMATS', THUMBNAIL_FORMATS),
+            bool(current_app.config.get('THUMBNAIL_PACK', False)),
+            current_app.config.get('HASH_ALGORITHM', 'md5'),
+        )
+        if made_filename is not None:
+            return made_filename
+    for s in sorted(sizes, key=lambda s: abs(s - size)):
+        variant_filename = thumbnail_variant_filename(thumbnail_filename, s)
+        if thumbnail_exists(thumbnails_dir, variant_filename):
+            return variant_filename
+    return thumbnail_filename
+
+def nearest_thumbnail_size(size: int) -> int|None:
+    """The smallest of THUMBNAIL_SIZES at least as large as size, or the largest"""
+    sizes = sorted(current_app.config.get('THUMBNAIL_SIZES', THUMBNAIL_SIZES))
+    if not sizes:
+        return None
+    return next((s for s in sizes if s >= size), sizes[-1])
+
+@api.route('/directory-thumbnails/<path:relpath>', methods=['GET'])
+def directory_thumbnails(relpath: str):
+    if '..' in relpath or '\\' in relpath:
+        abort(404)
+    return get_directory_thumbnails(relpath)
+
+@api.route('/directory-thumbnails/', methods=['GET'])
+def rootdir_directory_thumbnails():
+    return get_directory_thumbnails('.')
+
+def get_directory_thumbnails(relpath: str) -> Response:
+    """
+    The thumbnails of the files in relpath that have one, in a single
+    multipart/form-data response, so a directory view needs one request
+    rather than one per file.  Each part is named after the
+    percent-encoded file name and holds the thumbnail, in the same size
+    and format /thumbnails/ would serve.  Files whose thumbnail is not
+    made yet are left out, and variants are not made for this request.
+
+    Query parameters:
+    size: as for /thumbnails/.
+    limit, cursor: as for /directory-info/, counting directories too.  A
+        last part named next_cursor holds the cursor of the next page.
+
+    Like the listing with file info, the ETag is made from the
+    modification time of the directory and the database version, and from
+    the query and Accept header too.  Variants made since are only sent
+    once the directory or the database changes.
+    """
+    rootdir = Path(current_app.config['ROOT_DIR'])
+    path = rootdir / relpath
+    try:
+        stat_result = path.stat()
+    except OSError:
+        abort(404)
+    if not stat.S_ISDIR(stat_result.st_mode):
+        abort(404)
+    limit = request.args.get('limit', type=int)
+    if limit is not None and limit <= 0:
+        abort(400)
+    cursor = request.args.get('cursor')
+    size = get_thumbnail_size_arg()
+    etag = make_etag(
+        stat_result.st_mtime_ns,
+        stat_result.st_ino,
+        get_database_version(),
+        sorted(request.args.items(multi=True)),
+        request.headers.get('Accept'),
+    )
+    response = not_modified(etag)
+    if response is not None:
+        response.vary.add('Accept')
+        return response
+    if limit is None:
+        entries = iter_directory_entries(path)
+        next_cursor = None
+    else:
+        entries = get_directory_page(path, limit, cursor)
+        next_cursor = entries[-1].name if len(entries) == limit else None
+    thumbnails_dir = Path(current_app.config['RESOURCES_DIR']) / 'thumbnails'
+    boundary = secrets.token_hex(16)
+
+    def iter_thumbnails(names: list[str]) -> Iterator[tuple[str, str, str, bytes]]:
+        normalized_paths = normalize_paths([path / name for name in names])
+        records = get_file_records(normalized_paths)
+        for name, normalized_path in zip(names, normalized_paths):
+            thumbnail_filename = thumbnail_filename_from_record(records.get(normalized_path))
+            if thumbnail_filename in ['processing', 'error', None]:
+                continue
+            record_thumbnail_access(thumbnail_filename)
+            if size is not None:
+                thumbnail_filename = get_thumbnail_variant(thumbnail_filename, size, make_missing=False)
+            filename, mimetype = negotiate_thumbnail_format(thumbnails_dir, thumbnail_filename)
+            data = read_thumbnail(thumbnails_dir, filename)
+            if data is not None:
+                yield name, filename, mimetype or 'image/png', data
+
+    def generate():
+        pending_names = []
+        for entry in entries:
+            if entry.is_dir or Path(entry.name).suffix.lower() not in current_app.config['SUPPORTED_EXTENSIONS']:
+                continue
+            pending_names.append(entry.name)
+            if len(pending_names) == FILE_INFO_BATCH_SIZE:
+                for part in iter_thumbnails(pending_names):
+                    yield make_thumbnail_part(boundary, *part)
+                pending_names = []
+        for part in iter_thumbnails(pending_names):
+            yield make_thumbnail_part(boundary, *part)
+        if next_cursor is not None:
+            yield (
+                f'--{boundary}\r\n'
+                'Content-Disposition: form-data; name="next_cursor"\r\n'
+                'Content-Type: text/plain; charset=utf-8\r\n\r\n'
+            ).encode() + next_cursor.encode() + b'\r\n'
+        yield f'--{boundary}--\r\n'.encode()
+
+    response = Response(
+        stream_with_context(generate()),
+        mimetype=f'multipart/form-data; boundary={boundary}',
+    )
+    response.vary.add('Accept')
+    set_revalidated(response, etag)
+    return response
+
+def make_thumbnail_part(boundary: str, name: str, filename: str, mimetype: str, data: bytes) -> bytes:
+    header = (
+        f'--{boundary}\r\n'
+        f'Content-Disposition: form-data; name="{quote(name, safe="")}"; filename="{filename}"\r\n'
+        f'Content-Type: {mimetype}\r\n\r\n'
+    )
+    return header.encode() + data + b'\r\n'
 
 @api.route('file-data/<path:filename>', methods=['GET'])
 def serve_file_data(filename: str):
+    """
+    Serve a data file, with partial content for Range requests.
+
+    Behind nginx, X_ACCEL_REDIRECT set to an internal location aliasing
+    the files directory lets nginx send the file itself, ranges included,
+    and Flask's USE_X_SENDFILE does the same with X-Sendfile for Apache
+    or lighttpd, so no worker is held copying large files.
+    """
     files_dir = Path(current_app.config['RESOURCES_DIR']) / 'files'
-    return send_from_directory(files_dir, filename)
+    x_accel_redirect = current_app.config.get('X_ACCEL_REDIRECT')
+    if x_accel_redirect:
+        response = send_with_x_accel_redirect(files_dir, filename, x_accel_redirect)
+    else:
+        # Named after their content, like thumbnails
+        response = send_from_directory(files_dir, filename, etag=filename)
+    set_immutable(response)
+    return response
+
+def send_with_x_accel_redirect(files_dir: Path, filename: str, location: str) -> Response:
+    """
+    Return an empty response telling nginx to send filename from location,
+    the internal location aliasing files_dir.
+    """
+    file_path = safe_join(files_dir.as_posix(), filename)
+    if file_path is None or not os.path.isfile(file_path):
+        abort(404)
+    mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+    response = Response(mimetype=mimetype)
+    response.headers['X-Accel-Redirect'] = location.rstrip('/') + '/' + quote(filename)
+    return response
+
+@api.route('/cache-stats', methods=['GET'])
+def cache_stats():
+    listing_cache = current_app.extensions.get('fileexplorer_listing_cache')
+    return jsonify({
+        'directory_listings': listing_cache.stats() if listing_cache else None,
+    })
 
 @api.route('/directory-parts/<path:relpath>', methods=['GET'])
 def directory_parts(relpath: str):
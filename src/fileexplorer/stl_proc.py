@@ -1,18 +1,56 @@
-from io import BytesIO
+from collections.abc import Iterable
+import math
 from pathlib import Path
 
-import matplotlib.pyplot as plt
-from mpl_toolkits.mplot3d.art3d import Poly3DCollection
 import numpy as np
 from PIL import Image
 from stl.mesh import Mesh
 
+from fileexplorer.mesh import make_mesh_lods, mesh_lod_filenames, write_mesh
 from fileexplorer.proc import ProcessorTemplate
+from fileexplorer.registry import STL_EXTENSIONS
+from fileexplorer.thumbnail_pack import ThumbnailPack
 
-STL_EXTENSIONS = ('.stl',)
+# Camera angles in degrees, the default view of a matplotlib 3D axes
+VIEW_ELEVATION = 30.0
+VIEW_AZIMUTH = -60.0
+# matplotlib's default color, shaded by the angle between each triangle
+# and LIGHT_DIRECTION (in view coordinates: right, up, toward the viewer)
+MESH_COLOR = (31, 119, 180)
+LIGHT_DIRECTION = (-0.3, 0.5, 1.0)
+AMBIENT_LIGHT = 0.35
+# Maximum number of (triangle, pixel) pairs tested at once by rasterize
+RASTER_CHUNK_SIZE = 1 << 20
 
 class StlProcessor(ProcessorTemplate):
+    """
+    Makes a rendered thumbnail of STL files, and as data files a symlink
+    to the original and the levels of detail of fileexplorer.mesh.
+    """
     extensions = STL_EXTENSIONS
+    file_type = 'stl'
+
+    def __init__(
+        self,
+        hash_algorithm: str="md5",
+        thumbnail_sizes: Iterable[int]=(),
+        thumbnail_formats: Iterable[str]=(),
+        thumbnail_pack: ThumbnailPack | None=None,
+    ):
+        super().__init__(hash_algorithm, thumbnail_sizes, thumbnail_formats, thumbnail_pack)
+        # The last mesh loaded, so make_data_file does not parse the
+        # file make_thumbnail just parsed again
+        self._loaded = None
+
+    def load_vectors(self, file_path: Path) -> np.ndarray:
+        stat_result = file_path.stat()
+        key = (file_path, stat_result.st_mtime_ns, stat_result.st_size, stat_result.st_ino)
+        loaded = self._loaded
+        if loaded is None or loaded[0] != key:
+            # Released before the next mesh is loaded, not after
+            self._loaded = None
+            loaded = self._loaded = (key, Mesh.from_file(str(file_path)).vectors)
+        return loaded[1]
 
     def make_thumbnail(
         self,
@@ -20,10 +58,7 @@ class StlProcessor(ProcessorTemplate):
         thumbnails_dir: Path,
         thumbnail_size: tuple[int, int]
     ) -> str | None:
-        try:
-            image = get_stl_image(file_path)
-        except Exception:
-            return None
+        image = self.open_thumbnail_image(file_path, self.decode_size(thumbnail_size))
         thumbnail_filename = self.write_thumbnail(
             image=image,
             thumbnails_dir=thumbnails_dir,
@@ -31,46 +66,174 @@ class StlProcessor(ProcessorTemplate):
         )
         return thumbnail_filename
 
+    def open_thumbnail_image(self, file_path: Path, thumbnail_size: tuple[int, int]) -> Image.Image:
+        return render_mesh(self.load_vectors(file_path), thumbnail_size)
+
+    def make_thumbnail_variant(
+        self,
+        file_path: Path,
+        thumbnails_dir: Path,
+        thumbnail_filename: str,
+        size: int,
+    ) -> str | None:
+        try:
+            return super().make_thumbnail_variant(file_path, thumbnails_dir, thumbnail_filename, size)
+        finally:
+            # No data file follows, so the mesh is not needed anymore
+            self._loaded = None
+
     def make_data_file(self, file_path: Path, data_files_dir: Path) -> str:
-        return self.make_symlink_data_file(
+        data_filename = self.make_symlink_data_file(
             file_path=file_path,
             data_files_dir=data_files_dir
         )
-    
-def get_stl_image(stl_path: str|Path) -> Image.Image:
-    stl_path = Path(stl_path)
-    mesh = Mesh.from_file(str(stl_path))
-
-    figure = plt.figure()
-    axes = figure.add_subplot(111, projection='3d')
-
-    axes.add_collection3d(Poly3DCollection(mesh.vectors))
-
-    xmin, ymin, zmin = np.min(mesh.points.reshape(-1,3), axis=0)
-    xmax, ymax, zmax = np.max(mesh.points.reshape(-1,3), axis=0)
-    axes.set_xlim([xmin, xmax])
-    axes.set_ylim([ymin, ymax])
-    axes.set_zlim([zmin, zmax])
-    axes.set_box_aspect((xmax-xmin, ymax-ymin, zmax-zmin))
-    plt.axis('off')
-
-    img = figure_to_PIL(figure)
-    return crop_where_transparent(img)
-
-def figure_to_PIL(figure: plt.Figure) -> Image.Image:
-    buf = BytesIO()
-    plt.savefig(buf, format='png', bbox_inches='tight', pad_inches=0, transparent=True)
-    plt.close(figure)  # Close the figure to free memory
-    buf.seek(0) # Rewind the buffer's file pointer
-    return Image.open(buf)
-
-def crop_where_transparent(img: Image.Image) -> Image.Image:
-    data = np.asarray(img)
-    not_transparent = data[:,:,-1] > 0
-    not_transparent_cols = np.where(np.sum(not_transparent, axis=0) > 0)[0]
-    left = not_transparent_cols[0]
-    right = not_transparent_cols[-1] + 1
-    not_transparent_rows = np.where(np.sum(not_transparent, axis=1) > 0)[0]
-    upper = not_transparent_rows[0]
-    lower = not_transparent_rows[-1] + 1
-    return img.crop((left, upper, right, lower))
\ No newline at end of file
+        try:
+            self.make_mesh_lods(file_path, data_files_dir, data_filename)
+        except Exception:
+            # The viewer falls back to the original STL
+            pass
+        finally:
+            self._loaded = None
+        return data_filename
+
+    def make_mesh_lods(self, file_path: Path, data_files_dir: Path, data_filename: str):
+        """
+        Write the levels of detail of the mesh next to its data file,
+        unless they were already made for a file with the same content.
+        """
+        filenames = dict(mesh_lod_filenames(data_filename))
+        # The full resolution level is written last
+        if (data_files_dir / filenames[None]).exists():
+            return
+        for budget, vertices, triangles in make_mesh_lods(self.load_vectors(file_path)):
+            write_mesh(data_files_dir / filenames[budget], vertices, triangles)
+
+def view_axes(elevation: float, azimuth: float) -> np.ndarray:
+    """
+    Return the rows right, up and toward the viewer of the camera looking
+    at the origin from elevation and azimuth, in degrees.
+    """
+    elevation = math.radians(elevation)
+    azimuth = math.radians(azimuth)
+    toward_viewer = (
+        math.cos(elevation) * math.cos(azimuth),
+        math.cos(elevation) * math.sin(azimuth),
+        math.sin(elevation),
+    )
+    right = (-math.sin(azimuth), math.cos(azimuth), 0.0)
+    up = (
+        -math.sin(elevation) * math.cos(azimuth),
+        -math.sin(elevation) * math.sin(azimuth),
+        math.cos(elevation),
+    )
+    return np.array([right, up, toward_viewer], dtype=np.float32)
+
+def render_mesh(
+    vectors: np.ndarray,
+    image_size: tuple[int, int],
+    elevation: float=VIEW_ELEVATION,
+    azimuth: float=VIEW_AZIMUTH,
+) -> Image.Image:
+    """
+    Render the triangles vectors, an (n, 3, 3) array, with an orthographic
+    camera and flat shading.  The image is made at the largest size with
+    the aspect ratio of the projected mesh that fits in image_size, with a
+    transparent background.
+    """
+    view = np.asarray(vectors, dtype=np.float32).reshape(-1, 3) @ view_axes(elevation, azimuth).T
+    view = view.reshape(-1, 3, 3)
+    low = view[:, :, :2].min(axis=(0, 1))
+    high = view[:, :, :2].max(axis=(0, 1))
+    extent = np.maximum(high - low, 1e-12)
+    scale = min(image_size[0] / extent[0], image_size[1] / extent[1])
+    width = max(1, min(image_size[0], math.ceil(extent[0] * scale)))
+    height = max(1, min(image_size[1], math.ceil(extent[1] * scale)))
+    # Pixel coordinates, y down, and depth, nearer is smaller
+    x = (view[:, :, 0] - low[0]) * scale
+    y = (high[1] - view[:, :, 1]) * scale
+    depth = -view[:, :, 2]
+
+    normals = np.cross(view[:, 1] - view[:, 0], view[:, 2] - view[:, 0])
+    lengths = np.linalg.norm(normals, axis=1)
+    light = np.asarray(LIGHT_DIRECTION, dtype=np.float32)
+    light /= np.linalg.norm(light)
+    # STL windings are unreliable, so both sides of a triangle are lit
+    diffuse = np.abs(normals @ light) / np.maximum(lengths, 1e-30)
+    shade = AMBIENT_LIGHT + (1 - AMBIENT_LIGHT) * diffuse
+
+    triangles = rasterize(x, y, depth, width, height)
+    covered = triangles >= 0
+    pixels = np.zeros((height * width, 4), dtype=np.uint8)
+    pixels[covered, :3] = (shade[triangles[covered], None] * MESH_COLOR).astype(np.uint8)
+    pixels[covered, 3] = 255
+    return Image.fromarray(pixels.reshape(height, width, 4), 'RGBA')
+
+def rasterize(
+    x: np.ndarray,
+    y: np.ndarray,
+    depth: np.ndarray,
+    width: int,
+    height: int,
+) -> np.ndarray:
+    """
+    Z-buffer rasterize triangles whose vertices have the pixel coordinates
+    x, y and the depths depth, (n, 3) arrays.  A pixel is covered by the
+    triangles containing its center.
+
+    Returns the flattened (height * width) array of the index of the
+    nearest triangle covering each pixel, -1 where there is none.
+
+    Triangles are grouped by the power of two that bounds their bounding
+    box in pixels and each group is tested against the pixels of that
+    square, RASTER_CHUNK_SIZE pairs at a time, so a mesh of millions of
+    sub-pixel triangles is as vectorized as one of a few large ones.
+    """
+    area = (x[:, 1] - x[:, 0]) * (y[:, 2] - y[:, 0]) - (y[:, 1] - y[:, 0]) * (x[:, 2] - x[:, 0])
+    # Range of the pixel centers in the bounding box of each triangle
+    x_first = np.maximum(np.ceil(x.min(axis=1) - 0.5), 0).astype(np.int32)
+    x_last = np.minimum(np.floor(x.max(axis=1) - 0.5), width - 1).astype(np.int32)
+    y_first = np.maximum(np.ceil(y.min(axis=1) - 0.5), 0).astype(np.int32)
+    y_last = np.minimum(np.floor(y.max(axis=1) - 0.5), height - 1).astype(np.int32)
+    span = np.maximum(x_last - x_first, y_last - y_first) + 1
+    visible = (x_last >= x_first) & (y_last >= y_first) & (area != 0)
+
+    z_buffer = np.full(height * width, np.inf, dtype=np.float32)
+    nearest = np.full(height * width, -1, dtype=np.int64)
+    square = 1
+    while True:
+        in_group = visible & (span <= square) & (span > square // 2)
+        group = np.flatnonzero(in_group)
+        offsets = np.arange(square * square)
+        dx = offsets % square
+        dy = offsets // square
+        chunk_triangles = max(1, RASTER_CHUNK_SIZE // (square * square))
+        for start in range(0, len(group), chunk_triangles):
+            t = group[start:start + chunk_triangles]
+            px = x_first[t, None] + dx
+            py = y_first[t, None] + dy
+            candidate = (px <= x_last[t, None]) & (py <= y_last[t, None])
+            cx = px + 0.5
+            cy = py + 0.5
+            tx, ty, tz = x[t], y[t], depth[t]
+            w0 = ((tx[:, 1, None] - cx) * (ty[:, 2, None] - cy)
+                  - (ty[:, 1, None] - cy) * (tx[:, 2, None] - cx)) / area[t, None]
+            w1 = ((tx[:, 2, None] - cx) * (ty[:, 0, None] - cy)
+                  - (ty[:, 2, None] - cy) * (tx[:, 0, None] - cx)) / area[t, None]
+            w2 = 1 - w0 - w1
+            inside = candidate & (w0 >= -1e-6) & (w1 >= -1e-6) & (w2 >= -1e-6)
+            z = (w0 * tz[:, 0, None] + w1 * tz[:, 1, None] + w2 * tz[:, 2, None])[inside]
+            pixel = (py * width + px)[inside]
+            triangle = np.broadcast_to(t[:, None], inside.shape)[inside]
+            # The nearest candidate of each pixel, then merged in the z-buffer
+            order = np.lexsort((z, pixel))
+            pixel, z, triangle = pixel[order], z[order], triangle[order]
+            first = np.ones(len(pixel), dtype=bool)
+            first[1:] = pixel[1:] != pixel[:-1]
+            pixel, z, triangle = pixel[first], z[first], triangle[first]
+            nearer = z < z_buffer[pixel]
+            z_buffer[pixel[nearer]] = z[nearer]
+            nearest[pixel[nearer]] = triangle[nearer]
+        if square >= max(width, height):
+            break
+        square *= 2
+    return nearest
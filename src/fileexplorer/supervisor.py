@@ -0,0 +1,227 @@
+"""
+Pool of worker processes that never lets one item stall the others.
+
+multiprocessing.Pool cannot stop a task that hangs, in a C library
+rendering a pathological file for instance, and loses the task of a
+worker that dies.  WorkerSupervisor gives each worker its own pipe and
+keeps track of the items sent to it, which the worker processes in order,
+so it knows which item a worker is busy with and since when.  A worker
+that spends more than timeout seconds on an item, or dies, is killed and
+replaced, the item gets a failure result, and the items queued behind it
+are sent to the new worker.
+"""
+from collections import deque
+from collections.abc import Callable, Iterable, Iterator
+import multiprocessing
+import multiprocessing.connection
+import signal
+import time
+
+class _Worker:
+    """A worker process, its end of the pipe and the items it was sent"""
+
+    def __init__(self, process: multiprocessing.Process, conn: multiprocessing.connection.Connection):
+        self.process = process
+        self.conn = conn
+        self.pending = deque()
+        self.batches = deque()
+        # When the worker started on the first pending item
+        self.started_at = None
+
+def run_worker(
+    conn: multiprocessing.connection.Connection,
+    function: Callable,
+    initializer: Callable | None,
+    initargs: tuple,
+    memory_limit: int,
+):
+    """Apply function to the items of every batch received, sending back each result"""
+    if memory_limit > 0:
+        limit_memory(memory_limit)
+    if initializer is not None:
+        initializer(*initargs)
+    while True:
+        try:
+            batch = conn.recv()
+        except EOFError:
+            # The supervisor is gone
+            return
+        if batch is None:
+            return
+        for item in batch:
+            conn.send(function(item))
+
+def limit_memory(memory_limit: int):
+    """
+    Make allocations in this process fail with MemoryError past
+    memory_limit bytes of address space.  The address space is larger
+    than the memory used, by the thread stacks and the libraries mapped
+    in particular, so the limit must leave room for them.
+    """
+    import resource
+    resource.setrlimit(resource.RLIMIT_AS, (memory_limit, memory_limit))
+
+def describe_exit(exitcode: int | None) -> str:
+    if exitcode is not None and exitcode < 0:
+        return f'worker killed by {signal.Signals(-exitcode).name}'
+    return f'worker exited with code {exitcode}'
+
+class WorkerSupervisor:
+    """
+    Apply function to items in workers worker processes, each started by
+    calling initializer(*initargs).
+
+    Items are sent in batches, at most tasks_per_worker batches in flight
+    per worker, and results come back as they complete.  An item that
+    takes more than timeout seconds, or on which its worker dies, gets the
+    result of failed(item, reason, duration) instead, and its worker is
+    replaced.  With memory_limit, see limit_memory, allocations fail in the
+    workers past memory_limit bytes.
+
+    Batches must stay small: they are written to pipes without waiting
+    for the workers to read them.  Use it as a context manager or close it.
+    """
+
+    def __init__(
+        self,
+        workers: int,
+        function: Callable,
+        failed: Callable[[object, str, float], object],
+        initializer: Callable | None=None,
+        initargs: tuple=(),
+        timeout: float | None=None,
+        memory_limit: int=0,
+        tasks_per_worker: int=1,
+    ):
+        self.function = function
+        self.failed = failed
+        self.initializer = initializer
+        self.initargs = initargs
+        self.timeout = timeout
+        self.memory_limit = memory_limit
+        self.tasks_per_worker = tasks_per_worker
+        self.restarts = 0
+        self._workers = [self._start_worker() for _ in range(workers)]
+
+    def __enter__(self) -> 'WorkerSupervisor':
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _start_worker(self) -> _Worker:
+        conn, child_conn = multiprocessing.Pipe()
+        process = multiprocessing.Process(
+            target=run_worker,
+            args=(child_conn, self.function, self.initializer, self.initargs, self.memory_limit),
+            daemon=True,
+        )
+        process.start()
+        child_conn.close()
+        return _Worker(process, conn)
+
+    def _send(self, worker: _Worker, batch: list):
+        if not worker.pending:
+            worker.started_at = time.monotonic()
+        worker.conn.send(batch)
+        worker.pending.extend(batch)
+        worker.batches.append(len(batch))
+
+    def _receive(self, worker: _Worker) -> Iterator:
+        """Yield the results the worker has sent"""
+        while worker.pending and worker.conn.poll():
+            result = worker.conn.recv()
+            worker.pending.popleft()
+            worker.batches[0] -= 1
+            if worker.batches[0] == 0:
+                worker.batches.popleft()
+            worker.started_at = time.monotonic()
+            yield result
+
+    def _replace(self, worker: _Worker, reason: str) -> object:
+        """
+        Kill worker, start a new one with its pending items but the first,
+        and return the failure result of the first.
+        """
+        duration = time.monotonic() - worker.started_at
+        worker.process.kill()
+        worker.process.join()
+        worker.conn.close()
+        item = worker.pending.popleft()
+        replacement = self._start_worker()
+        self._workers[self._workers.index(worker)] = replacement
+        self.restarts += 1
+        if worker.pending:
+            self._send(replacement, list(worker.pending))
+        return self.failed(item, reason, duration)
+
+    def imap_unordered(
+        self,
+        batches: Iterable[list],
+        on_wait: Callable[[], float | None] | None=None,
+    ) -> Iterator:
+        """
+        Yield the result of every item of batches, in the order they
+        complete.  on_wait is called whenever no result is ready, before
+        waiting for one, and returns the time.monotonic() time it must be
+        called again by, or None.
+        """
+        batches = iter(batches)
+        exhausted = False
+        while True:
+            if not exhausted:
+                for worker in self._workers:
+                    while len(worker.batches) < self.tasks_per_worker:
+                        batch = next(batches, None)
+                        if batch is None:
+                            exhausted = True
+                            break
+                        if batch:
+                            self._send(worker, batch)
+                    if exhausted:
+                        break
+            busy = [worker for worker in self._workers if worker.pending]
+            if not busy:
+                if exhausted:
+                    return
+                continue
+            deadlines = []
+            if self.timeout is not None:
+                deadlines.append(min(worker.started_at for worker in busy) + self.timeout)
+            wake_time = on_wait() if on_wait is not None else None
+            if wake_time is not None:
+                deadlines.append(wake_time)
+            wait_timeout = None
+            if deadlines:
+                wait_timeout = max(0.0, min(deadlines) - time.monotonic())
+            ready = multiprocessing.connection.wait(
+                [worker.conn for worker in busy] + [worker.process.sentinel for worker in busy],
+                wait_timeout,
+            )
+            for worker in busy:
+                try:
+                    yield from self._receive(worker)
+                except (EOFError, OSError):
+                    # Died while sending
+                    pass
+                if not worker.pending:
+                    continue
+                if worker.process.sentinel in ready or not worker.process.is_alive():
+                    worker.process.join()
+                    yield self._replace(worker, describe_exit(worker.process.exitcode))
+                elif self.timeout is not None and time.monotonic() - worker.started_at >= self.timeout:
+                    yield self._replace(worker, f'timed out after {self.timeout:g} s')
+
+    def close(self):
+        for worker in self._workers:
+            try:
+                worker.conn.send(None)
+            except OSError:
+                pass
+        for worker in self._workers:
+            worker.process.join(timeout=1.0)
+            if worker.process.is_alive():
+                worker.process.kill()
+                worker.process.join()
+            worker.conn.close()
+        self._workers = []
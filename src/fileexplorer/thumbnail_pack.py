@@ -0,0 +1,139 @@
+"""
+Append-only store packing thumbnails into a single data file, so the
+resources directory does not end up with millions of tiny files.
+
+The store is two files: thumbnails.pack holds the encoded thumbnails back
+to back, and thumbnails.idx holds one fixed size record (name, offset,
+length) per thumbnail.  Both are opened with O_APPEND, and a thumbnail is
+written to the pack before its record is written to the index, so the
+worker processes can all add thumbnails while the web server reads them
+without any locking between processes, on a local filesystem.  The
+threads of a process share the offset of its file descriptors, so they
+take turns to add thumbnails.
+"""
+from collections.abc import Callable
+import os
+from pathlib import Path
+import struct
+import threading
+
+PACK_FILENAME = 'thumbnails.pack'
+INDEX_FILENAME = 'thumbnails.idx'
+
+_RECORD = struct.Struct('<64sQI')
+
+class ThumbnailPack:
+    """
+    Thumbnails packed in resources_dir, by filename.  Use it as a context
+    manager or close it.
+    """
+
+    def __init__(self, resources_dir: Path):
+        self.resources_dir = resources_dir = Path(resources_dir)
+        flags = os.O_RDWR | os.O_APPEND | os.O_CREAT | getattr(os, 'O_CLOEXEC', 0)
+        self._pack_fd = os.open(resources_dir / PACK_FILENAME, flags, 0o644)
+        self._index_fd = os.open(resources_dir / INDEX_FILENAME, flags, 0o644)
+        self._index = {}
+        self._index_size = 0
+        self._lock = threading.Lock()
+        # Held from writing a thumbnail until its offset is read back
+        self._write_lock = threading.Lock()
+
+    def __enter__(self) -> 'ThumbnailPack':
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _refresh_index(self):
+        """Read the records added since the index was last read, with the lock held"""
+        index_size = os.fstat(self._index_fd).st_size
+        # A record being written by another process is read next time
+        index_size -= index_size % _RECORD.size
+        if index_size <= self._index_size:
+            return
+        data = os.pread(self._index_fd, index_size - self._index_size, self._index_size)
+        for name, offset, length in _RECORD.iter_unpack(data):
+            self._index[name.rstrip(b'\0').decode()] = (offset, length)
+        self._index_size = index_size
+
+    def _lookup(self, name: str) -> tuple[int, int] | None:
+        with self._lock:
+            location = self._index.get(name)
+            if location is None:
+                self._refresh_index()
+                location = self._index.get(name)
+            return location
+
+    def __contains__(self, name: str) -> bool:
+        return self._lookup(name) is not None
+
+    def get(self, name: str) -> bytes | None:
+        """Return the thumbnail called name, or None if it is not in the pack"""
+        location = self._lookup(name)
+        if location is None:
+            return None
+        offset, length = location
+        return os.pread(self._pack_fd, length, offset)
+
+    def put(self, name: str, data: bytes):
+        """Add the thumbnail called name, unless it is already in the pack"""
+        encoded_name = name.encode()
+        if len(encoded_name) > 64:
+            raise ValueError(f'Thumbnail name too long to be packed: {name}')
+        with self._write_lock:
+            if name in self:
+                return
+            os.write(self._pack_fd, data)
+            # With O_APPEND this is the end of what was just written, whatever
+            # other processes appended in the meantime, but not other threads
+            offset = os.lseek(self._pack_fd, 0, os.SEEK_CUR) - len(data)
+            os.write(self._index_fd, _RECORD.pack(encoded_name, offset, len(data)))
+            with self._lock:
+                self._index[name] = (offset, len(data))
+
+    def names(self) -> list[str]:
+        with self._lock:
+            self._refresh_index()
+            return list(self._index)
+
+    def sizes(self) -> dict[str, int]:
+        """The size in bytes of every thumbnail in the pack, by name"""
+        with self._lock:
+            self._refresh_index()
+            return {name: length for name, (_, length) in self._index.items()}
+
+    def close(self):
+        if self._pack_fd >= 0:
+            os.close(self._pack_fd)
+            os.close(self._index_fd)
+            self._pack_fd = self._index_fd = -1
+
+def compact_thumbnail_pack(resources_dir: Path, keep: Callable[[str], bool]) -> int:
+    """
+    Rewrite the pack in resources_dir with only the thumbnails whose name
+    keep is true for, and return the number of bytes freed.  No other
+    process may have the pack open, since it would go on using the files
+    this replaces.
+    """
+    resources_dir = Path(resources_dir)
+    if not (resources_dir / INDEX_FILENAME).exists():
+        return 0
+    with ThumbnailPack(resources_dir) as pack:
+        names = pack.names()
+        kept_names = [name for name in names if keep(name)]
+        if len(kept_names) == len(names):
+            return 0
+        pack_size = os.fstat(pack._pack_fd).st_size
+        temporary_pack_path = resources_dir / f'.{PACK_FILENAME}.{os.getpid()}'
+        temporary_index_path = resources_dir / f'.{INDEX_FILENAME}.{os.getpid()}'
+        offset = 0
+        with open(temporary_pack_path, 'wb') as pack_file, open(temporary_index_path, 'wb') as index_file:
+            for name in kept_names:
+                data = pack.get(name)
+                pack_file.write(data)
+                index_file.write(_RECORD.pack(name.encode(), offset, len(data)))
+                offset += len(data)
+    os.replace(temporary_pack_path, resources_dir / PACK_FILENAME)
+    os.replace(temporary_index_path, resources_dir / INDEX_FILENAME)
+    return pack_size - offset
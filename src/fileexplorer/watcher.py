@@ -0,0 +1,247 @@
+"""
+Watchers reporting changes under ROOT_DIR so the index can be kept up to
+date without rescanning the whole tree.
+
+A watcher's read_events returns WatchEvents for paths that were created,
+modified, moved or deleted.  Events for a path are reported as soon as
+they are seen; EventCoalescer debounces them so a file being written is
+only processed once it has been left alone.
+"""
+from collections.abc import Callable
+import errno
+import logging
+import os
+from pathlib import Path
+import time
+from typing import NamedTuple
+
+from fileexplorer import inotify
+from fileexplorer.inotify import Inotify, inotify_available
+from fileexplorer.models import file_stat_key
+
+# A file or directory that was created, modified or moved in
+CHANGED = 'changed'
+# A file or directory that was deleted or moved out
+DELETED = 'deleted'
+
+logger = logging.getLogger(__name__)
+
+class WatchEvent(NamedTuple):
+    kind: str
+    path: Path
+
+WATCH_MASK = (
+    inotify.IN_CREATE
+    | inotify.IN_MODIFY
+    | inotify.IN_CLOSE_WRITE
+    | inotify.IN_ATTRIB
+    | inotify.IN_MOVED_FROM
+    | inotify.IN_MOVED_TO
+    | inotify.IN_DELETE
+    | inotify.IN_DELETE_SELF
+    | inotify.IN_ONLYDIR
+)
+
+class InotifyWatcher:
+    """
+    Watch every directory under root_dir with inotify.  Directories that
+    are created or moved in are watched as soon as they are seen and are
+    reported as changed so their contents get indexed.  If the kernel
+    queue overflows, the whole tree is watched again and root_dir itself
+    is reported as changed.
+
+    A directory that cannot be watched, once fs.inotify.max_user_watches
+    watches are in use for instance, is polled with its subdirectories by
+    a PollingWatcher every poll_interval seconds instead.
+    """
+
+    def __init__(self, root_dir: Path, poll_interval: float=10.0):
+        self.root_dir = Path(root_dir)
+        self.poll_interval = poll_interval
+        self._inotify = Inotify()
+        self._directories = {}
+        # PollingWatchers of the directories that could not be watched
+        self._pollers = {}
+        self._watch_tree(self.root_dir)
+
+    def _watch_tree(self, directory: Path):
+        for dirpath, dirnames, _ in os.walk(directory):
+            path = Path(dirpath)
+            if path in self._pollers:
+                dirnames.clear()
+                continue
+            try:
+                wd = self._inotify.add_watch(dirpath, WATCH_MASK)
+            except FileNotFoundError:
+                # Deleted while walking
+                continue
+            except OSError as e:
+                if e.errno == errno.ENOSPC:
+                    reason = 'fs.inotify.max_user_watches reached'
+                else:
+                    reason = e.strerror
+                logger.warning('Cannot watch %s (%s), polling it instead', dirpath, reason)
+                self._pollers[path] = PollingWatcher(path, self.poll_interval)
+                # Polled with it
+                dirnames.clear()
+                continue
+            self._directories[wd] = path
+
+    def _unwatch_tree(self, directory: Path):
+        for wd, path in list(self._directories.items()):
+            if path == directory or directory in path.parents:
+                del self._directories[wd]
+                self._inotify.rm_watch(wd)
+        for path in list(self._pollers):
+            if path == directory or directory in path.parents:
+                del self._pollers[path]
+
+    def read_events(self, timeout: float|None=None) -> list[WatchEvent]:
+        events = []
+        for poller in self._pollers.values():
+            # Only polls when it is due, without waiting
+            events.extend(poller.read_events(0))
+        for event in self._inotify.read_events(timeout):
+            if event.mask & inotify.IN_Q_OVERFLOW:
+                # Directories created since may not be watched yet
+                self._watch_tree(self.root_dir)
+                events.append(WatchEvent(CHANGED, self.root_dir))
+                continue
+            directory = self._directories.get(event.wd)
+            if directory is None:
+                continue
+            if event.mask & (inotify.IN_DELETE_SELF | inotify.IN_IGNORED):
+                self._directories.pop(event.wd, None)
+                continue
+            path = directory / event.name
+            is_dir = bool(event.mask & inotify.IN_ISDIR)
+            if event.mask & (inotify.IN_DELETE | inotify.IN_MOVED_FROM):
+                if is_dir:
+                    self._unwatch_tree(path)
+                events.append(WatchEvent(DELETED, path))
+            else:
+                if is_dir and event.mask & (inotify.IN_CREATE | inotify.IN_MOVED_TO):
+                    self._watch_tree(path)
+                events.append(WatchEvent(CHANGED, path))
+        return events
+
+    def close(self):
+        self._inotify.close()
+
+class PollingWatcher:
+    """
+    Fallback for platforms without inotify: every interval seconds, stat
+    every file under root_dir and report the files whose (mtime, size,
+    inode) changed since the previous poll.  Nothing is processed unless
+    it changed, but the cost of a poll grows with the size of the tree.
+    """
+
+    def __init__(self, root_dir: Path, interval: float=10.0):
+        self.root_dir = Path(root_dir)
+        self.interval = interval
+        self._snapshot = self._take_snapshot()
+        self._next_poll = time.monotonic() + interval
+
+    def _take_snapshot(self) -> dict[Path, tuple[int, int, int]]:
+        snapshot = {}
+        directories = [self.root_dir]
+        while directories:
+            directory = directories.pop()
+            try:
+                with os.scandir(directory) as it:
+                    for entry in it:
+                        try:
+                            if entry.is_dir(follow_symlinks=False):
+                                directories.append(Path(entry.path))
+                            elif entry.is_file():
+                                snapshot[Path(entry.path)] = file_stat_key(entry.stat())
+                        except OSError:
+                            continue
+            except OSError:
+                continue
+        return snapshot
+
+    def read_events(self, timeout: float|None=None) -> list[WatchEvent]:
+        wait = max(self._next_poll - time.monotonic(), 0)
+        if timeout is not None and timeout < wait:
+            time.sleep(timeout)
+            return []
+        time.sleep(wait)
+        self._next_poll = time.monotonic() + self.interval
+        snapshot = self._take_snapshot()
+        events = [
+            WatchEvent(CHANGED, path) for path, stat_key in snapshot.items()
+            if self._snapshot.get(path) != stat_key
+        ]
+        events += [WatchEvent(DELETED, path) for path in self._snapshot.keys() - snapshot.keys()]
+        self._snapshot = snapshot
+        return events
+
+    def close(self):
+        pass
+
+def make_watcher(root_dir: Path, mode: str='auto', poll_interval: float=10.0):
+    """
+    Return an InotifyWatcher for mode 'inotify', a PollingWatcher for mode
+    'poll', and the first that is available for mode 'auto'.
+    """
+    if mode == 'inotify' or (mode == 'auto' and inotify_available()):
+        return InotifyWatcher(root_dir, poll_interval)
+    if mode in ('poll', 'auto'):
+        return PollingWatcher(root_dir, poll_interval)
+    raise ValueError(f'Unknown watch mode {mode!r}')
+
+class EventCoalescer:
+    """
+    Debounce and coalesce watch events.  Only the last event for a path is
+    kept, and it is released once no event for the path has been seen for
+    debounce seconds.
+    """
+
+    def __init__(self, debounce: float=0.5):
+        self.debounce = debounce
+        self._pending = {}
+
+    def __len__(self) -> int:
+        return len(self._pending)
+
+    def add(self, event: WatchEvent):
+        self._pending.pop(event.path, None)
+        # Reinserted so the dict stays ordered by time of the last event
+        self._pending[event.path] = (event.kind, time.monotonic())
+
+    def pop_ready(self) -> list[WatchEvent]:
+        """Remove and return the events that have settled"""
+        settled_before = time.monotonic() - self.debounce
+        ready = []
+        for path, (kind, last_seen) in self._pending.items():
+            if last_seen > settled_before:
+                break
+            ready.append(WatchEvent(kind, path))
+        for event in ready:
+            del self._pending[event.path]
+        return ready
+
+def watch_for_changes(
+    watcher,
+    handle_events: Callable[[list[WatchEvent]], None],
+    debounce: float=0.5,
+    should_stop: Callable[[], bool]=lambda: False,
+    on_tick: Callable[[], None]=lambda: None,
+):
+    """
+    Feed the settled events of watcher to handle_events until should_stop
+    returns True.  on_tick is called about every second in between.
+    """
+    coalescer = EventCoalescer(debounce)
+    next_tick = time.monotonic() + 1.0
+    while not should_stop():
+        timeout = debounce if len(coalescer) else 1.0
+        for event in watcher.read_events(timeout):
+            coalescer.add(event)
+        ready = coalescer.pop_ready()
+        if ready:
+            handle_events(ready)
+        if time.monotonic() >= next_tick:
+            on_tick()
+            next_tick = time.monotonic() + 1.0
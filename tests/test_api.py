@@ -1,25 +1,41 @@
 import hashlib
 from io import BytesIO
+import json
 from pathlib import Path
+import time
 from urllib.parse import urlparse
 
 from flask import Flask
 from flask.testing import FlaskClient 
+import numpy as np
 from PIL import Image
 import pytest
 from pytest import TempPathFactory
+from stl.mesh import Mesh
+from werkzeug.formparser import parse_form_data
+from werkzeug.test import create_environ
 
-from fileexplorer import create_app
+from fileexplorer import create_app, models, routes
+from fileexplorer.mesh import MESH_MAGIC
+from fileexplorer.models import (
+    ThumbnailAccessLog,
+    get_file_record,
+    get_thumbnail_accesses,
+    normalize_path,
+    pop_requested_paths,
+)
+from fileexplorer.resource_gc import collect_garbage
 
 # Helper functions for pytest tests
-def create_test_app(root_dir: Path, instance_dir: Path) -> Flask:
+def create_test_app(root_dir: Path, instance_dir: Path, **config) -> Flask:
     resources_dir = instance_dir / 'resources'
     database_path = instance_dir / 'files.db'
     test_config = {
         "TESTING": True,
         "ROOT_DIR": root_dir.as_posix(),
         "RESOURCES_DIR": resources_dir.as_posix(),
-        "DATABASE_PATH": database_path.as_posix()
+        "DATABASE_PATH": database_path.as_posix(),
+        **config,
     }
     return create_app(test_config)
 
@@ -169,6 +185,7 @@ def test_file_info_on_text_file(
     assert file_info['relpath'] == 'subdir/text-file.txt'
     assert file_info['st_size'] == len('a text file')
     assert file_info['thumbnail_url'] is None
+    assert file_info['mesh_lod_urls'] is None
 
 def test_file_info_on_missing_file(
     root_dir_2: Path,
@@ -179,6 +196,36 @@ def test_file_info_on_missing_file(
     response = client_2.get('/api/file-info/missing-file')
     assert response.status_code == 404
 
+def test_batch_file_info(
+    root_dir_2: Path,
+    client_2: FlaskClient
+):
+    relpaths = ['subdir/text-file.txt', 'missing-file', 'red-image.jpeg', '../red-image.jpeg', '/etc/passwd']
+    response = client_2.post('/api/file-info/', json={'relpaths': relpaths})
+    assert response.status_code == 200
+    files_info = response.json['files']
+    assert len(files_info) == len(relpaths)
+    assert files_info[0] == client_2.get('/api/file-info/subdir/text-file.txt').json
+    assert files_info[1] is None
+    assert files_info[2] == client_2.get('/api/file-info/red-image.jpeg').json
+    assert files_info[2]['thumbnail_url'].startswith('/api/thumbnails/')
+    assert files_info[3] is None
+    assert files_info[4] is None
+
+def test_batch_file_info_bad_request(client_2: FlaskClient):
+    assert client_2.post('/api/file-info/', json={'relpaths': 'red-image.jpeg'}).status_code == 400
+    assert client_2.post('/api/file-info/', data='not json').status_code == 400
+
+def test_directory_info_include_file_info(
+    root_dir_2: Path,
+    client_2: FlaskClient
+):
+    response = client_2.get('/api/directory-info/?include=file_info')
+    assert response.status_code == 200
+    files = response.json['files']
+    assert len(files) == 1
+    assert files[0]['file_info'] == client_2.get('/api/file-info/red-image.jpeg').json
+
 # fixtures to test /api/directory-info/
 # Directory structure is
 # root_dir/
@@ -266,14 +313,56 @@ def test_directory_info_missing_subdir(client_3: FlaskClient):
     response = client_3.get('/api/directory-info/missing-subdir')
     assert response.status_code == 404
 
-# fixtures to test /api/thumbnails/
+def test_directory_info_pages(client_3: FlaskClient):
+    names = []
+    cursor = None
+    for _ in range(3):
+        params = {'limit': 2} if cursor is None else {'limit': 2, 'cursor': cursor}
+        response = client_3.get('/api/directory-info/', query_string=params)
+        assert response.status_code == 200
+        directory_info = response.json
+        names += [d['name'] for d in directory_info['files'] + directory_info['directories']]
+        cursor = directory_info['next_cursor']
+        if cursor is None:
+            break
+    assert names == ['file1.txt', 'subdir1', 'subdir2']
+
+def test_directory_info_bad_limit(client_3: FlaskClient):
+    response = client_3.get('/api/directory-info/?limit=0')
+    assert response.status_code == 400
+
+def test_directory_info_stream(client_3: FlaskClient):
+    response = client_3.get('/api/directory-info/subdir2?stream=1')
+    assert response.status_code == 200
+    assert response.mimetype == 'application/x-ndjson'
+    lines = [json.loads(line) for line in response.data.decode().splitlines()]
+    assert lines[0]['relpath'] == 'subdir2'
+    assert urlparse(lines[0]['parts']).path == '/api/directory-parts/subdir2'
+    entries = sorted(lines[1:-1], key=lambda entry: entry['name'])
+    assert [(e['type'], e['name']) for e in entries] == [('file', 'file3.txt'), ('directory', 'subdir3')]
+    assert urlparse(entries[0]['link']).path == '/api/file-info/subdir2/file3.txt'
+    assert lines[-1] == {'next_cursor': None}
+
+def test_cache_stats(client_3: FlaskClient):
+    response = client_3.get('/api/cache-stats')
+    assert response.status_code == 200
+    stats = response.json['directory_listings']
+    assert stats['hits'] + stats['misses'] > 0
+
+# fixtures to test /api/thumbnails/ and /api/file-data/
 # Directory structure is
-# root_dir/blue-image.png
+# root_dir/
+#     blue-image.png
+#     tetrahedron.stl
 @pytest.fixture(scope="session")
 def root_dir_4(tmp_path_factory: TempPathFactory) -> Path:
     root_dir = tmp_path_factory.mktemp('root-dir')
     img = Image.new('RGB', size=(150,150), color=(0,0,255))
     img.save(root_dir / 'blue-image.png')
+    vertices = np.array([[0,0,0], [1,0,0], [0,1,0], [0,0,1]], dtype=np.float32)
+    mesh = Mesh(np.zeros(4, dtype=Mesh.dtype))
+    mesh.vectors[:] = vertices[[[0,2,1], [0,1,3], [0,3,2], [1,2,3]]]
+    mesh.save(str(root_dir / 'tetrahedron.stl'))
     return root_dir
 
 @pytest.fixture(scope="session")
@@ -296,3 +385,250 @@ def test_thumbnails(client_4: FlaskClient):
     assert img.size == (100,100)
     assert img.getpixel((0,0)) == (0,0,255)
     assert img.getpixel((50,50)) == (0,0,255)
+
+def test_mesh_lods(client_4: FlaskClient):
+    file_info = client_4.get('/api/file-info/tetrahedron.stl').json
+    assert file_info['file_type'] == 'stl'
+    # Too small to be decimated, only the full resolution level is made
+    assert len(file_info['mesh_lod_urls']) == 1
+    mesh_url = urlparse(file_info['mesh_lod_urls'][0]).path
+    assert mesh_url.endswith('.mesh')
+    assert mesh_url != urlparse(file_info['file_data_url']).path
+    response = client_4.get(mesh_url)
+    assert response.status_code == 200
+    assert response.data.startswith(MESH_MAGIC)
+    assert client_4.get('/api/file-info/blue-image.png').json['mesh_lod_urls'] is None
+
+def test_thumbnail_sizes(client_4: FlaskClient):
+    thumbnail_url = urlparse(client_4.get('/api/file-info/blue-image.png').json['thumbnail_url']).path
+    stem = thumbnail_url.split('/')[-1][:-len('.png')]
+    # 256 is made during the build, the 150x150 image is not enlarged
+    response = client_4.get(thumbnail_url, query_string={'size': 200})
+    assert response.status_code == 200
+    assert Image.open(BytesIO(response.data)).size == (150, 150)
+    assert response.data == client_4.get(f'/api/thumbnails/{stem}.256.png').data
+    # 512 is made when first requested
+    assert client_4.get(f'/api/thumbnails/{stem}.512.png').status_code == 404
+    response = client_4.get(thumbnail_url, query_string={'size': 1000})
+    assert response.status_code == 200
+    assert client_4.get(f'/api/thumbnails/{stem}.512.png').status_code == 200
+    response = client_4.get(thumbnail_url, query_string={'size': 50})
+    assert Image.open(BytesIO(response.data)).size == (64, 64)
+    assert client_4.get(thumbnail_url, query_string={'size': 'big'}).status_code == 400
+    assert client_4.get(thumbnail_url, query_string={'size': 0}).status_code == 400
+
+def test_thumbnail_format_negotiation(client_4: FlaskClient):
+    thumbnail_url = urlparse(client_4.get('/api/file-info/blue-image.png').json['thumbnail_url']).path
+    browser_accept = 'image/avif,image/webp,image/apng,image/*,*/*;q=0.8'
+    response = client_4.get(thumbnail_url, headers={'Accept': browser_accept})
+    assert response.mimetype == 'image/webp'
+    assert 'Accept' in response.headers['Vary']
+    image = Image.open(BytesIO(response.data))
+    assert image.format == 'WEBP'
+    assert image.size == (100, 100)
+    response = client_4.get(thumbnail_url, headers={'Accept': browser_accept}, query_string={'size': 128})
+    assert response.mimetype == 'image/webp'
+    assert Image.open(BytesIO(response.data)).size == (128, 128)
+    for accept in ['*/*', 'image/png', 'image/webp;q=0']:
+        response = client_4.get(thumbnail_url, headers={'Accept': accept})
+        assert response.mimetype == 'image/png'
+        assert 'Accept' in response.headers['Vary']
+
+def parse_form_data_response(response) -> tuple[dict, dict]:
+    environ = create_environ(
+        method='POST',
+        input_stream=BytesIO(response.data),
+        content_type=response.content_type,
+        content_length=len(response.data),
+    )
+    _, form, files = parse_form_data(environ)
+    return form, files
+
+def test_directory_thumbnails(client_4: FlaskClient):
+    response = client_4.get('/api/directory-thumbnails/')
+    assert response.status_code == 200
+    assert response.mimetype == 'multipart/form-data'
+    form, files = parse_form_data_response(response)
+    assert sorted(files) == ['blue-image.png', 'tetrahedron.stl']
+    thumbnail_url = urlparse(client_4.get('/api/file-info/blue-image.png').json['thumbnail_url']).path
+    assert files['blue-image.png'].filename == thumbnail_url.split('/')[-1]
+    assert files['blue-image.png'].read() == client_4.get(thumbnail_url).data
+    assert 'next_cursor' not in form
+    # The same sizes and formats as /api/thumbnails/
+    response = client_4.get(
+        '/api/directory-thumbnails/',
+        headers={'Accept': 'image/webp'},
+        query_string={'size': 64, 'limit': 1},
+    )
+    form, files = parse_form_data_response(response)
+    assert list(files) == ['blue-image.png']
+    assert files['blue-image.png'].mimetype == 'image/webp'
+    assert Image.open(files['blue-image.png']).size == (64, 64)
+    assert form['next_cursor'] == 'blue-image.png'
+    # Revalidated with the same query and Accept header only
+    etag = response.headers['ETag']
+    assert 'no-cache' in response.headers['Cache-Control']
+    response = client_4.get(
+        '/api/directory-thumbnails/',
+        headers={'Accept': 'image/webp', 'If-None-Match': etag},
+        query_string={'size': 64, 'limit': 1},
+    )
+    assert response.status_code == 304
+    response = client_4.get(
+        '/api/directory-thumbnails/',
+        headers={'If-None-Match': etag},
+        query_string={'size': 64, 'limit': 1},
+    )
+    assert response.status_code == 200
+    # Not read, so the streaming response must be closed
+    response.close()
+    assert client_4.get('/api/directory-thumbnails/blue-image.png').status_code == 404
+    assert client_4.get('/api/directory-thumbnails/', query_string={'limit': 0}).status_code == 400
+
+def test_evicted_thumbnail_made_again(client_4: FlaskClient):
+    resources_dir = Path(client_4.application.config['RESOURCES_DIR'])
+    thumbnail_url = urlparse(client_4.get('/api/file-info/blue-image.png').json['thumbnail_url']).path
+    thumbnail = client_4.get(thumbnail_url).data
+    stats = collect_garbage(resources_dir, thumbnail_budget=1)
+    assert stats.thumbnails_evicted > 0
+    assert not (resources_dir / 'thumbnails' / Path(thumbnail_url).name).exists()
+    response = client_4.get(thumbnail_url)
+    assert response.status_code == 200
+    assert response.data == thumbnail
+    assert client_4.get(thumbnail_url, query_string={'size': 64}).status_code == 200
+    extensions = client_4.application.extensions
+    extensions['fileexplorer_thumbnail_accesses'] = ThumbnailAccessLog(flush_interval=0)
+    try:
+        assert client_4.get('/api/thumbnails/missing.png').status_code == 404
+        client_4.get(thumbnail_url)
+    finally:
+        del extensions['fileexplorer_thumbnail_accesses']
+    assert list(get_thumbnail_accesses()) == [Path(thumbnail_url).name]
+
+# fixtures to test the thumbnail pack, on the files of root_dir_4
+@pytest.fixture(scope="session")
+def client_5(
+    root_dir_4: Path,
+    tmp_path_factory: TempPathFactory
+) -> FlaskClient:
+    instance_dir = tmp_path_factory.mktemp('instance-dir')
+    app = create_test_app(root_dir_4, instance_dir, THUMBNAIL_PACK=True)
+    return app.test_client()
+
+def test_thumbnail_pack(client_5: FlaskClient):
+    resources_dir = Path(client_5.application.config['RESOURCES_DIR'])
+    assert list((resources_dir / 'thumbnails').iterdir()) == []
+    thumbnail_url = urlparse(client_5.get('/api/file-info/blue-image.png').json['thumbnail_url']).path
+    response = client_5.get(thumbnail_url)
+    assert response.status_code == 200
+    assert hashlib.md5(response.data).hexdigest() == thumbnail_url.split('/')[-1][:-len('.png')]
+    response = client_5.get(thumbnail_url, headers={'Accept': 'image/webp'}, query_string={'size': 1000})
+    assert response.mimetype == 'image/webp'
+    assert Image.open(BytesIO(response.data)).size == (150, 150)
+    _, files = parse_form_data_response(client_5.get('/api/directory-thumbnails/'))
+    assert sorted(files) == ['blue-image.png', 'tetrahedron.stl']
+    assert list((resources_dir / 'thumbnails').iterdir()) == []
+
+def test_conditional_requests(client_5: FlaskClient):
+    response = client_5.get('/api/directory-info/', query_string={'include': 'file_info'})
+    etag = response.headers['ETag']
+    assert 'no-cache' in response.headers['Cache-Control']
+    response = client_5.get(
+        '/api/directory-info/',
+        query_string={'include': 'file_info'},
+        headers={'If-None-Match': etag},
+    )
+    assert response.status_code == 304
+    assert response.data == b''
+    # Without file info the listing only depends on the directory
+    response = client_5.get('/api/directory-info/', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    response = client_5.get('/api/file-info/blue-image.png')
+    file_info = response.json
+    response = client_5.get('/api/file-info/blue-image.png', headers={'If-None-Match': response.headers['ETag']})
+    assert response.status_code == 304
+    for url in [file_info['thumbnail_url'], file_info['file_data_url']]:
+        response = client_5.get(urlparse(url).path)
+        assert response.headers['ETag'] == f'"{url.split("/")[-1]}"'
+        assert response.headers['Cache-Control'] == 'public, max-age=31536000, immutable'
+        response = client_5.get(urlparse(url).path, headers={'If-None-Match': response.headers['ETag']})
+        assert response.status_code == 304
+
+def test_file_data_ranges(client_5: FlaskClient):
+    data_url = urlparse(client_5.get('/api/file-info/tetrahedron.stl').json['file_data_url']).path
+    data = client_5.get(data_url).data
+    assert data == (Path(client_5.application.config['ROOT_DIR']) / 'tetrahedron.stl').read_bytes()
+    response = client_5.get(data_url, headers={'Range': 'bytes=10-19'})
+    assert response.status_code == 206
+    assert response.headers['Content-Range'] == f'bytes 10-19/{len(data)}'
+    assert response.data == data[10:20]
+    response = client_5.get(data_url, headers={'Range': 'bytes=-5'})
+    assert response.data == data[-5:]
+    # A range of a file that has changed since is not sent
+    response = client_5.get(data_url, headers={'Range': 'bytes=10-19', 'If-Range': '"other"'})
+    assert response.status_code == 200
+    assert response.data == data
+    response = client_5.get(data_url, headers={'Range': f'bytes={len(data)}-'})
+    assert response.status_code == 416
+
+def test_file_data_x_accel_redirect(client_5: FlaskClient):
+    data_url = urlparse(client_5.get('/api/file-info/tetrahedron.stl').json['file_data_url']).path
+    filename = data_url.split('/')[-1]
+    client_5.application.config['X_ACCEL_REDIRECT'] = '/internal-files/'
+    try:
+        response = client_5.get(data_url)
+        assert response.headers['X-Accel-Redirect'] == f'/internal-files/{filename}'
+        assert response.data == b''
+        assert response.headers['Cache-Control'] == 'public, max-age=31536000, immutable'
+        assert client_5.get('/api/file-data/missing.stl').status_code == 404
+    finally:
+        del client_5.application.config['X_ACCEL_REDIRECT']
+
+# fixtures to test files added after the build, with an empty root_dir
+@pytest.fixture
+def client_6(
+    tmp_path_factory: TempPathFactory,
+    monkeypatch: pytest.MonkeyPatch
+) -> FlaskClient:
+    # Switched by the app, and restored for the clients of the other tests
+    monkeypatch.setattr(models, 'DATABASE_PATH', models.DATABASE_PATH)
+    root_dir = tmp_path_factory.mktemp('root-dir')
+    app = create_test_app(root_dir, tmp_path_factory.mktemp('instance-dir'), HASH_ALGORITHM='sha256')
+    return app.test_client()
+
+def test_unprocessed_files(client_6: FlaskClient, monkeypatch: pytest.MonkeyPatch):
+    client = client_6
+    app = client.application
+    root_dir = Path(app.config['ROOT_DIR'])
+    # Added after the build
+    for name in ['a.png', 'b.png']:
+        Image.new('RGB', size=(150,150), color=(0,0,255)).save(root_dir / name)
+    assert client.get('/api/file-info/a.png').json['thumbnail_url'] == 'processing'
+    assert pop_requested_paths() == [normalize_path(root_dir / 'a.png'), normalize_path(root_dir)]
+    app.config['ON_DEMAND_BUDGET'] = 10
+    listing = client.get('/api/directory-info/', query_string={'include': 'file_info'}).json
+    for file_data in listing['files']:
+        thumbnail_url = urlparse(file_data['file_info']['thumbnail_url']).path
+        assert client.get(thumbnail_url).status_code == 200
+    assert pop_requested_paths() == []
+    # Hashed like the builder hashes
+    assert len(get_file_record(root_dir / 'a.png')['content_hash']) == 64
+
+    # Meshes are left to the builder, however much budget is left
+    (root_dir / 'mesh.stl').write_bytes(b'not rendered in the request')
+    assert client.get('/api/file-info/mesh.stl').json['thumbnail_url'] == 'processing'
+    assert pop_requested_paths() == [normalize_path(root_dir / 'mesh.stl'), normalize_path(root_dir)]
+    (root_dir / 'mesh.stl').unlink()
+
+    # The budget is for the whole request, not for each batch of files
+    for name in ['c.png', 'd.png', 'e.png']:
+        Image.new('RGB', size=(150,150), color=(0,255,0)).save(root_dir / name)
+    monkeypatch.setattr(routes, 'FILE_INFO_BATCH_SIZE', 1)
+    process_file_on_demand = routes.process_file_on_demand
+    def slow_process_file_on_demand(*args):
+        time.sleep(0.2)
+        return process_file_on_demand(*args)
+    monkeypatch.setattr(routes, 'process_file_on_demand', slow_process_file_on_demand)
+    app.config['ON_DEMAND_BUDGET'] = 0.1
+    client.get('/api/directory-info/', query_string={'include': 'file_info'})
+    assert len(pop_requested_paths()) == 3
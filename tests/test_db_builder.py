@@ -0,0 +1,277 @@
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+from PIL import Image
+import pytest
+from pytest import TempPathFactory
+
+from fileexplorer import db_builder, models
+from fileexplorer.db_builder import build_database, iter_supported_files, prioritize_requested_files
+from fileexplorer.image_proc import ImageProcessor
+from fileexplorer.models import create_tables, normalize_path, request_paths
+
+SUPPORTED_EXTENSIONS = ['.png', '.jpg', '.jpeg', '.gif', '.bmp', '.pdf', '.stl']
+
+# Helper functions for pytest tests
+def run_build(root_dir: Path, instance_dir: Path, **kwargs) -> Path:
+    database_path = instance_dir / 'files.db'
+    build_database(
+        database_path=database_path.as_posix(),
+        root_dir=root_dir,
+        resources_dir=instance_dir / 'resources',
+        supported_extensions=SUPPORTED_EXTENSIONS,
+        **kwargs
+    )
+    return database_path
+
+def get_thumbnails(database_path: Path) -> dict[str, str]:
+    conn = sqlite3.connect(database_path)
+    rows = conn.execute('SELECT file_path, thumbnail_file FROM files').fetchall()
+    conn.close()
+    return dict(rows)
+
+# Directory structure is
+# root_dir/
+#     image0.png ... image9.png
+#     subdir/image10.png ... image19.png
+#     subdir/text-file.txt
+@pytest.fixture(scope="session")
+def image_root_dir(tmp_path_factory: TempPathFactory) -> Path:
+    root_dir = tmp_path_factory.mktemp('root-dir')
+    (root_dir / 'subdir').mkdir()
+    for i in range(20):
+        img = Image.new('RGB', size=(150,150), color=(10*i,0,0))
+        img.save(root_dir / ('subdir' if i >= 10 else '.') / f'image{i}.png')
+    (root_dir / 'subdir/text-file.txt').touch()
+    return root_dir
+
+def test_parallel_build_matches_serial_build(
+    image_root_dir: Path,
+    tmp_path_factory: TempPathFactory
+):
+    serial_db = run_build(image_root_dir, tmp_path_factory.mktemp('serial'), workers=1)
+    parallel_db = run_build(image_root_dir, tmp_path_factory.mktemp('parallel'), workers=3)
+    serial_thumbnails = get_thumbnails(serial_db)
+    assert len(serial_thumbnails) == 20
+    assert get_thumbnails(parallel_db) == serial_thumbnails
+
+def test_rebuild_only_processes_changed_files(
+    tmp_path_factory: TempPathFactory,
+    monkeypatch: pytest.MonkeyPatch
+):
+    root_dir = tmp_path_factory.mktemp('root-dir')
+    for name in ['unchanged.png', 'changed.png', 'deleted.png']:
+        Image.new('RGB', size=(150,150), color=(255,0,0)).save(root_dir / name)
+    instance_dir = tmp_path_factory.mktemp('instance-dir')
+    database_path = run_build(root_dir, instance_dir)
+    assert len(get_thumbnails(database_path)) == 3
+
+    Image.new('RGB', size=(160,160), color=(0,255,0)).save(root_dir / 'changed.png')
+    (root_dir / 'deleted.png').unlink()
+    Image.new('RGB', size=(150,150), color=(0,0,255)).save(root_dir / 'new.png')
+    processed = []
+    original_process_file = db_builder.process_file
+    def spy_process_file(file_path, resources_dir):
+        processed.append(file_path.name)
+        return original_process_file(file_path, resources_dir)
+    monkeypatch.setattr(db_builder, 'process_file', spy_process_file)
+    run_build(root_dir, instance_dir)
+
+    assert sorted(processed) == ['changed.png', 'new.png']
+    thumbnails = get_thumbnails(database_path)
+    assert sorted(Path(p).name for p in thumbnails) == ['changed.png', 'new.png', 'unchanged.png']
+
+def test_unreadable_file_is_recorded_as_error(tmp_path_factory: TempPathFactory):
+    root_dir = tmp_path_factory.mktemp('root-dir')
+    with open(root_dir / 'not-an-image.png', 'w') as f:
+        f.write('not an image')
+    database_path = run_build(root_dir, tmp_path_factory.mktemp('instance-dir'))
+    assert list(get_thumbnails(database_path).values()) == [None]
+
+def test_requested_files_come_first(
+    image_root_dir: Path,
+    tmp_path: Path,
+    monkeypatch: pytest.MonkeyPatch
+):
+    monkeypatch.setattr(models, 'DATABASE_PATH', (tmp_path / 'files.db').as_posix())
+    create_tables()
+    walk = sorted(file_path for file_path, _ in iter_supported_files(image_root_dir, SUPPORTED_EXTENSIONS))
+    requested = image_root_dir / 'subdir/image15.png'
+    request_paths([
+        normalize_path(requested),
+        normalize_path(image_root_dir / 'subdir'),
+        # Outside of the root directory
+        normalize_path(tmp_path),
+    ])
+    order = list(prioritize_requested_files(walk, image_root_dir, SUPPORTED_EXTENSIONS))
+    assert order[0] == requested
+    assert {file_path.name for file_path in order[1:10]} == {f'image{i}.png' for i in range(10, 20)} - {'image15.png'}
+    assert sorted(order) == walk
+
+def test_copies_are_not_rendered_again(tmp_path_factory: TempPathFactory, monkeypatch: pytest.MonkeyPatch):
+    root_dir = tmp_path_factory.mktemp('root-dir')
+    for name in ['a', 'b', 'c']:
+        (root_dir / name).mkdir()
+        Image.new('RGB', size=(150,150), color=(255,0,0)).save(root_dir / name / 'copy.png')
+    Image.new('RGB', size=(150,150), color=(0,255,0)).save(root_dir / 'other.png')
+    rendered = []
+    original_open_thumbnail_image = ImageProcessor.open_thumbnail_image
+    def spy_open_thumbnail_image(self, file_path, thumbnail_size):
+        rendered.append(file_path.name)
+        return original_open_thumbnail_image(self, file_path, thumbnail_size)
+    monkeypatch.setattr(ImageProcessor, 'open_thumbnail_image', spy_open_thumbnail_image)
+    instance_dir = tmp_path_factory.mktemp('instance-dir')
+    stats = build_database(
+        database_path=(instance_dir / 'files.db').as_posix(),
+        root_dir=root_dir,
+        resources_dir=instance_dir / 'resources',
+        supported_extensions=SUPPORTED_EXTENSIONS,
+    )
+    assert sorted(rendered) == ['copy.png', 'other.png']
+    assert (stats.files_processed, stats.files_deduplicated) == (4, 2)
+    assert stats.bytes_deduplicated == 2 * (root_dir / 'a/copy.png').stat().st_size
+    conn = sqlite3.connect(instance_dir / 'files.db')
+    rows = conn.execute(
+        'SELECT thumbnail_file, data_file, content_hash FROM files WHERE file_path LIKE ?',
+        ('%/copy.png',)
+    ).fetchall()
+    conn.close()
+    assert len(rows) == 3
+    assert len(set(rows)) == 1
+
+    # A copy made after its original was deleted gets a data file of its own
+    data_file = instance_dir / 'resources/files' / rows[0][1]
+    for name in ['a', 'b', 'c']:
+        (root_dir / name / 'copy.png').unlink()
+    assert not data_file.exists()
+    Image.new('RGB', size=(150,150), color=(255,0,0)).save(root_dir / 'copy.png')
+    stats = build_database(
+        database_path=(instance_dir / 'files.db').as_posix(),
+        root_dir=root_dir,
+        resources_dir=instance_dir / 'resources',
+        supported_extensions=SUPPORTED_EXTENSIONS,
+    )
+    assert (stats.files_processed, stats.files_deduplicated) == (1, 1)
+    assert data_file.resolve() == (root_dir / 'copy.png').resolve()
+
+def get_failures(database_path: Path) -> dict[str, tuple]:
+    conn = sqlite3.connect(database_path)
+    rows = conn.execute(
+        "SELECT file_path, error, duration, attempts, retry_at FROM files WHERE status = 'error'"
+    ).fetchall()
+    conn.close()
+    return {Path(row[0]).name: row[1:] for row in rows}
+
+def test_failures_recorded_and_retried(tmp_path_factory: TempPathFactory):
+    root_dir = tmp_path_factory.mktemp('root-dir')
+    (root_dir / 'broken.png').write_text('not an image')
+    Image.new('RGB', size=(150,150), color=(255,0,0)).save(root_dir / 'fine.png')
+    instance_dir = tmp_path_factory.mktemp('instance-dir')
+    retry_policy = db_builder.RetryPolicy(max_attempts=3, backoff=0)
+    database_path = run_build(root_dir, instance_dir, retry_policy=retry_policy)
+    # Tried again right after the walk, since the backoff is 0
+    error, duration, attempts, retry_at = get_failures(database_path)['broken.png']
+    assert error.startswith('UnidentifiedImageError')
+    assert duration >= 0
+    assert attempts == 2
+    assert retry_at is not None
+    run_build(root_dir, instance_dir, retry_policy=retry_policy)
+    assert get_failures(database_path)['broken.png'][2:] == (3, None)
+    # Given up on until it changes
+    run_build(root_dir, instance_dir, retry_policy=retry_policy)
+    assert get_failures(database_path)['broken.png'][2] == 3
+    (root_dir / 'broken.png').write_text('still not an image')
+    run_build(root_dir, instance_dir, retry_policy=db_builder.RetryPolicy(max_attempts=3, backoff=60))
+    assert get_failures(database_path)['broken.png'][2] == 1
+    assert list(get_failures(database_path)) == ['broken.png']
+
+def test_hung_file_times_out(tmp_path_factory: TempPathFactory, monkeypatch: pytest.MonkeyPatch):
+    root_dir = tmp_path_factory.mktemp('root-dir')
+    for name in ['hangs.png', 'fine.png']:
+        Image.new('RGB', size=(150,150), color=(255,0,0) if name == 'fine.png' else (0,0,255)).save(root_dir / name)
+    original_open_thumbnail_image = ImageProcessor.open_thumbnail_image
+    def hanging_open_thumbnail_image(self, file_path, thumbnail_size):
+        if file_path.name == 'hangs.png':
+            time.sleep(60)
+        return original_open_thumbnail_image(self, file_path, thumbnail_size)
+    # Inherited by the worker processes
+    monkeypatch.setattr(ImageProcessor, 'open_thumbnail_image', hanging_open_thumbnail_image)
+    database_path = run_build(root_dir, tmp_path_factory.mktemp('instance-dir'), timeout=1.0)
+    thumbnails = get_thumbnails(database_path)
+    assert thumbnails[normalize_path(root_dir / 'fine.png')] is not None
+    error, duration, attempts, _ = get_failures(database_path)['hangs.png']
+    assert error == 'timed out after 1 s'
+    assert 1 <= duration < 10
+    assert attempts == 1
+
+def test_results_committed_while_slow_file_renders(
+    tmp_path_factory: TempPathFactory,
+    monkeypatch: pytest.MonkeyPatch,
+):
+    root_dir = tmp_path_factory.mktemp('root-dir')
+    (root_dir / 'subdir').mkdir()
+    # The walk reaches fast.png first
+    for name in ['fast.png', 'subdir/slow.png']:
+        Image.new('RGB', size=(150,150), color=(255,0,0) if name == 'fast.png' else (0,0,255)).save(root_dir / name)
+    original_open_thumbnail_image = ImageProcessor.open_thumbnail_image
+    def slow_open_thumbnail_image(self, file_path, thumbnail_size):
+        if file_path.name == 'slow.png':
+            time.sleep(4)
+        return original_open_thumbnail_image(self, file_path, thumbnail_size)
+    # Inherited by the worker processes
+    monkeypatch.setattr(ImageProcessor, 'open_thumbnail_image', slow_open_thumbnail_image)
+    instance_dir = tmp_path_factory.mktemp('instance-dir')
+    database_path = instance_dir / 'files.db'
+    # Rendered by a worker process, while this one waits for its results
+    build = threading.Thread(
+        target=run_build,
+        args=(root_dir, instance_dir),
+        kwargs={'batch_ms': 100, 'timeout': 30.0},
+    )
+    start = time.monotonic()
+    build.start()
+    try:
+        fast_path = normalize_path(root_dir / 'fast.png')
+        while time.monotonic() - start < 3 and fast_path not in get_thumbnails_if_built(database_path):
+            time.sleep(0.05)
+        # Not held back until slow.png is done
+        assert fast_path in get_thumbnails_if_built(database_path)
+    finally:
+        build.join()
+    assert normalize_path(root_dir / 'subdir/slow.png') in get_thumbnails(database_path)
+
+def get_thumbnails_if_built(database_path: Path) -> dict[str, str]:
+    try:
+        return get_thumbnails(database_path)
+    except sqlite3.OperationalError:
+        # Not created yet
+        return {}
+
+def test_request_threads_share_processors(tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setattr(db_builder, '_on_demand_processors', {})
+    made = []
+    original_make_processors = db_builder.make_processors
+    def slow_make_processors(*args):
+        made.append(args)
+        time.sleep(0.1)
+        return original_make_processors(*args)
+    monkeypatch.setattr(db_builder, 'make_processors', slow_make_processors)
+    barrier = threading.Barrier(8)
+    processors = []
+    def get_processors():
+        barrier.wait()
+        processors.append(db_builder.get_on_demand_processors(tmp_path, (), True, 'md5'))
+    threads = [threading.Thread(target=get_processors) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(made) == 1
+    assert all(p is processors[0] for p in processors)
+    # Another configuration gets processors of its own, leaving the pack open
+    pack = db_builder.get_on_demand_processors(tmp_path, (), True, 'md5')['.png'][1].thumbnail_pack
+    db_builder.get_on_demand_processors(tmp_path, (), False, 'sha256')
+    pack.put('a.png', b'a')
+    assert pack.get('a.png') == b'a'
@@ -0,0 +1,101 @@
+from io import BytesIO
+from pathlib import Path
+import struct
+
+from PIL import Image
+import pytest
+
+from fileexplorer.image_proc import ImageProcessor
+
+# Helper functions for pytest tests
+def make_exif(orientation: int, thumbnail_bytes: bytes) -> bytes:
+    """EXIF data with an orientation in IFD0 and a JPEG thumbnail in IFD1"""
+    ifd0_offset = 8
+    ifd1_offset = ifd0_offset + 2 + 12 + 4
+    thumbnail_offset = ifd1_offset + 2 + 2 * 12 + 4
+    tiff = b'II*\x00' + struct.pack('<I', ifd0_offset)
+    tiff += struct.pack('<H', 1) + struct.pack('<HHIHH', 0x0112, 3, 1, orientation, 0)
+    tiff += struct.pack('<I', ifd1_offset)
+    tiff += struct.pack('<H', 2)
+    tiff += struct.pack('<HHII', 0x0201, 4, 1, thumbnail_offset)
+    tiff += struct.pack('<HHII', 0x0202, 4, 1, len(thumbnail_bytes))
+    tiff += struct.pack('<I', 0)
+    return b'Exif\x00\x00' + tiff + thumbnail_bytes
+
+def make_jpeg(
+    file_path: Path,
+    size: tuple[int, int],
+    orientation: int=1,
+    exif_thumbnail_size: tuple[int, int]|None=None
+):
+    exif = b''
+    if exif_thumbnail_size is not None:
+        thumbnail_bytes_io = BytesIO()
+        Image.new('RGB', size=exif_thumbnail_size, color=(0,255,0)).save(thumbnail_bytes_io, format='jpeg')
+        exif = make_exif(orientation, thumbnail_bytes_io.getvalue())
+    Image.new('RGB', size=size, color=(255,0,0)).save(file_path, exif=exif)
+
+def make_thumbnail(file_path: Path, thumbnails_dir: Path) -> Image.Image:
+    thumbnail_filename = ImageProcessor().make_thumbnail(file_path, thumbnails_dir, (100, 100))
+    return Image.open(thumbnails_dir / thumbnail_filename)
+
+def is_close(color: tuple, expected: tuple) -> bool:
+    return all(abs(c - e) < 10 for c, e in zip(color, expected))
+
+def test_large_exif_thumbnail_used(tmp_path: Path):
+    make_jpeg(tmp_path / 'photo.jpg', (1200, 800), exif_thumbnail_size=(150, 100))
+    thumbnail = make_thumbnail(tmp_path / 'photo.jpg', tmp_path)
+    assert thumbnail.size == (100, 67)
+    assert is_close(thumbnail.getpixel((50, 33)), (0,255,0))
+
+@pytest.mark.parametrize('exif_thumbnail_size', [(60, 40), (150, 150)])
+def test_small_or_letterboxed_exif_thumbnail_ignored(tmp_path: Path, exif_thumbnail_size: tuple[int, int]):
+    make_jpeg(tmp_path / 'photo.jpg', (1200, 800), exif_thumbnail_size=exif_thumbnail_size)
+    thumbnail = make_thumbnail(tmp_path / 'photo.jpg', tmp_path)
+    assert thumbnail.size == (100, 67)
+    assert is_close(thumbnail.getpixel((50, 33)), (255,0,0))
+
+def test_exif_orientation_applied(tmp_path: Path):
+    make_jpeg(tmp_path / 'photo.jpg', (1200, 800), orientation=6, exif_thumbnail_size=(60, 40))
+    thumbnail = make_thumbnail(tmp_path / 'photo.jpg', tmp_path)
+    assert thumbnail.size == (67, 100)
+
+def test_large_jpeg_decoded_at_reduced_size(tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+    make_jpeg(tmp_path / 'photo.jpg', (2000, 1600))
+    decoded_sizes = []
+    original_write_thumbnail = ImageProcessor.write_thumbnail
+    def spy_write_thumbnail(self, image, thumbnails_dir, thumbnail_size):
+        image.load()
+        decoded_sizes.append(image.size)
+        return original_write_thumbnail(self, image, thumbnails_dir, thumbnail_size)
+    monkeypatch.setattr(ImageProcessor, 'write_thumbnail', spy_write_thumbnail)
+    thumbnail = make_thumbnail(tmp_path / 'photo.jpg', tmp_path)
+    assert decoded_sizes == [(250, 200)]
+    assert thumbnail.size == (100, 80)
+
+def test_thumbnail_variants_made_from_one_decode(tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+    make_jpeg(tmp_path / 'photo.jpg', (2400, 1600))
+    decoded_sizes = []
+    original_write_thumbnail = ImageProcessor.write_thumbnail
+    def spy_write_thumbnail(self, image, thumbnails_dir, thumbnail_size):
+        image.load()
+        decoded_sizes.append(image.size)
+        return original_write_thumbnail(self, image, thumbnails_dir, thumbnail_size)
+    monkeypatch.setattr(ImageProcessor, 'write_thumbnail', spy_write_thumbnail)
+    processor = ImageProcessor(thumbnail_sizes=(64, 256))
+    thumbnail_filename = processor.make_thumbnail(tmp_path / 'photo.jpg', tmp_path, (100, 100))
+    # Decoded at 1/8 scale, still large enough for the 256 pixel variant
+    assert decoded_sizes == [(300, 200)]
+    assert Image.open(tmp_path / thumbnail_filename).size == (100, 67)
+    stem = Path(thumbnail_filename).stem
+    assert Image.open(tmp_path / f'{stem}.64.png').size == (64, 43)
+    assert Image.open(tmp_path / f'{stem}.256.png').size == (256, 171)
+
+def test_make_thumbnail_variant(tmp_path: Path):
+    make_jpeg(tmp_path / 'photo.jpg', (2400, 1600))
+    processor = ImageProcessor()
+    thumbnail_filename = processor.make_thumbnail(tmp_path / 'photo.jpg', tmp_path, (100, 100))
+    variant_filename = processor.make_thumbnail_variant(tmp_path / 'photo.jpg', tmp_path, thumbnail_filename, 512)
+    assert variant_filename == f'{Path(thumbnail_filename).stem}.512.png'
+    assert Image.open(tmp_path / variant_filename).size == (512, 341)
+    assert processor.make_thumbnail_variant(tmp_path / 'missing.jpg', tmp_path, thumbnail_filename, 512) is None
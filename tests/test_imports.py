@@ -0,0 +1,37 @@
+from pathlib import Path
+import subprocess
+import sys
+
+from PIL import Image
+
+PROCESSING_PACKAGES = {'PIL', 'fitz', 'pymupdf', 'numpy', 'stl'}
+
+SERVE_DIRECTORY = '''
+import sys
+from fileexplorer import create_app
+root_dir, instance_dir = sys.argv[1:]
+app = create_app({
+    'TESTING': True,
+    'ROOT_DIR': root_dir,
+    'RESOURCES_DIR': instance_dir + '/resources',
+    'DATABASE_PATH': instance_dir + '/files.db',
+})
+client = app.test_client()
+listing = client.get('/api/directory-info/', query_string={'include': 'file_info'}).json
+thumbnail_url = listing['files'][0]['file_info']['thumbnail_url']
+assert client.get(thumbnail_url, headers={'Accept': 'image/webp'}).status_code == 200
+print(' '.join({name.split('.')[0] for name in sys.modules}))
+'''
+
+def test_web_server_does_not_import_processing_libraries(tmp_path: Path):
+    root_dir = tmp_path / 'root'
+    root_dir.mkdir()
+    Image.new('RGB', size=(150,150), color=(0,0,255)).save(root_dir / 'image.png')
+    # A fresh interpreter, since this one has imported everything already
+    result = subprocess.run(
+        [sys.executable, '-c', SERVE_DIRECTORY, root_dir.as_posix(), (tmp_path / 'instance').as_posix()],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    assert PROCESSING_PACKAGES.isdisjoint(result.stdout.split())
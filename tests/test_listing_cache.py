@@ -0,0 +1,60 @@
+import os
+from pathlib import Path
+import time
+
+import pytest
+
+from fileexplorer import listing_cache
+from fileexplorer.inotify import inotify_available
+from fileexplorer.listing_cache import DirectoryListingCache, ListingEntry
+
+def list_names(cache: DirectoryListingCache, path: Path) -> list[str]:
+    return sorted(entry.name for entry in cache.iter_entries(path))
+
+def test_cache_hit_until_directory_mtime_changes(tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setattr(listing_cache, 'RACY_MTIME_NS', 0)
+    (tmp_path / 'subdir').mkdir()
+    (tmp_path / 'file.txt').touch()
+    cache = DirectoryListingCache()
+    assert sorted(cache.iter_entries(tmp_path)) == [ListingEntry('file.txt', False), ListingEntry('subdir', True)]
+    assert list_names(cache, tmp_path) == ['file.txt', 'subdir']
+    assert (cache.hits, cache.misses) == (1, 1)
+
+    (tmp_path / 'new-file.txt').touch()
+    os.utime(tmp_path, ns=(0, 10**9))
+    assert list_names(cache, tmp_path) == ['file.txt', 'new-file.txt', 'subdir']
+    assert (cache.hits, cache.misses) == (1, 2)
+
+def test_recently_modified_directory_not_cached(tmp_path: Path):
+    (tmp_path / 'file.txt').touch()
+    cache = DirectoryListingCache()
+    list_names(cache, tmp_path)
+    list_names(cache, tmp_path)
+    assert (cache.hits, cache.misses) == (0, 2)
+
+def test_least_recently_used_listing_evicted(tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setattr(listing_cache, 'RACY_MTIME_NS', 0)
+    for name in ['a', 'b', 'c']:
+        (tmp_path / name).mkdir()
+    cache = DirectoryListingCache(max_directories=2)
+    list_names(cache, tmp_path / 'a')
+    list_names(cache, tmp_path / 'b')
+    list_names(cache, tmp_path / 'a')
+    list_names(cache, tmp_path / 'c')
+    assert cache.evictions == 1
+    list_names(cache, tmp_path / 'a')
+    assert (cache.hits, cache.misses) == (2, 3)
+
+@pytest.mark.skipif(not inotify_available(), reason='inotify is not available')
+def test_inotify_invalidation(tmp_path: Path):
+    (tmp_path / 'file.txt').touch()
+    cache = DirectoryListingCache(use_inotify=True)
+    assert list_names(cache, tmp_path) == ['file.txt']
+    assert list_names(cache, tmp_path) == ['file.txt']
+    assert cache.hits == 1
+    (tmp_path / 'new-file.txt').touch()
+    deadline = time.monotonic() + 5
+    while cache.invalidations == 0 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert list_names(cache, tmp_path) == ['file.txt', 'new-file.txt']
+    assert cache.invalidations == 1
@@ -0,0 +1,76 @@
+from pathlib import Path
+
+import numpy as np
+
+from fileexplorer.mesh import (
+    MESH_LOD_TRIANGLES,
+    QUANTIZATION_STEPS,
+    decimate,
+    deduplicate_vertices,
+    make_mesh_lods,
+    mesh_lod_filenames,
+    read_mesh,
+    write_mesh,
+)
+
+# Helper functions for pytest tests
+def make_sphere_vectors(rows: int, cols: int) -> np.ndarray:
+    """A UV sphere as an STL would store it, three vertices per triangle"""
+    theta = np.linspace(0, np.pi, rows + 1)[:, None]
+    phi = np.linspace(0, 2 * np.pi, cols + 1)[None, :]
+    points = np.stack([
+        np.sin(theta) * np.cos(phi),
+        np.sin(theta) * np.sin(phi),
+        np.cos(theta) * np.ones_like(phi),
+    ], axis=-1).astype(np.float32)
+    a = points[:-1, :-1].reshape(-1, 3)
+    b = points[1:, :-1].reshape(-1, 3)
+    c = points[1:, 1:].reshape(-1, 3)
+    d = points[:-1, 1:].reshape(-1, 3)
+    return np.concatenate([np.stack([a, b, c], axis=1), np.stack([a, c, d], axis=1)])
+
+def test_deduplicate_vertices():
+    vectors = np.array([
+        [[0,0,0], [1,0,0], [0,1,0]],
+        [[1,0,0], [1,1,0], [0,1,0]],
+        [[0,0,0], [0,0,0], [0,1,0]],
+    ], dtype=np.float32)
+    vertices, triangles = deduplicate_vertices(vectors)
+    assert len(vertices) == 4
+    # The degenerate triangle is dropped
+    assert len(triangles) == 2
+    assert np.array_equal(vertices[triangles], vectors[:2])
+
+def test_decimate_within_budget():
+    vertices, triangles = deduplicate_vertices(make_sphere_vectors(200, 200))
+    assert len(triangles) > 50_000
+    decimated_vertices, decimated_triangles = decimate(vertices, triangles, 5_000)
+    assert 1_000 < len(decimated_triangles) <= 5_000
+    assert decimated_triangles.max() == len(decimated_vertices) - 1
+    # Still a sphere
+    radii = np.linalg.norm(decimated_vertices, axis=1)
+    assert np.all(radii > 0.9) and np.all(radii < 1.01)
+
+def test_make_mesh_lods():
+    lods = make_mesh_lods(make_sphere_vectors(300, 300))
+    assert [budget for budget, _, _ in lods] == [*MESH_LOD_TRIANGLES, None]
+    triangle_counts = [len(triangles) for _, _, triangles in lods]
+    assert triangle_counts == sorted(triangle_counts)
+    assert triangle_counts[0] <= MESH_LOD_TRIANGLES[0]
+
+def test_small_mesh_has_only_full_lod():
+    lods = make_mesh_lods(make_sphere_vectors(10, 10))
+    assert [budget for budget, _, _ in lods] == [None]
+
+def test_write_read_mesh(tmp_path: Path):
+    vertices, triangles = deduplicate_vertices(make_sphere_vectors(21, 17))
+    write_mesh(tmp_path / 'sphere.mesh', vertices, triangles)
+    read_vertices, read_triangles = read_mesh(tmp_path / 'sphere.mesh')
+    assert np.array_equal(read_triangles, triangles)
+    # Within half a quantization step of the 2 unit bounding box
+    assert np.abs(read_vertices - vertices).max() <= 2 / QUANTIZATION_STEPS
+    assert list(tmp_path.iterdir()) == [tmp_path / 'sphere.mesh']
+
+def test_mesh_lod_filenames():
+    assert mesh_lod_filenames('0123abcd.stl')[-1] == (None, '0123abcd.mesh')
+    assert mesh_lod_filenames('0123abcd.stl')[0] == (MESH_LOD_TRIANGLES[0], f'0123abcd.{MESH_LOD_TRIANGLES[0]}.mesh')
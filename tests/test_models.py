@@ -0,0 +1,178 @@
+from pathlib import Path
+import sqlite3
+import threading
+
+from flask import Flask
+import pytest
+
+from fileexplorer import models
+from fileexplorer.models import (
+    DatabaseWriter,
+    create_tables,
+    delete_files,
+    get_data_filename,
+    get_database_version,
+    get_file_record,
+    get_thumbnail_filename,
+)
+
+STAT_KEY = (1, 2, 3)
+
+@pytest.fixture
+def database_path(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> Path:
+    database_path = tmp_path / 'files.db'
+    monkeypatch.setattr(models, 'DATABASE_PATH', database_path.as_posix())
+    return database_path
+
+def count_files(database_path: Path) -> int:
+    conn = sqlite3.connect(database_path)
+    count = conn.execute('SELECT COUNT(*) FROM files').fetchone()[0]
+    conn.close()
+    return count
+
+def test_writer_commits_in_batches(database_path: Path, tmp_path: Path):
+    create_tables()
+    writer = DatabaseWriter(batch_rows=3, batch_ms=60_000)
+    writer.upsert_file(tmp_path / 'a.png', 'image', STAT_KEY, 'a.png', 'a.png')
+    writer.upsert_file(tmp_path / 'b.png', 'image', STAT_KEY, 'b.png', 'b.png')
+    assert count_files(database_path) == 0
+    writer.upsert_file(tmp_path / 'c.png', 'image', STAT_KEY, 'c.png', 'c.png')
+    assert count_files(database_path) == 3
+    writer.upsert_file(tmp_path / 'd.png', 'image', STAT_KEY, 'd.png', 'd.png')
+    writer.close()
+    assert count_files(database_path) == 4
+
+def test_writer_applies_delete_after_queued_upsert(database_path: Path, tmp_path: Path):
+    create_tables()
+    file_path = tmp_path / 'a.png'
+    with DatabaseWriter(batch_rows=100) as writer:
+        writer.upsert_file(file_path, 'image', STAT_KEY, 'first.png', 'a.png')
+        writer.delete_files([models.normalize_path(file_path)])
+        writer.upsert_file(file_path, 'image', STAT_KEY, 'second.png', 'a.png')
+        writer.upsert_file(tmp_path / 'b.png', 'image', STAT_KEY, 'b.png', 'b.png')
+        writer.delete_files([models.normalize_path(tmp_path / 'b.png')])
+    assert count_files(database_path) == 1
+    assert get_thumbnail_filename(file_path) == 'second.png'
+
+def test_thumbnail_status(database_path: Path, tmp_path: Path):
+    create_tables()
+    models.upsert_file(tmp_path / 'ok.png', 'image', STAT_KEY, 'thumb.png', 'data.png')
+    models.upsert_file(tmp_path / 'bad.png', 'image', STAT_KEY, None, None)
+    assert get_thumbnail_filename(tmp_path / 'ok.png') == 'thumb.png'
+    assert get_thumbnail_filename(tmp_path / 'bad.png') == 'error'
+    assert get_thumbnail_filename(tmp_path / 'missing.png') == 'processing'
+    assert get_data_filename(tmp_path / 'missing.png') is None
+
+def test_database_version_changes_with_files(database_path: Path, tmp_path: Path):
+    create_tables()
+    versions = [get_database_version()]
+    with DatabaseWriter(batch_rows=1, batch_ms=60_000) as writer:
+        writer.upsert_file(tmp_path / 'a.png', 'image', STAT_KEY, 'a.png', 'a.png')
+        versions.append(get_database_version())
+        writer.flush()
+        # Nothing written, nothing changed
+        assert get_database_version() == versions[-1]
+    delete_files([models.normalize_path(tmp_path / 'a.png')])
+    versions.append(get_database_version())
+    assert len(set(versions)) == 3
+    create_tables()
+    assert get_database_version() == versions[-1]
+
+def test_migrate_legacy_tables(database_path: Path, tmp_path: Path):
+    ok_path = models.normalize_path(tmp_path / 'ok.pdf')
+    bad_path = models.normalize_path(tmp_path / 'bad.png')
+    conn = sqlite3.connect(database_path)
+    conn.execute('CREATE TABLE thumbnails (file_path STR, thumbnail_file STR)')
+    conn.execute('CREATE TABLE data_files (file_path STR, data_file STR)')
+    conn.execute('CREATE TABLE file_stats (file_path STR PRIMARY KEY, st_mtime_ns INT, st_size INT, st_ino INT)')
+    conn.execute('INSERT INTO thumbnails VALUES (?,?)', (ok_path, 'thumb.png'))
+    conn.execute('INSERT INTO thumbnails VALUES (?,?)', (bad_path, None))
+    conn.execute('INSERT INTO data_files VALUES (?,?)', (ok_path, 'data.pdf'))
+    conn.execute('INSERT INTO file_stats VALUES (?,?,?,?)', (ok_path, 1, 2, 3))
+    conn.commit()
+    conn.close()
+
+    create_tables()
+
+    record = get_file_record(ok_path)
+    assert record['file_type'] == 'pdf'
+    assert record['status'] == 'ready'
+    assert record['thumbnail_file'] == 'thumb.png'
+    assert record['data_file'] == 'data.pdf'
+    assert models.get_indexed_files()[ok_path] == (1, 2, 3)
+    assert get_thumbnail_filename(bad_path) == 'error'
+    conn = sqlite3.connect(database_path)
+    tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    conn.close()
+    assert tables == {'files', 'database_version', 'requested_paths', 'thumbnail_accesses'}
+
+def test_connection_cached_per_thread(database_path: Path):
+    conn = models.get_db_connection()
+    assert models.get_db_connection() is conn
+    other_thread_conns = []
+    thread = threading.Thread(target=lambda: other_thread_conns.append(models.get_db_connection()))
+    thread.start()
+    thread.join()
+    assert other_thread_conns[0] is not conn
+    models.close_db_connection()
+    assert models.get_db_connection() is not conn
+
+def test_connection_replaced_when_database_path_changes(
+    database_path: Path,
+    tmp_path: Path,
+    monkeypatch: pytest.MonkeyPatch
+):
+    conn = models.get_db_connection()
+    monkeypatch.setattr(models, 'DATABASE_PATH', (tmp_path / 'other.db').as_posix())
+    assert models.get_db_connection() is not conn
+
+def test_read_connection_pooled_per_app_context(database_path: Path):
+    create_tables()
+    app = Flask(__name__)
+    app.config['DATABASE_PATH'] = database_path.as_posix()
+    models.init_database(app)
+    with app.app_context():
+        conn = models.get_read_connection()
+        assert models.get_read_connection() is conn
+        assert conn is not models.get_db_connection()
+        with pytest.raises(sqlite3.OperationalError):
+            conn.execute('DELETE FROM files')
+    # Given back when the app context ends, and reused by the next one
+    with app.app_context():
+        assert models.get_read_connection() is conn
+        with app.app_context():
+            assert models.get_read_connection() is not conn
+    # Outside of an app context, by the builder
+    assert models.get_read_connection() is models.get_db_connection()
+
+def test_migrate_schema_version_1(database_path: Path, tmp_path: Path):
+    conn = sqlite3.connect(database_path)
+    conn.execute(
+        'CREATE TABLE files (id INTEGER PRIMARY KEY, file_path TEXT NOT NULL, file_type TEXT, '
+        'st_size INTEGER, st_mtime_ns INTEGER, st_ino INTEGER, status TEXT NOT NULL, '
+        'thumbnail_file TEXT, data_file TEXT)'
+    )
+    conn.execute('PRAGMA user_version = 1')
+    conn.commit()
+    conn.close()
+
+    create_tables()
+    models.upsert_file(tmp_path / 'a.pdf', 'pdf', STAT_KEY, 'thumb.png', 'data.pdf', 'digest')
+    models.upsert_file(tmp_path / 'bad.pdf', 'pdf', STAT_KEY, None, None, 'bad-digest')
+
+    assert get_file_record(tmp_path / 'a.pdf')['content_hash'] == 'digest'
+    assert get_file_record(tmp_path / 'bad.pdf')['attempts'] is None
+    assert models.find_content('digest', 'pdf') == ('thumb.png', 'data.pdf')
+    assert models.find_content('digest', 'image') is None
+    assert models.find_content('bad-digest', 'pdf') is None
+
+def test_thumbnail_access_log(database_path: Path):
+    create_tables()
+    access_log = models.ThumbnailAccessLog(flush_interval=60)
+    access_log.record('a.png')
+    assert models.get_thumbnail_accesses() == {}
+    access_log.record('b.png')
+    access_log.flush()
+    accesses = models.get_thumbnail_accesses()
+    assert sorted(accesses) == ['a.png', 'b.png']
+    assert accesses['a.png'] <= accesses['b.png']
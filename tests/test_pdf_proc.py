@@ -0,0 +1,51 @@
+from pathlib import Path
+
+import fitz
+from PIL import Image
+import pytest
+
+from fileexplorer.pdf_proc import PdfProcessor, render_first_page
+
+# Helper functions for pytest tests
+def make_pdf(file_path: Path, page_size: tuple[float, float], thumb_size: tuple[int, int]|None=None):
+    """A PDF with a single blank page and optionally a solid green /Thumb"""
+    pdf = fitz.open()
+    page = pdf.new_page(width=page_size[0], height=page_size[1])
+    if thumb_size is not None:
+        width, height = thumb_size
+        xref = pdf.get_new_xref()
+        pdf.update_object(
+            xref,
+            f'<< /Type /XObject /Subtype /Image /Width {width} /Height {height} '
+            '/ColorSpace /DeviceRGB /BitsPerComponent 8 >>'
+        )
+        pdf.update_stream(xref, b'\x00\xff\x00' * width * height)
+        pdf.xref_set_key(page.xref, 'Thumb', f'{xref} 0 R')
+    pdf.save(file_path)
+    pdf.close()
+
+def test_large_page_rendered_at_thumbnail_size(tmp_path: Path):
+    # A0 drawing, 3370x2384 pixels at the default 72 dpi
+    make_pdf(tmp_path / 'drawing.pdf', (3370, 2384))
+    image = render_first_page(tmp_path / 'drawing.pdf', (100, 100))
+    assert image.size == (100, 71)
+    assert image.getpixel((50, 35)) == (255, 255, 255)
+
+def test_large_embedded_thumbnail_used(tmp_path: Path):
+    make_pdf(tmp_path / 'doc.pdf', (612, 792), thumb_size=(85, 110))
+    image = render_first_page(tmp_path / 'doc.pdf', (100, 100))
+    assert image.size == (85, 110)
+    assert image.getpixel((40, 55)) == (0, 255, 0)
+
+def test_small_embedded_thumbnail_ignored(tmp_path: Path):
+    make_pdf(tmp_path / 'doc.pdf', (612, 792), thumb_size=(38, 50))
+    image = render_first_page(tmp_path / 'doc.pdf', (100, 100))
+    assert image.size == (78, 100)
+    assert image.getpixel((38, 50)) == (255, 255, 255)
+
+def test_make_thumbnail(tmp_path: Path):
+    make_pdf(tmp_path / 'doc.pdf', (612, 792))
+    thumbnail_filename = PdfProcessor().make_thumbnail(tmp_path / 'doc.pdf', tmp_path, (100, 100))
+    assert Image.open(tmp_path / thumbnail_filename).size == (78, 100)
+    with pytest.raises(RuntimeError):
+        PdfProcessor().make_thumbnail(tmp_path / 'missing.pdf', tmp_path, (100, 100))
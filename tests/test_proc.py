@@ -0,0 +1,39 @@
+import hashlib
+from io import BytesIO
+import os
+from pathlib import Path
+
+from PIL import Image
+import pytest
+
+from fileexplorer import proc
+from fileexplorer.proc import encode_thumbnail, hash_file, thumbnail_format_filename
+
+def test_hash_file_in_chunks(tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setattr(proc, 'HASH_CHUNK_SIZE', 1000)
+    file_path = tmp_path / 'data.bin'
+    file_bytes = os.urandom(10_500)
+    file_path.write_bytes(file_bytes)
+    assert hash_file(file_path) == hashlib.md5(file_bytes).hexdigest()
+    assert hash_file(file_path, 'sha256') == hashlib.sha256(file_bytes).hexdigest()
+    assert hash_file(file_path, 'blake2b') == hashlib.blake2b(file_bytes, digest_size=16).hexdigest()
+
+def test_hash_file_rehashes_changed_file(tmp_path: Path):
+    file_path = tmp_path / 'data.bin'
+    file_path.write_bytes(b'first')
+    os.utime(file_path, ns=(0, 10**9))
+    assert hash_file(file_path) == hashlib.md5(b'first').hexdigest()
+    file_path.write_bytes(b'other')
+    os.utime(file_path, ns=(0, 2 * 10**9))
+    assert hash_file(file_path) == hashlib.md5(b'other').hexdigest()
+
+def test_encode_thumbnail_formats():
+    image = Image.new('RGBA', (10, 10), (255, 0, 0, 0))
+    image.putpixel((5, 5), (0, 0, 255, 255))
+    assert Image.open(BytesIO(encode_thumbnail(image))).format == 'PNG'
+    assert Image.open(BytesIO(encode_thumbnail(image, 'webp'))).mode == 'RGBA'
+    jpeg = Image.open(BytesIO(encode_thumbnail(image, 'jpeg')))
+    assert jpeg.mode == 'RGB'
+    # Transparent pixels are made white
+    assert all(c > 250 for c in jpeg.getpixel((0, 0)))
+    assert thumbnail_format_filename('abc.256.png', 'webp') == 'abc.256.webp'
@@ -0,0 +1,122 @@
+from importlib.metadata import EntryPoint
+from pathlib import Path
+import sqlite3
+
+from PIL import Image
+import pytest
+
+from fileexplorer import db_builder, registry
+from fileexplorer.db_builder import build_database, get_file_cost, iter_batches
+from fileexplorer.proc import ProcessorTemplate
+from fileexplorer.registry import (
+    DATA_FILE,
+    PROCESSOR_ENTRY_POINT_GROUP,
+    THUMBNAIL,
+    ProcessorSpec,
+    get_extension_map,
+    get_supported_extensions,
+)
+
+class TextProcessor(ProcessorTemplate):
+    """Thumbnails of the length of the first line of text files"""
+    extensions = ('.txt',)
+    file_type = 'text'
+
+    def open_thumbnail_image(self, file_path: Path, thumbnail_size: tuple[int, int]) -> Image.Image:
+        first_line = file_path.read_text().splitlines()[0]
+        return Image.new('RGB', (len(first_line), 10), 'white')
+
+    def make_thumbnail(self, file_path: Path, thumbnails_dir: Path, thumbnail_size: tuple[int, int]) -> str | None:
+        try:
+            image = self.open_thumbnail_image(file_path, thumbnail_size)
+        except Exception:
+            return None
+        return self.write_thumbnail(image, thumbnails_dir, thumbnail_size)
+
+    def make_data_file(self, file_path: Path, data_files_dir: Path) -> str:
+        raise AssertionError('text files have no data file')
+
+TEXT_PROCESSOR = ProcessorSpec('text', ('.txt', '.TEXT'), 'test_registry:TextProcessor', frozenset({THUMBNAIL}))
+
+class LogProcessor(ProcessorTemplate):
+    """Data files, but no thumbnails, for log files"""
+    extensions = ('.log',)
+    file_type = 'log'
+
+    def open_thumbnail_image(self, file_path: Path, thumbnail_size: tuple[int, int]) -> Image.Image:
+        raise AssertionError('log files have no thumbnail')
+
+    def make_thumbnail(self, file_path: Path, thumbnails_dir: Path, thumbnail_size: tuple[int, int]) -> str | None:
+        raise AssertionError('log files have no thumbnail')
+
+    def make_data_file(self, file_path: Path, data_files_dir: Path) -> str:
+        data_filename = self.hash_file(file_path) + file_path.suffix
+        (data_files_dir / data_filename).write_bytes(file_path.read_bytes())
+        return data_filename
+
+LOG_PROCESSOR = ProcessorSpec('log', ('.log',), 'test_registry:LogProcessor', frozenset({DATA_FILE}))
+
+@pytest.fixture
+def text_plugin(monkeypatch: pytest.MonkeyPatch):
+    def plugin_entry_points(group: str) -> list[EntryPoint]:
+        assert group == PROCESSOR_ENTRY_POINT_GROUP
+        return [
+            EntryPoint('text', 'test_registry:TEXT_PROCESSOR', group),
+            EntryPoint('log', 'test_registry:LOG_PROCESSOR', group),
+        ]
+    monkeypatch.setattr(registry, 'entry_points', plugin_entry_points)
+    monkeypatch.setattr(db_builder, '_processors', None)
+    registry.get_processor_specs.cache_clear()
+    registry.get_extension_map.cache_clear()
+    yield
+    registry.get_processor_specs.cache_clear()
+    registry.get_extension_map.cache_clear()
+
+def test_builtin_processors():
+    assert get_extension_map()['.jpeg'].file_type == 'image'
+    assert get_extension_map()['.pdf'].file_type == 'pdf'
+    assert get_extension_map()['.stl'].file_type == 'stl'
+    assert '.txt' not in get_supported_extensions()
+
+def test_batches_by_cost():
+    file_paths = [Path(name) for name in ['a.stl', 'b.png', 'c.stl', 'd.png', 'e.png', 'f.pdf']]
+    batches = list(iter_batches(file_paths, 11, get_file_cost))
+    assert [[p.name for p in batch] for batch in batches] == [['a.stl', 'b.png'], ['c.stl', 'd.png'], ['e.png', 'f.pdf']]
+
+def test_entry_point_processor(text_plugin, tmp_path: Path):
+    assert get_extension_map()['.text'] == TEXT_PROCESSOR
+    assert '.png' in get_supported_extensions()
+    root_dir = tmp_path / 'root'
+    root_dir.mkdir()
+    (root_dir / 'notes.txt').write_text('twelve chars\nmore')
+    (root_dir / 'empty.txt').write_text('')
+    (root_dir / 'build.log').write_text('done')
+    database_path = tmp_path / 'files.db'
+    build_database(
+        database_path=database_path.as_posix(),
+        root_dir=root_dir,
+        resources_dir=tmp_path / 'resources',
+        supported_extensions=get_supported_extensions(),
+    )
+    conn = sqlite3.connect(database_path)
+    rows = dict(
+        (Path(row[0]).name, row[1:])
+        for row in conn.execute('SELECT file_path, file_type, status, thumbnail_file, data_file FROM files')
+    )
+    conn.close()
+    file_type, status, thumbnail_file, data_file = rows['notes.txt']
+    assert (file_type, status, data_file) == ('text', 'ready', None)
+    assert Image.open(tmp_path / 'resources/thumbnails' / thumbnail_file).size == (12, 10)
+    assert rows['empty.txt'] == ('text', 'error', None, None)
+    file_type, status, thumbnail_file, data_file = rows['build.log']
+    assert (file_type, status, thumbnail_file) == ('log', 'ready', None)
+    assert (tmp_path / 'resources/files' / data_file).read_text() == 'done'
+
+def test_entry_point_must_be_spec(text_plugin, monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setattr(
+        registry,
+        'entry_points',
+        lambda group: [EntryPoint('text', 'test_registry:TextProcessor', group)],
+    )
+    with pytest.raises(TypeError):
+        get_extension_map()
@@ -0,0 +1,105 @@
+import os
+from pathlib import Path
+import time
+
+import pytest
+
+from fileexplorer import models
+from fileexplorer.models import create_tables, file_stat_key, get_thumbnail_accesses, upsert_file
+from fileexplorer.resource_gc import collect_garbage
+from fileexplorer.thumbnail_pack import ThumbnailPack
+
+LONG_AGO = time.time() - 24 * 60 * 60
+
+@pytest.fixture
+def resources_dir(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> Path:
+    monkeypatch.setattr(models, 'DATABASE_PATH', (tmp_path / 'files.db').as_posix())
+    create_tables()
+    resources_dir = tmp_path / 'resources'
+    (resources_dir / 'thumbnails').mkdir(parents=True)
+    (resources_dir / 'files').mkdir()
+    return resources_dir
+
+def make_resource(file_path: Path, size: int=100, made_at: float=LONG_AGO):
+    file_path.write_bytes(b'x' * size)
+    os.utime(file_path, (made_at, made_at))
+
+def make_symlink(link_path: Path, target: Path, made_at: float=LONG_AGO):
+    link_path.symlink_to(target)
+    os.utime(link_path, (made_at, made_at), follow_symlinks=False)
+
+def record_file(file_path: Path, thumbnail_filename: str, data_filename: str|None=None):
+    upsert_file(file_path, 'pdf', file_stat_key(file_path.stat()), thumbnail_filename, data_filename)
+
+def test_orphans_removed(resources_dir: Path, tmp_path: Path):
+    thumbnails_dir = resources_dir / 'thumbnails'
+    files_dir = resources_dir / 'files'
+    (tmp_path / 'a.pdf').write_bytes(b'a')
+    record_file(tmp_path / 'a.pdf', 'a.png', 'a.pdf')
+    for name in ['a.png', 'a.64.png', 'a.webp', 'orphan.png', 'orphan.64.webp', '.orphan.png.1.2']:
+        make_resource(thumbnails_dir / name)
+    # Saved by the builder but not recorded yet
+    make_resource(thumbnails_dir / 'new.png', made_at=time.time())
+    make_symlink(files_dir / 'a.pdf', tmp_path / 'a.pdf')
+    make_resource(files_dir / 'a.mesh')
+    make_symlink(files_dir / 'orphan.stl', tmp_path / 'orphan.stl')
+    make_resource(files_dir / 'orphan.10000.mesh')
+
+    stats = collect_garbage(resources_dir)
+
+    assert sorted(p.name for p in thumbnails_dir.iterdir()) == ['a.64.png', 'a.png', 'a.webp', 'new.png']
+    assert sorted(p.name for p in files_dir.iterdir()) == ['a.mesh', 'a.pdf']
+    assert stats.orphans_removed == 4
+    assert stats.bytes_freed >= 300
+
+def test_broken_symlinks_repaired_or_removed(resources_dir: Path, tmp_path: Path):
+    files_dir = resources_dir / 'files'
+    for name in ['copy1.pdf', 'copy2.pdf', 'moved.pdf']:
+        (tmp_path / name).write_bytes(b'same content')
+    record_file(tmp_path / 'copy1.pdf', 'same.png', 'same.pdf')
+    record_file(tmp_path / 'copy2.pdf', 'same.png', 'same.pdf')
+    record_file(tmp_path / 'moved.pdf', 'moved.png', 'moved.pdf')
+    make_symlink(files_dir / 'same.pdf', tmp_path / 'copy1.pdf')
+    make_symlink(files_dir / 'moved.pdf', tmp_path / 'moved.pdf')
+    (tmp_path / 'copy1.pdf').unlink()
+    (tmp_path / 'moved.pdf').rename(tmp_path / 'elsewhere.pdf')
+
+    stats = collect_garbage(resources_dir)
+
+    assert (files_dir / 'same.pdf').resolve() == (tmp_path / 'copy2.pdf').resolve()
+    assert not (files_dir / 'moved.pdf').is_symlink()
+    assert (stats.symlinks_repaired, stats.symlinks_removed) == (1, 1)
+
+def test_thumbnail_budget_evicts_least_recently_served(resources_dir: Path, tmp_path: Path):
+    thumbnails_dir = resources_dir / 'thumbnails'
+    for name in ['a', 'b', 'c']:
+        (tmp_path / f'{name}.pdf').write_bytes(name.encode())
+        record_file(tmp_path / f'{name}.pdf', f'{name}.png')
+        make_resource(thumbnails_dir / f'{name}.png', made_at=LONG_AGO + 2)
+        make_resource(thumbnails_dir / f'{name}.64.png', made_at=LONG_AGO + 2)
+    # c was never served, so it counts as served when it was made
+    models.record_thumbnail_accesses({'a.png': LONG_AGO + 3, 'b.png': LONG_AGO + 1, 'unknown.png': LONG_AGO})
+
+    stats = collect_garbage(resources_dir, thumbnail_budget=250)
+
+    assert sorted(p.name for p in thumbnails_dir.iterdir()) == ['a.64.png', 'a.png']
+    assert stats.thumbnails_evicted == 2
+    assert stats.orphans_removed == 0
+    assert get_thumbnail_accesses() == {'a.png': LONG_AGO + 3}
+
+def test_compact_thumbnail_pack(resources_dir: Path, tmp_path: Path):
+    (tmp_path / 'a.pdf').write_bytes(b'a')
+    record_file(tmp_path / 'a.pdf', 'a.png')
+    with ThumbnailPack(resources_dir) as thumbnail_pack:
+        for name in ['a.png', 'a.webp', 'orphan.png', 'orphan.64.png']:
+            thumbnail_pack.put(name, name.encode() * 10)
+
+    # Only when asked to, with no other process using the pack
+    assert collect_garbage(resources_dir).bytes_freed == 0
+    stats = collect_garbage(resources_dir, compact_pack=True)
+
+    with ThumbnailPack(resources_dir) as thumbnail_pack:
+        assert sorted(thumbnail_pack.names()) == ['a.png', 'a.webp']
+        assert thumbnail_pack.get('a.webp') == b'a.webp' * 10
+    assert stats.orphans_removed == 1
+    assert stats.bytes_freed == len(b'orphan.png' * 10) + len(b'orphan.64.png' * 10)
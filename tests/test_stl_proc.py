@@ -0,0 +1,73 @@
+from pathlib import Path
+
+import numpy as np
+from PIL import Image
+import pytest
+from stl.mesh import Mesh
+
+from fileexplorer.mesh import read_mesh
+from fileexplorer.stl_proc import StlProcessor, rasterize, render_mesh
+
+CUBE_VERTICES = np.array([
+    [0,0,0], [1,0,0], [1,1,0], [0,1,0], [0,0,1], [1,0,1], [1,1,1], [0,1,1],
+], dtype=np.float32)
+CUBE_FACES = [
+    [0,1,2], [0,2,3], [4,5,6], [4,6,7], [0,1,5], [0,5,4],
+    [1,2,6], [1,6,5], [2,3,7], [2,7,6], [3,0,4], [3,4,7],
+]
+
+def test_nearest_triangle_wins():
+    # Two triangles covering the whole 4x4 image, the second one nearer
+    x = np.array([[0, 10, 0], [0, 10, 0]], dtype=np.float32)
+    y = np.array([[0, 0, 10], [0, 0, 10]], dtype=np.float32)
+    for depth, expected in [([1, 0], 1), ([0, 1], 0)]:
+        depths = np.repeat(np.array(depth, dtype=np.float32)[:, None], 3, axis=1)
+        nearest = rasterize(x, y, depths, 4, 4)
+        assert (nearest == expected).all()
+
+def test_pixel_centers_outside_triangle_not_covered():
+    x = np.array([[0, 4, 0]], dtype=np.float32)
+    y = np.array([[0, 0, 4]], dtype=np.float32)
+    nearest = rasterize(x, y, np.zeros((1, 3), dtype=np.float32), 4, 4).reshape(4, 4)
+    assert nearest[0, 0] == 0
+    assert nearest[3, 3] == -1
+    # The pixel centers up to the hypotenuse, which is included
+    assert (nearest == 0).sum() == 10
+
+def test_render_cube():
+    image = render_mesh(CUBE_VERTICES[CUBE_FACES], (100, 100))
+    assert image.mode == 'RGBA'
+    assert image.size == (89, 100)
+    pixels = np.asarray(image)
+    assert pixels[0, 0, 3] == 0
+    assert pixels[50, 44, 3] == 255
+    # Three faces seen, each with its own shade
+    assert len(np.unique(pixels[pixels[:, :, 3] == 255][:, :3], axis=0)) == 3
+
+def test_make_thumbnail(tmp_path: Path):
+    mesh = Mesh(np.zeros(len(CUBE_FACES), dtype=Mesh.dtype))
+    mesh.vectors[:] = CUBE_VERTICES[CUBE_FACES]
+    mesh.save(str(tmp_path / 'cube.stl'))
+    thumbnail_filename = StlProcessor().make_thumbnail(tmp_path / 'cube.stl', tmp_path, (100, 100))
+    assert Image.open(tmp_path / thumbnail_filename).size == (89, 100)
+    with pytest.raises(FileNotFoundError):
+        StlProcessor().make_thumbnail(tmp_path / 'missing.stl', tmp_path, (100, 100))
+
+def test_make_data_file_writes_mesh_lods(tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+    mesh = Mesh(np.zeros(len(CUBE_FACES), dtype=Mesh.dtype))
+    mesh.vectors[:] = CUBE_VERTICES[CUBE_FACES]
+    mesh.save(str(tmp_path / 'cube.stl'))
+    loads = []
+    original_from_file = Mesh.from_file
+    def spy_from_file(*args, **kwargs):
+        loads.append(args)
+        return original_from_file(*args, **kwargs)
+    monkeypatch.setattr(Mesh, 'from_file', spy_from_file)
+    processor = StlProcessor()
+    processor.make_thumbnail(tmp_path / 'cube.stl', tmp_path, (100, 100))
+    data_filename = processor.make_data_file(tmp_path / 'cube.stl', tmp_path)
+    assert len(loads) == 1
+    assert (tmp_path / data_filename).resolve() == tmp_path / 'cube.stl'
+    vertices, triangles = read_mesh(tmp_path / f'{Path(data_filename).stem}.mesh')
+    assert len(vertices) == 8
+    assert len(triangles) == 12
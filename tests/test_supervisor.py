@@ -0,0 +1,47 @@
+import os
+from pathlib import Path
+import time
+
+import pytest
+
+from fileexplorer.supervisor import WorkerSupervisor
+
+def run_item(item: str) -> str:
+    if item == 'hang':
+        time.sleep(60)
+    elif item == 'crash':
+        os._exit(3)
+    elif item == 'allocate':
+        try:
+            bytearray(1 << 30)
+        except MemoryError:
+            return 'MemoryError'
+    return f'done {item}'
+
+def failed(item: str, reason: str, duration: float) -> str:
+    return f'failed {item}: {reason}'
+
+def test_hung_and_crashed_items_fail_alone():
+    batches = [['a', 'hang', 'b'], ['c', 'crash', 'd'], ['e']]
+    start = time.monotonic()
+    with WorkerSupervisor(2, run_item, failed, timeout=1.0, tasks_per_worker=2) as supervisor:
+        results = list(supervisor.imap_unordered(batches))
+        assert supervisor.restarts == 2
+    assert time.monotonic() - start < 10
+    assert sorted(results) == [
+        'done a', 'done b', 'done c', 'done d', 'done e',
+        'failed crash: worker exited with code 3',
+        'failed hang: timed out after 1 s',
+    ]
+
+def virtual_memory_size() -> int:
+    for line in Path('/proc/self/status').read_text().splitlines():
+        if line.startswith('VmSize:'):
+            return int(line.split()[1]) * 1024
+    raise RuntimeError('VmSize not found')
+
+@pytest.mark.skipif(not os.path.exists('/proc/self/status'), reason='needs /proc')
+def test_memory_limit():
+    memory_limit = virtual_memory_size() + (256 << 20)
+    with WorkerSupervisor(1, run_item, failed, memory_limit=memory_limit) as supervisor:
+        assert list(supervisor.imap_unordered([['allocate', 'a']])) == ['MemoryError', 'done a']
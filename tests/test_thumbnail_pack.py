@@ -0,0 +1,57 @@
+from pathlib import Path
+import threading
+
+import pytest
+
+from fileexplorer.thumbnail_pack import INDEX_FILENAME, ThumbnailPack
+
+def test_put_get(tmp_path: Path):
+    with ThumbnailPack(tmp_path) as pack:
+        pack.put('a.png', b'aaa')
+        pack.put('b.png', b'bb')
+        assert pack.get('a.png') == b'aaa'
+        assert pack.get('b.png') == b'bb'
+        assert pack.get('c.png') is None
+        assert 'a.png' in pack
+        assert 'c.png' not in pack
+
+def test_put_existing_name_ignored(tmp_path: Path):
+    with ThumbnailPack(tmp_path) as pack:
+        pack.put('a.png', b'aaa')
+        pack.put('a.png', b'aaa')
+        assert pack.names() == ['a.png']
+    assert (tmp_path / INDEX_FILENAME).stat().st_size == 76
+
+def test_other_pack_sees_new_thumbnails(tmp_path: Path):
+    with ThumbnailPack(tmp_path) as writer, ThumbnailPack(tmp_path) as reader:
+        writer.put('a.png', b'aaa')
+        assert reader.get('a.png') == b'aaa'
+        reader.put('b.png', b'bb')
+        writer.put('c.png', b'c')
+        assert writer.get('b.png') == b'bb'
+        assert reader.get('c.png') == b'c'
+    with ThumbnailPack(tmp_path) as pack:
+        assert sorted(pack.names()) == ['a.png', 'b.png', 'c.png']
+
+def test_name_too_long(tmp_path: Path):
+    with ThumbnailPack(tmp_path) as pack:
+        with pytest.raises(ValueError):
+            pack.put('a' * 65, b'a')
+
+def test_threads_put_concurrently(tmp_path: Path):
+    def put_thumbnails(pack: ThumbnailPack, thread: int):
+        for i in range(500):
+            pack.put(f'{thread}-{i}.png', f'{thread}-{i}'.encode() * (i % 7 + 1))
+    with ThumbnailPack(tmp_path) as pack:
+        threads = [threading.Thread(target=put_thumbnails, args=(pack, t)) for t in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    # Read back from the index on disk, not the one of the writer
+    with ThumbnailPack(tmp_path) as pack:
+        assert len(pack.names()) == 4000
+        for name in pack.names():
+            stem = name[:-len('.png')]
+            i = int(stem.split('-')[1])
+            assert pack.get(name) == stem.encode() * (i % 7 + 1)
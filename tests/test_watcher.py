@@ -0,0 +1,142 @@
+import errno
+import multiprocessing
+from pathlib import Path
+import sqlite3
+import time
+
+from PIL import Image
+import pytest
+
+from fileexplorer import inotify
+from fileexplorer.db_builder import apply_changes, build_database
+from fileexplorer.inotify import Inotify, InotifyEvent, inotify_available
+from fileexplorer.models import DatabaseWriter
+from fileexplorer.watcher import CHANGED, DELETED, EventCoalescer, InotifyWatcher, WatchEvent
+
+SUPPORTED_EXTENSIONS = ['.png', '.jpg', '.jpeg', '.gif', '.bmp', '.pdf', '.stl']
+
+# Helper functions for pytest tests
+def get_indexed_names(database_path: Path) -> set[str]:
+    conn = sqlite3.connect(database_path)
+    rows = conn.execute("SELECT file_path FROM files WHERE status = 'ready'").fetchall()
+    conn.close()
+    return {Path(row[0]).name for row in rows}
+
+def wait_for(condition, timeout: float=10.0) -> bool:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.05)
+    return False
+
+def test_coalescer_keeps_last_event_per_path(monkeypatch: pytest.MonkeyPatch):
+    now = [100.0]
+    monkeypatch.setattr(time, 'monotonic', lambda: now[0])
+    coalescer = EventCoalescer(debounce=1.0)
+    coalescer.add(WatchEvent(CHANGED, Path('a.png')))
+    coalescer.add(WatchEvent(CHANGED, Path('b.png')))
+    now[0] = 100.5
+    coalescer.add(WatchEvent(DELETED, Path('a.png')))
+    assert coalescer.pop_ready() == []
+    now[0] = 101.2
+    assert coalescer.pop_ready() == [WatchEvent(CHANGED, Path('b.png'))]
+    now[0] = 101.6
+    assert coalescer.pop_ready() == [WatchEvent(DELETED, Path('a.png'))]
+    assert len(coalescer) == 0
+
+@pytest.mark.parametrize('watch_mode', [
+    pytest.param('inotify', marks=pytest.mark.skipif(not inotify_available(), reason='inotify is not available')),
+    'poll',
+])
+def test_watcher_keeps_index_current(tmp_path: Path, watch_mode: str):
+    root_dir = tmp_path / 'root-dir'
+    (root_dir / 'subdir').mkdir(parents=True)
+    Image.new('RGB', size=(150,150), color=(255,0,0)).save(root_dir / 'subdir/existing.png')
+    database_path = tmp_path / 'files.db'
+    done_flag = multiprocessing.Event()
+    builder = multiprocessing.Process(
+        target=build_database,
+        args=(database_path.as_posix(), root_dir, tmp_path / 'resources', SUPPORTED_EXTENSIONS),
+        kwargs={
+            'done_flag': done_flag,
+            'watch': True,
+            'watch_mode': watch_mode,
+            'poll_interval': 0.1,
+            'debounce': 0.1,
+        },
+    )
+    builder.start()
+    try:
+        assert done_flag.wait(10)
+        assert get_indexed_names(database_path) == {'existing.png'}
+
+        Image.new('RGB', size=(150,150), color=(0,255,0)).save(root_dir / 'new.png')
+        (root_dir / 'new-dir').mkdir()
+        Image.new('RGB', size=(150,150), color=(0,0,255)).save(root_dir / 'new-dir/nested.png')
+        assert wait_for(lambda: get_indexed_names(database_path) == {'existing.png', 'new.png', 'nested.png'})
+
+        (root_dir / 'subdir').rename(root_dir / 'moved-dir')
+        (root_dir / 'new.png').unlink()
+        assert wait_for(lambda: get_indexed_names(database_path) == {'existing.png', 'nested.png'})
+        conn = sqlite3.connect(database_path)
+        paths = {Path(row[0]).parent.name for row in conn.execute('SELECT file_path FROM files')}
+        conn.close()
+        assert paths == {'moved-dir', 'new-dir'}
+    finally:
+        builder.terminate()
+        builder.join()
+
+@pytest.mark.skipif(not inotify_available(), reason='inotify is not available')
+def test_queue_overflow_reconciles_index(tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+    root_dir = tmp_path / 'root-dir'
+    (root_dir / 'subdir').mkdir(parents=True)
+    for name in ['kept.png', 'subdir/deleted.png']:
+        Image.new('RGB', size=(150,150), color=(255,0,0)).save(root_dir / name)
+    database_path = tmp_path / 'files.db'
+    build_database(database_path.as_posix(), root_dir, tmp_path / 'resources', SUPPORTED_EXTENSIONS)
+    assert get_indexed_names(database_path) == {'kept.png', 'deleted.png'}
+
+    watcher = InotifyWatcher(root_dir)
+    try:
+        # Changes whose events were lost
+        (root_dir / 'subdir/deleted.png').unlink()
+        (root_dir / 'new-dir').mkdir()
+        monkeypatch.setattr(
+            watcher._inotify,
+            'read_events',
+            lambda timeout: [InotifyEvent(-1, inotify.IN_Q_OVERFLOW, 0, '')],
+        )
+        events = watcher.read_events(0)
+        assert events == [WatchEvent(CHANGED, root_dir)]
+        assert root_dir / 'new-dir' in watcher._directories.values()
+    finally:
+        watcher.close()
+    with DatabaseWriter() as writer:
+        apply_changes(writer, None, events, tmp_path / 'resources', SUPPORTED_EXTENSIONS)
+    assert get_indexed_names(database_path) == {'kept.png'}
+
+@pytest.mark.skipif(not inotify_available(), reason='inotify is not available')
+def test_unwatchable_directory_polled(
+    tmp_path: Path,
+    monkeypatch: pytest.MonkeyPatch,
+    caplog: pytest.LogCaptureFixture,
+):
+    root_dir = tmp_path / 'root-dir'
+    (root_dir / 'full/nested').mkdir(parents=True)
+    add_watch = Inotify.add_watch
+    def add_watch_until_full(self, path, mask):
+        if Path(path).name == 'full':
+            raise OSError(errno.ENOSPC, 'No space left on device', str(path))
+        return add_watch(self, path, mask)
+    monkeypatch.setattr(Inotify, 'add_watch', add_watch_until_full)
+    watcher = InotifyWatcher(root_dir, poll_interval=0.1)
+    try:
+        assert 'Cannot watch' in caplog.text and 'full' in caplog.text
+        assert set(watcher._directories.values()) == {root_dir}
+        (root_dir / 'full/nested/a.png').write_bytes(b'a')
+        events = []
+        assert wait_for(lambda: events.extend(watcher.read_events(0.05)) or events)
+        assert events == [WatchEvent(CHANGED, root_dir / 'full/nested/a.png')]
+    finally:
+        watcher.close()